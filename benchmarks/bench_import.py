@@ -0,0 +1,124 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+"""
+Report per-module import cost of the plugin.
+
+Usage:
+    python benchmarks/bench_import.py --save-baseline benchmarks/baselines/import.json
+    python benchmarks/bench_import.py --baseline benchmarks/baselines/import.json
+
+Every module is imported in a fresh interpreter with `-X importtime`, after
+PIMS itself, so that only the cost added by the plugin is measured. Format
+modules are what PIMS imports at startup; vendor modules are only imported
+when a checker, parser or reader runs. When a baseline is given, modules
+whose median cumulative import time regressed by more than the tolerance
+are reported and the exit code is 1.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+PACKAGE = "pims_plugin_format_openslide"
+FORMAT_MODULES = ('bif', 'mrxs', 'ndpi', 'philips', 'scn', 'svs', 'vms')
+VENDOR_MODULES = ('bif', 'ndpi', 'philips', 'scn', 'svs', 'vms')
+PRELUDE = "import pims.formats"
+MARKER = "--- prelude imported ---"
+
+
+def import_times(module: str) -> List[Tuple[str, int, int]]:
+    """(module, self us, cumulative us) of every import done by `module`."""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c",
+         f"{PRELUDE}\nimport sys\nprint({MARKER!r}, file=sys.stderr, flush=True)"
+         f"\nimport {module}"],
+        capture_output=True, text=True, check=True
+    )
+    # Only keep imports done after the prelude.
+    lines = process.stderr.splitlines()
+    lines = lines[lines.index(MARKER) + 1:]
+    times = []
+    for line in lines:
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times.append((name.strip(), int(self_us), int(cumulative_us)))
+    return times
+
+
+def bench_module(module: str, repeat: int) -> Dict:
+    cumulative = []
+    heaviest = dict()
+    for _ in range(repeat):
+        times = import_times(module)
+        cumulative.append(sum(self_us for _, self_us, _ in times))
+        for name, self_us, _ in times:
+            heaviest[name] = min(heaviest.get(name, self_us), self_us)
+    top = sorted(heaviest.items(), key=lambda item: item[1], reverse=True)[:5]
+    return {
+        "cumulative_ms": statistics.median(cumulative) / 1000,
+        "modules": len(heaviest),
+        "heaviest": {name: us / 1000 for name, us in top},
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--baseline', type=Path, default=None)
+    parser.add_argument('--save-baseline', type=Path, default=None)
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    modules = [f"{PACKAGE}.{name}" for name in FORMAT_MODULES]
+    modules.append("; import ".join(modules))  # all formats, as at PIMS startup
+    modules += [f"{PACKAGE}.vendors.{name}" for name in VENDOR_MODULES]
+
+    results = dict()
+    for module in modules:
+        label = "all formats" if ";" in module else module
+        results[label] = bench_module(module, args.repeat)
+        stats = results[label]
+        heaviest = ", ".join(
+            f"{name} {ms:.1f}" for name, ms in list(stats["heaviest"].items())[:3]
+        )
+        print(f"{label:<48} {stats['cumulative_ms']:8.1f} ms "
+              f"({stats['modules']} modules; {heaviest})")
+
+    if args.save_baseline:
+        args.save_baseline.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = [
+            f"{label}: {stats['cumulative_ms']:.1f} ms "
+            f"(baseline {baseline[label]['cumulative_ms']:.1f} ms)"
+            for label, stats in results.items()
+            if label in baseline and stats['cumulative_ms']
+            > baseline[label]['cumulative_ms'] * (1 + args.tolerance)
+        ]
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
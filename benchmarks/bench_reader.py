@@ -0,0 +1,260 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+"""
+Benchmark OpenSlide read paths on synthetic slides.
+
+Usage:
+    python benchmarks/bench_reader.py --save-baseline benchmarks/baselines/local.json
+    python benchmarks/bench_reader.py --baseline benchmarks/baselines/local.json
+
+Results are latency percentiles per operation (ms), tile throughput at
+several thread counts (tiles/s) and peak RSS (MiB). When a baseline is given,
+operations whose median latency regressed by more than the tolerance are
+reported and the exit code is 1.
+"""
+import argparse
+import json
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+import pyvips
+from pyvips import Image as VIPSImage
+
+from pims.formats import AbstractFormat
+from pims.processing.region import Region
+from pims_plugin_format_openslide.svs import SVSFormat
+from pims_plugin_format_openslide.utils.engine import (
+    OpenslideVipsParser, OpenslideVipsReader
+)
+from synthetic import write_svs, write_tiled_tiff
+
+PERCENTILES = (50, 90, 99)
+
+
+class GenericTiffFormat(AbstractFormat):
+    """Generic tiled TIFF read by OpenSlide, for benchmarks only."""
+    parser_class = OpenslideVipsParser
+    reader_class = OpenslideVipsReader
+
+
+def _evaluate(im) -> int:
+    # Vips images are lazy: force decoding as PIMS does before encoding.
+    if im is None:
+        return 0
+    return len(im.write_to_memory())
+
+
+def measure(func: Callable, repeat: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    stats = {f"p{p}": float(np.percentile(timings, p)) for p in PERCENTILES}
+    stats["mean"] = float(np.mean(timings))
+    stats["n"] = repeat
+    return stats
+
+
+def random_tiles(format: AbstractFormat, n: int, seed: int) -> List:
+    rng = random.Random(seed)
+    tiles = []
+    for _ in range(n):
+        tier = rng.choice(format.pyramid.tiers)
+        tx = rng.randrange(-(-tier.width // tier.tile_width))
+        ty = rng.randrange(-(-tier.height // tier.tile_height))
+        tiles.append(tier.get_txty_tile(tx, ty))
+    return tiles
+
+
+def random_windows(format: AbstractFormat, n: int, size: int, seed: int):
+    rng = random.Random(seed)
+    imd = format.main_imd
+    windows = []
+    for _ in range(n):
+        width = min(imd.width, rng.choice((1, 2, 4)) * size)
+        height = min(imd.height, width)
+        left = rng.randrange(imd.width - width + 1)
+        top = rng.randrange(imd.height - height + 1)
+        windows.append(Region(top, left, width, height))
+    return windows
+
+
+def bench_slide(
+    format_cls, path: Path, repeat: int, threads: List[int], seed: int
+) -> Dict:
+    results = {}
+
+    # Cold open, without vips operation cache which would reuse the handle
+    max_operations = pyvips.cache_get_max()
+    pyvips.cache_set_max(0)
+    results["open"] = measure(
+        lambda: VIPSImage.openslideload(str(path)).get('openslide.level-count'),
+        repeat
+    )
+    pyvips.cache_set_max(max_operations)
+
+    for name in ('main_metadata', 'known_metadata', 'raw_metadata', 'pyramid'):
+        results[f"parse_{name}"] = measure(
+            lambda: getattr(format_cls(path).parser, f'parse_{name}')(), repeat
+        )
+
+    format = format_cls(path)
+    reader = format.reader
+
+    tiles = random_tiles(format, repeat, seed)
+    iter_tiles = iter(tiles)
+    results["read_tile"] = measure(
+        lambda: _evaluate(reader.read_tile(next(iter_tiles))), len(tiles)
+    )
+
+    windows = random_windows(format, repeat, 512, seed)
+    iter_windows = iter(windows)
+    results["read_window"] = measure(
+        lambda: _evaluate(reader.read_window(next(iter_windows), 512, 512)),
+        len(windows)
+    )
+
+    results["read_thumb"] = measure(
+        lambda: _evaluate(reader.read_thumb(256, 256)), repeat
+    )
+    imd = format.full_imd
+    if imd.associated_thumb.exists:
+        results["read_thumb_precomputed"] = measure(
+            lambda: _evaluate(reader.read_thumb(256, 256, precomputed=True)),
+            repeat
+        )
+    if imd.associated_label.exists:
+        results["read_label"] = measure(
+            lambda: _evaluate(reader.read_label(256, 256)), repeat
+        )
+    if imd.associated_macro.exists:
+        results["read_macro"] = measure(
+            lambda: _evaluate(reader.read_macro(256, 256)), repeat
+        )
+
+    throughput = {}
+    tiles = random_tiles(format, repeat * max(threads), seed + 1)
+    for n_threads in threads:
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            start = time.perf_counter()
+            list(executor.map(lambda t: _evaluate(reader.read_tile(t)), tiles))
+            elapsed = time.perf_counter() - start
+        throughput[str(n_threads)] = len(tiles) / elapsed
+    results["read_tile_throughput"] = throughput
+    return results
+
+
+def peak_rss_mib() -> float:
+    # ru_maxrss is in KiB on Linux, in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    regressions = []
+    for slide, operations in results["slides"].items():
+        for operation, stats in operations.items():
+            reference = baseline["slides"].get(slide, {}).get(operation)
+            if reference is None or "p50" not in stats:
+                continue
+            if stats["p50"] > reference["p50"] * (1 + tolerance):
+                regressions.append(
+                    f"{slide}/{operation}: p50 {stats['p50']:.2f} ms "
+                    f"(baseline {reference['p50']:.2f} ms)"
+                )
+    return regressions
+
+
+def report(results: Dict):
+    for slide, operations in results["slides"].items():
+        print(f"\n{slide}")
+        for operation, stats in operations.items():
+            if operation == "read_tile_throughput":
+                values = ", ".join(
+                    f"{n} threads: {v:.1f}/s" for n, v in stats.items()
+                )
+                print(f"  {operation:<26} {values}")
+            else:
+                values = "  ".join(
+                    f"p{p} {stats[f'p{p}']:8.2f}" for p in PERCENTILES
+                )
+                print(f"  {operation:<26} {values} ms")
+    print(f"\npeak RSS: {results['peak_rss_mib']:.1f} MiB")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workdir', type=Path, default=None)
+    parser.add_argument('--width', type=int, default=8192)
+    parser.add_argument('--height', type=int, default=6144)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', type=Path, default=None)
+    parser.add_argument('--save-baseline', type=Path, default=None)
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="pims-openslide-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    slides = {
+        "svs": (SVSFormat, workdir / f"bench-{args.width}x{args.height}.svs",
+                write_svs),
+        "tiled-tiff": (GenericTiffFormat,
+                       workdir / f"bench-{args.width}x{args.height}.tif",
+                       write_tiled_tiff),
+    }
+
+    results = {
+        "config": {**{k: str(v) for k, v in vars(args).items()},
+                   "python": platform.python_version(),
+                   "vips": f"{pyvips.version(0)}.{pyvips.version(1)}",
+                   "machine": platform.machine()},
+        "slides": {}
+    }
+    for name, (format_cls, path, write) in slides.items():
+        if not path.exists():
+            write(path, args.width, args.height, seed=args.seed)
+        results["slides"][name] = bench_slide(
+            format_cls, path, args.repeat, args.threads, args.seed
+        )
+    results["peak_rss_mib"] = peak_rss_mib()
+    report(results)
+
+    if args.save_baseline:
+        args.save_baseline.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
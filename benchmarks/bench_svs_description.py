@@ -0,0 +1,81 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+"""
+Benchmark Aperio image description parsing on the test corpus.
+
+Usage:
+    python benchmarks/bench_svs_description.py
+"""
+import json
+import timeit
+from pathlib import Path
+
+from tifffile import astype
+
+from pims_plugin_format_openslide.vendors.svs import (
+    APERIO_KNOWN_KEYS, parse_aperio_description, tokenize_aperio_description
+)
+
+CORPUS_PATH = Path(__file__).parent.parent / "tests" / "data" / "aperio_descriptions.json"
+
+
+def legacy_parse(description: str) -> dict:
+    """Split-based parser used before the single-pass tokenizer."""
+    result = {}
+    items = description.split('|')
+    headers = items[0].split('\n', 1)
+    key, value = headers[0].strip().rsplit(None, 1)
+    result[key.strip()] = value.strip()
+    if len(headers) == 1:
+        return result
+    result['Description'] = headers[1].strip()
+    for item in items[1:]:
+        key, value = item.split(' = ')
+        result[key.strip()] = astype(value.strip())
+    return result
+
+
+def _run_all(func, corpus):
+    failures = 0
+    for description in corpus:
+        try:
+            func(description)
+        except ValueError:
+            failures += 1
+    return failures
+
+
+def main():
+    with open(CORPUS_PATH) as f:
+        corpus = json.load(f)
+
+    candidates = {
+        "legacy (split + astype)": legacy_parse,
+        "tokenize (raw strings)": tokenize_aperio_description,
+        "parse (typed values)": parse_aperio_description,
+        "known keys fast path": lambda d: parse_aperio_description(d, APERIO_KNOWN_KEYS),
+    }
+    number = 2000
+    for name, func in candidates.items():
+        failures = _run_all(func, corpus)
+        elapsed = min(timeit.repeat(
+            lambda: _run_all(func, corpus), number=number, repeat=5
+        ))
+        per_description = elapsed / (number * len(corpus)) * 1e6
+        print(f"{name:<26} {per_description:8.2f} us/description, "
+              f"{failures}/{len(corpus)} failures")
+
+
+if __name__ == '__main__':
+    main()
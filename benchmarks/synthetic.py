@@ -0,0 +1,132 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+"""
+Deterministic synthetic slides for benchmarks.
+
+Tiles are generated on the fly so that memory usage does not depend on the
+slide size, and the same seed always gives the same file.
+"""
+from pathlib import Path
+from typing import Iterator, Tuple
+
+import numpy as np
+from pyvips import Image as VIPSImage
+from tifffile import TiffWriter
+
+APERIO_HEADER = "Aperio Image Library v12.0.15"
+
+
+def _tile_content(
+    seed: int, level: int, tx: int, ty: int, tile_size: int
+) -> np.ndarray:
+    """Smooth gradient with noise, compressible as real tissue."""
+    rng = np.random.default_rng((seed, level, tx, ty))
+    y, x = np.mgrid[0:tile_size, 0:tile_size]
+    base = np.stack([
+        128 + 100 * np.sin((x + tx * tile_size) / 97.0),
+        128 + 100 * np.cos((y + ty * tile_size) / 131.0),
+        np.full_like(x, 160 + 10 * level, dtype=np.float64),
+    ], axis=-1)
+    noise = rng.normal(0, 12, size=base.shape)
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+
+def _tiles(
+    width: int, height: int, tile_size: int, level: int, seed: int
+) -> Iterator[np.ndarray]:
+    for ty in range(-(-height // tile_size)):
+        for tx in range(-(-width // tile_size)):
+            yield _tile_content(seed, level, tx, ty, tile_size)
+
+
+def _image(width: int, height: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+
+
+def level_sizes(
+    width: int, height: int, n_levels: int, factor: int
+) -> Iterator[Tuple[int, int]]:
+    for level in range(n_levels):
+        yield max(1, width // factor ** level), max(1, height // factor ** level)
+
+
+def write_svs(
+    path: Path, width: int, height: int, tile_size: int = 240,
+    n_levels: int = 3, factor: int = 4, seed: int = 0
+) -> Path:
+    """
+    Write an Aperio-like SVS: baseline, thumbnail, reduced levels, label and
+    macro, with an Aperio image description readable by tifffile and
+    OpenSlide.
+    """
+    info = (
+        "|AppMag = 20|MPP = 0.4990|Date = 01/15/21|Time = 10:30:00"
+        "|ScanScope ID = SS1234|Filename = synthetic"
+    )
+    sizes = list(level_sizes(width, height, n_levels, factor))
+    kwargs = dict(photometric='rgb', compression='zlib', metadata=None)
+    with TiffWriter(path, bigtiff=True) as tif:
+        for level, (w, h) in enumerate(sizes):
+            description = (
+                f"{APERIO_HEADER}\n{width}x{height} [0,0 {width}x{height}] "
+                f"({tile_size}x{tile_size}) -> {w}x{h} {info}"
+            )
+            tif.write(
+                _tiles(w, h, tile_size, level, seed), shape=(h, w, 3),
+                dtype=np.uint8, tile=(tile_size, tile_size),
+                description=description, **kwargs
+            )
+            if level == 0:
+                tw, th = max(1, w // 32), max(1, h // 32)
+                tif.write(
+                    _image(tw, th, seed),
+                    description=f"{APERIO_HEADER}\n{width}x{height} -> {tw}x{th}",
+                    **kwargs
+                )
+        tif.write(
+            _image(400, 400, seed + 1), subfiletype=1,
+            description=f"{APERIO_HEADER}\nlabel 400x400", **kwargs
+        )
+        tif.write(
+            _image(1200, 400, seed + 2), subfiletype=9,
+            description=f"{APERIO_HEADER}\nmacro 1200x400", **kwargs
+        )
+    return path
+
+
+def write_tiled_tiff(
+    path: Path, width: int, height: int, tile_size: int = 256, seed: int = 0
+) -> Path:
+    """
+    Write a generic tiled pyramidal JPEG TIFF (OpenSlide generic-tiff).
+    The content is a lazy vips expression so that the slide is streamed to
+    disk.
+    """
+    xy = VIPSImage.xyz(width, height)
+    degrees = 180 / np.pi
+    image = (
+        (xy[0] * (degrees / 97.0)).sin() * 100 + 128
+    ).bandjoin([
+        (xy[1] * (degrees / 131.0)).cos() * 100 + 128,
+        VIPSImage.black(width, height) + 160
+    ])
+    noise = VIPSImage.gaussnoise(width, height, sigma=12, mean=0, seed=seed)
+    image = (image + noise).cast('uchar')
+    image.tiffsave(
+        str(path), tile=True, pyramid=True, bigtiff=True,
+        tile_width=tile_size, tile_height=tile_size,
+        compression='jpeg', Q=85
+    )
+    return path
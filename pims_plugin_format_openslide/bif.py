@@ -11,53 +11,19 @@
 #  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  * See the License for the specific language governing permissions and
 #  * limitations under the License.
-from datetime import datetime
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
 from pims.cache import cached_property
 from pims.formats import AbstractFormat
-from pims.formats.utils.abstract import CachedDataPath
-from pims.formats.utils.engines.tifffile import TifffileChecker
-from pims.formats.utils.engines.vips import cached_vips_file, get_vips_field
-from pims.formats.utils.histogram import DefaultHistogramReader
-from pims.formats.utils.structures.metadata import ImageMetadata
-from pims.utils.types import parse_datetime
-from pims_plugin_format_openslide.utils.engine import OpenslideVipsParser, OpenslideVipsReader
+from pims_plugin_format_openslide.utils.lazy import ENGINE, HISTOGRAM, LazyClass, lazy_module_getattr
 
+if TYPE_CHECKING:
+    import numpy as np
 
-class BifChecker(TifffileChecker):
-    @classmethod
-    def match(cls, pathlike: CachedDataPath) -> bool:
-        try:
-            if super().match(pathlike):
-                tf = cls.get_tifffile(pathlike)
-                return tf.is_bif
-            return False
-        except RuntimeError:
-            return False
-
-
-class BifParser(OpenslideVipsParser):
-    # TODO: parse ourselves ventana xml
-    def parse_known_metadata(self) -> ImageMetadata:
-        image = cached_vips_file(self.format)
-
-        imd = super().parse_known_metadata()
+VENDOR = 'pims_plugin_format_openslide.vendors.bif'
 
-        imd.acquisition_datetime = self.parse_acquisition_date(
-            get_vips_field(image, 'ventana.ScanDate')
-        )
-
-        imd.microscope.model = get_vips_field(image, 'ventana.ScannerModel')
-        imd.is_complete = True
-        return imd
-
-    @staticmethod
-    def parse_acquisition_date(date: str) -> Optional[datetime]:
-        # Have seen: 8/18/2014 09:44:30 | 8/30/2017 12:04:52 PM
-        return parse_datetime(
-            date, ["%m/%d/%Y %H:%M:%S", "%m/%d/%Y %H:%M:%S %p"]
-        )
+# Checker, parser, reader and helpers are defined in the vendor module.
+__getattr__ = lazy_module_getattr(__name__, VENDOR)
 
 
 class BifFormat(AbstractFormat):
@@ -71,10 +37,10 @@ class BifFormat(AbstractFormat):
     * https://github.com/ome/bioformats/blob/develop/components/formats-gpl/src/loci/formats/in/VentanaReader.java
     """
 
-    checker_class = BifChecker
-    parser_class = BifParser
-    reader_class = OpenslideVipsReader
-    histogram_reader_class = DefaultHistogramReader
+    checker_class = LazyClass(VENDOR, 'BifChecker')
+    parser_class = LazyClass(VENDOR, 'BifParser')
+    reader_class = LazyClass(ENGINE, 'OpenslideVipsReader')
+    histogram_reader_class = LazyClass(HISTOGRAM, 'DefaultHistogramReader')
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -91,3 +57,10 @@ class BifFormat(AbstractFormat):
     @cached_property
     def need_conversion(self):
         return False
+
+    @property
+    def tile_joints(self) -> Optional['np.ndarray']:
+        """Ventana tile-joint table, as a numpy structured array."""
+        from pims_plugin_format_openslide.vendors.bif import cached_ventana_metadata
+        ventana = cached_ventana_metadata(self)
+        return ventana.joints if ventana is not None else None
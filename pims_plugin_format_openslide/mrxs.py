@@ -18,8 +18,7 @@ from pims.cache import cached_property
 from pims.formats import AbstractFormat
 from pims.formats.utils.abstract import CachedDataPath
 from pims.formats.utils.checker import AbstractChecker
-from pims.formats.utils.histogram import DefaultHistogramReader
-from pims_plugin_format_openslide.utils.engine import OpenslideVipsParser, OpenslideVipsReader
+from pims_plugin_format_openslide.utils.lazy import ENGINE, HISTOGRAM, LazyClass
 
 
 def get_root_file(path: Path) -> Optional[Path]:
@@ -51,9 +50,9 @@ class MRXSFormat(AbstractFormat):
 
     """
     checker_class = MRXSChecker
-    parser_class = OpenslideVipsParser
-    reader_class = OpenslideVipsReader
-    histogram_reader_class = DefaultHistogramReader
+    parser_class = LazyClass(ENGINE, 'OpenslideVipsParser')
+    reader_class = LazyClass(ENGINE, 'OpenslideVipsReader')
+    histogram_reader_class = LazyClass(HISTOGRAM, 'DefaultHistogramReader')
 
     def __init__(self, path, *args, **kwargs):
         super().__init__(path, *args, **kwargs)
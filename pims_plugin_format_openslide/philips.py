@@ -11,54 +11,16 @@
 #  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  * See the License for the specific language governing permissions and
 #  * limitations under the License.
-from datetime import datetime
-from typing import Optional
-
 from pims.cache import cached_property
 from pims.formats import AbstractFormat
-from pims.formats.utils.abstract import CachedDataPath
-from pims.formats.utils.engines.tifffile import TifffileChecker
-from pims.formats.utils.engines.vips import cached_vips_file, get_vips_field
-from pims.formats.utils.histogram import DefaultHistogramReader
-from pims.formats.utils.structures.metadata import ImageMetadata
-from pims_plugin_format_openslide.utils.engine import OpenslideVipsParser, OpenslideVipsReader
-
-
-class PhilipsChecker(TifffileChecker):
-    @classmethod
-    def match(cls, pathlike: CachedDataPath) -> bool:
-        try:
-            if super().match(pathlike):
-                tf = cls.get_tifffile(pathlike)
-                return tf.is_philips
-            return False
-        except RuntimeError:
-            return False
-
-
-class PhilipsParser(OpenslideVipsParser):
-    # TODO: parse ourselves the philips tiff comment tag
-    def parse_known_metadata(self) -> ImageMetadata:
-        image = cached_vips_file(self.format)
-
-        imd = super().parse_known_metadata()
-
-        acquisition_date = self.parse_acquisition_date(
-            get_vips_field(image, 'philips.DICOM_ACQUISITION_DATETIME')
-        )
-        if acquisition_date:
-            imd.acquisition_datetime = acquisition_date
+from pims_plugin_format_openslide.utils.lazy import (
+    HISTOGRAM, PLANES, LazyClass, lazy_module_getattr
+)
 
-        imd.is_complete = True
-        return imd
+VENDOR = 'pims_plugin_format_openslide.vendors.philips'
 
-    @staticmethod
-    def parse_acquisition_date(date: str) -> Optional[datetime]:
-        # Have seen: 20181019105847.000000
-        try:
-            return datetime.strptime(date, "%Y%m%d%H%M%S.%f")
-        except (ValueError, TypeError):
-            return None
+# Checker, parser, reader and helpers are defined in the vendor module.
+__getattr__ = lazy_module_getattr(__name__, VENDOR)
 
 
 class PhilipsFormat(AbstractFormat):
@@ -70,10 +32,10 @@ class PhilipsFormat(AbstractFormat):
     * https://openslide.org/formats/philips/
     """
 
-    checker_class = PhilipsChecker
-    parser_class = PhilipsParser
-    reader_class = OpenslideVipsReader
-    histogram_reader_class = DefaultHistogramReader
+    checker_class = LazyClass(VENDOR, 'PhilipsChecker')
+    parser_class = LazyClass(VENDOR, 'PhilipsParser')
+    reader_class = LazyClass(PLANES, 'ZStackReader')
+    histogram_reader_class = LazyClass(HISTOGRAM, 'DefaultHistogramReader')
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -12,46 +12,22 @@
 #  * See the License for the specific language governing permissions and
 #  * limitations under the License.
 from pims.cache import cached_property
-
 from pims.formats import AbstractFormat
-from pims.formats.utils.abstract import CachedDataPath
-from pims.formats.utils.engines.tifffile import TifffileChecker
-from pims.formats.utils.engines.vips import cached_vips_file, get_vips_field
-from pims.formats.utils.histogram import DefaultHistogramReader
-from pims.formats.utils.structures.metadata import ImageMetadata
-from pims.utils.types import parse_datetime
-from pims_plugin_format_openslide.utils.engine import OpenslideVipsParser, OpenslideVipsReader
-
-
-class SCNChecker(TifffileChecker):
-    @classmethod
-    def match(cls, pathlike: CachedDataPath) -> bool:
-        try:
-            if super().match(pathlike):
-                tf = cls.get_tifffile(pathlike)
-                return tf.is_scn
-            return False
-        except RuntimeError:
-            return False
-
+from pims_plugin_format_openslide.utils.lazy import HISTOGRAM, LazyClass, lazy_module_getattr
 
-class SCNParser(OpenslideVipsParser):
-    def parse_known_metadata(self) -> ImageMetadata:
-        image = cached_vips_file(self.format)
+VENDOR = 'pims_plugin_format_openslide.vendors.scn'
 
-        imd = super().parse_known_metadata()
-        imd.acquisition_datetime = parse_datetime(
-            get_vips_field(image, 'leica.creation-date')
-        )
-        imd.microscope.model = get_vips_field(image, 'leica.device-model')
-        imd.is_complete = True
-        return imd
+# Checker, parser, reader and helpers are defined in the vendor module.
+__getattr__ = lazy_module_getattr(__name__, VENDOR)
 
 
 class SCNFormat(AbstractFormat):
     """
     Leica SCN format.
-    Only support brightfield, no support for fluorescence.
+    Scanned regions are indexed: reads in gaps between regions return
+    blank data and reads inside a region use its own pyramid.
+    Fluorescence slides, which OpenSlide does not support, are read with
+    tifffile: only requested channels are decoded, at native bit depth.
 
     References
     ----------
@@ -60,10 +36,10 @@ class SCNFormat(AbstractFormat):
     * https://docs.openmicroscopy.org/bio-formats/6.5.1/formats/leica-scn.html
     """
 
-    checker_class = SCNChecker
-    parser_class = SCNParser
-    reader_class = OpenslideVipsReader
-    histogram_reader_class = DefaultHistogramReader
+    checker_class = LazyClass(VENDOR, 'SCNChecker')
+    parser_class = LazyClass(VENDOR, 'SCNParser')
+    reader_class = LazyClass(VENDOR, 'SCNReader')
+    histogram_reader_class = LazyClass(HISTOGRAM, 'DefaultHistogramReader')
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
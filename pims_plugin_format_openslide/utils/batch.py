@@ -0,0 +1,132 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+"""
+Planning of batch extractions (many regions or annotations of one slide).
+
+Extractions are located in the pyramid, sorted spatially by tier and
+native tile, and processed in chunks: native tiles needed by a chunk are
+decoded once, and dropped once no remaining extraction needs them, so
+that the work scales with the number of unique tiles.
+"""
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from pims_plugin_format_openslide.utils.geometry import (
+    covered_tiles, geometry_bounds, rasterize
+)
+from pims_plugin_format_openslide.utils.pyramid import CompactPyramid
+from pims_plugin_format_openslide.utils.tilegrid import Window, clip_window, native_tiles
+
+Tile = Tuple[int, int, int]  # level, column, row
+
+
+@dataclass
+class Extraction:
+    index: int
+    bounds: Window  # full resolution
+    out_width: int
+    out_height: int
+    level: int = 0
+    window: Window = (0, 0, 0, 0)  # at level
+    geometry: Any = None  # None for rectangular regions
+    mask: Optional[np.ndarray] = None  # coverage at level
+    tiles: Tuple[Tile, ...] = ()
+
+    @property
+    def sort_key(self) -> Tuple[int, int, int]:
+        return min((level, row, col) for level, col, row in self.tiles)
+
+
+def region_bounds(region) -> Window:
+    """Full resolution window of a PIMS region (or a window tuple)."""
+    if isinstance(region, tuple):
+        return region
+    downsample = getattr(region, 'downsample', 1)
+    return (
+        int(round(region.left * downsample)), int(round(region.top * downsample)),
+        int(round(region.width * downsample)), int(round(region.height * downsample))
+    )
+
+
+def plan_extractions(
+    requests: Iterable[Tuple[Any, int, int]], pyramid: CompactPyramid,
+    tile_size
+) -> List[Extraction]:
+    """
+    Locate extraction requests, given as (region or geometry, output
+    width, output height), and sort them spatially. Regions are PIMS
+    regions or full resolution (left, top, width, height) tuples,
+    geometries are described in `utils.geometry`. `tile_size(level)` gives
+    the native tile size of a level.
+    """
+    width, height = int(pyramid.widths[0]), int(pyramid.heights[0])
+    extractions = []
+    for index, (item, out_width, out_height) in enumerate(requests):
+        is_region = isinstance(item, tuple) or hasattr(item, 'left')
+        bounds = region_bounds(item) if is_region else geometry_bounds(item)
+        extraction = Extraction(
+            index, clip_window(bounds, width, height), out_width, out_height,
+            geometry=None if is_region else item
+        )
+        extraction.level, extraction.window = pyramid.locate(
+            *extraction.bounds, out_width, out_height
+        )
+
+        tile_width, tile_height = tile_size(extraction.level)
+        if is_region:
+            cols, rows = native_tiles(extraction.window, tile_width, tile_height)
+            tiles = [(col, row) for row in rows for col in cols]
+        else:
+            _, _, w, h = extraction.window
+            extraction.mask = rasterize(item, extraction.bounds, w, h)
+            tiles = covered_tiles(
+                extraction.mask, extraction.window, tile_width, tile_height
+            )
+        extraction.tiles = tuple((extraction.level, col, row) for col, row in tiles)
+        extractions.append(extraction)
+
+    # Extractions without tiles (geometries between tiles) go first.
+    return sorted(
+        extractions,
+        key=lambda e: e.sort_key if e.tiles else (-1, 0, 0)
+    )
+
+
+def chunks(
+    extractions: List[Extraction], chunk_size: int
+) -> Iterator[Tuple[List[Extraction], List[Tile], List[Tile]]]:
+    """
+    Split sorted extractions in chunks, with the tiles to decode before a
+    chunk and the tiles no longer needed after it.
+    """
+    remaining = Counter(tile for e in extractions for tile in e.tiles)
+    decoded = set()
+    for start in range(0, len(extractions), chunk_size):
+        chunk = extractions[start:start + chunk_size]
+        needed = list(dict.fromkeys(
+            tile for e in chunk for tile in e.tiles if tile not in decoded
+        ))
+        decoded.update(needed)
+
+        released = []
+        for e in chunk:
+            for tile in e.tiles:
+                remaining[tile] -= 1
+                if remaining[tile] == 0:
+                    released.append(tile)
+        decoded.difference_update(released)
+        yield chunk, needed, released
@@ -0,0 +1,135 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from pyvips import Image as VIPSImage
+
+from pims_plugin_format_openslide.utils.channels import VIPS_FORMATS
+from pims_plugin_format_openslide.utils.config import get_settings
+from pims_plugin_format_openslide.utils.memory import get_memory_governor
+
+
+class BufferPool:
+    """
+    Pool of preallocated arrays, reused across reads of the same shape and
+    dtype. Released buffers beyond `max_bytes` are dropped.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._free: Dict[Tuple[Tuple[int, ...], str], List[np.ndarray]] = \
+            defaultdict(list)
+        self._free_bytes = 0
+        self.governor = None
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return self._free_bytes
+
+    def acquire(self, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        key = (tuple(shape), np.dtype(dtype).name)
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                buffer = free.pop()
+                self._free_bytes -= buffer.nbytes
+                return buffer
+        return np.empty(key[0], dtype=dtype)
+
+    def release(self, buffer: np.ndarray):
+        if not buffer.flags.c_contiguous or buffer.base is not None:
+            return
+        with self._lock:
+            if self._free_bytes + buffer.nbytes > self.max_bytes:
+                return
+            self._free[(buffer.shape, buffer.dtype.name)].append(buffer)
+            self._free_bytes += buffer.nbytes
+        if self.governor is not None:
+            self.governor.enforce()
+
+    def trim(self, nbytes: int) -> int:
+        """Drop free buffers until `nbytes` are freed, return freed bytes."""
+        freed = 0
+        with self._lock:
+            for key in list(self._free):
+                free = self._free[key]
+                while free and freed < nbytes:
+                    freed += free.pop().nbytes
+                if not free:
+                    del self._free[key]
+                if freed >= nbytes:
+                    break
+            self._free_bytes -= freed
+        return freed
+
+    def clear(self):
+        with self._lock:
+            self._free.clear()
+            self._free_bytes = 0
+
+    @contextmanager
+    def borrow(self, shape: Tuple[int, ...], dtype=np.uint8):
+        buffer = self.acquire(shape, dtype)
+        try:
+            yield buffer
+        finally:
+            self.release(buffer)
+
+
+_pool: Optional[BufferPool] = None
+
+
+def get_buffer_pool() -> BufferPool:
+    global _pool
+    if _pool is None:
+        _pool = BufferPool(get_settings().buffer_pool_max_bytes)
+        get_memory_governor().register('buffer_pool', _pool)
+    return _pool
+
+
+def resize_to(im: VIPSImage, width: int, height: int) -> VIPSImage:
+    """Resize a vips image to an exact size."""
+    if (im.width, im.height) != (width, height):
+        im = im.resize(width / im.width, vscale=height / im.height)
+        # Rounding in resize may give a 1-pixel difference.
+        if (im.width, im.height) != (width, height):
+            im = im.gravity('north-west', width, height, extend='copy')
+    return im
+
+
+def write_into(im: VIPSImage, out: np.ndarray) -> np.ndarray:
+    """
+    Decode a vips image directly into a (height, width, bands) C-contiguous
+    array, without intermediate copy. The image is resized to the array
+    size and cast to the array dtype if needed.
+    """
+    band_format = VIPS_FORMATS.get(out.dtype.name)
+    if band_format is None or not out.flags.c_contiguous or out.ndim != 3:
+        raise ValueError("Output must be a C-contiguous HWC array of a vips pixel type")
+    height, width, bands = out.shape
+    if bands != im.bands:
+        raise ValueError(f"Output has {bands} channels, image has {im.bands}")
+
+    im = resize_to(im, width, height)
+    if im.format != band_format:
+        im = im.cast(band_format)
+
+    target = VIPSImage.new_from_memory(out.data, width, height, bands, band_format)
+    im.write(target)
+    return out
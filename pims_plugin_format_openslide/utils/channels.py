@@ -0,0 +1,144 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+from pyvips import Image as VIPSImage
+
+ChannelSpec = Optional[Union[int, str, Sequence[Union[int, str]]]]
+
+# NumPy dtype of vips band formats, and the reverse
+VIPS_DTYPES = {
+    'uchar': np.uint8, 'char': np.int8, 'ushort': np.uint16, 'short': np.int16,
+    'uint': np.uint32, 'int': np.int32, 'float': np.float32, 'double': np.float64
+}
+VIPS_FORMATS = {np.dtype(dtype).name: name for name, dtype in VIPS_DTYPES.items()}
+
+# Stain vectors (optical density of R, G, B) from Ruifrok & Johnston,
+# Quantification of histochemical staining by color deconvolution, 2001.
+HEMATOXYLIN = (0.650, 0.704, 0.286)
+EOSIN = (0.072, 0.990, 0.105)
+DAB = (0.268, 0.570, 0.776)
+
+
+def _stain_matrix(first, second) -> np.ndarray:
+    stains = np.array([first, second], dtype=np.float64)
+    stains /= np.linalg.norm(stains, axis=1, keepdims=True)
+    residual = np.cross(stains[0], stains[1])
+    residual /= np.linalg.norm(residual)
+    return np.vstack([stains, residual])
+
+
+# Rows: stains, columns: R, G, B.
+STAIN_MATRICES = {
+    'HE': _stain_matrix(HEMATOXYLIN, EOSIN),
+    'HDAB': _stain_matrix(HEMATOXYLIN, DAB),
+}
+
+STAIN_CHANNELS = {
+    'hematoxylin': ('HE', 0),
+    'eosin': ('HE', 1),
+    'dab': ('HDAB', 1),
+}
+
+# Optical density of every 8-bit intensity, so that deconvolution is a
+# table lookup and a matrix product.
+_OD_LUT = -np.log10(np.maximum(np.arange(256), 1) / 255).astype(np.float32)
+
+
+def is_stain_request(c: ChannelSpec) -> bool:
+    if isinstance(c, str):
+        return True
+    return isinstance(c, (list, tuple)) and any(isinstance(i, str) for i in c)
+
+
+def channel_list(c: ChannelSpec, n_channels: int) -> List[int]:
+    if c is None:
+        return list(range(n_channels))
+    if isinstance(c, int):
+        return [c]
+    return list(c)
+
+
+def to_numpy(im: VIPSImage) -> np.ndarray:
+    """Decode a vips image to a (height, width, bands) array."""
+    return np.ndarray(
+        buffer=im.write_to_memory(), dtype=VIPS_DTYPES[im.format],
+        shape=(im.height, im.width, im.bands)
+    )
+
+
+def flatten_array(
+    array: np.ndarray, channels: Optional[List[int]] = None
+) -> np.ndarray:
+    """
+    Flatten the alpha channel (last band) of an array on black, as vips
+    does, for requested channels only. When the area is fully opaque, the
+    result is a view of the input array.
+    """
+    if channels is None:
+        channels = list(range(array.shape[2] - 1))
+    alpha = array[..., -1]
+    if alpha.min() == 255:
+        if len(channels) == 1:
+            return array[..., channels[0]:channels[0] + 1]
+        if channels == list(range(channels[0], channels[-1] + 1)):
+            return array[..., channels[0]:channels[-1] + 1]
+        return array[..., channels]
+
+    weights = alpha.astype(np.uint16)[..., np.newaxis]
+    flat = array[..., channels].astype(np.uint16)
+    flat *= weights
+    flat += 127
+    flat //= 255
+    return flat.astype(np.uint8)
+
+
+def deconvolve(rgb: np.ndarray, stains: str = 'HE') -> np.ndarray:
+    """
+    Colour deconvolution of a (height, width, 3) uint8 RGB array into stain
+    concentrations (optical densities), as a float32 (height, width, 3)
+    array whose last channel is the residual.
+    """
+    matrix = np.linalg.inv(STAIN_MATRICES[stains]).astype(np.float32)
+    od = _OD_LUT[rgb]
+    concentrations = od.reshape(-1, 3) @ matrix
+    np.maximum(concentrations, 0, out=concentrations)
+    return concentrations.reshape(rgb.shape)
+
+
+def stain_channels(rgb: np.ndarray, c: ChannelSpec) -> np.ndarray:
+    """
+    Get stain concentrations for requested stains names (see
+    `STAIN_CHANNELS`), as a float32 (height, width, n_stains) array.
+    """
+    names = [c] if isinstance(c, str) else list(c)
+    try:
+        requested = [STAIN_CHANNELS[name.lower()] for name in names]
+    except (KeyError, AttributeError):
+        raise ValueError(
+            f"Unknown stains {names}, expected one of {list(STAIN_CHANNELS)}"
+        )
+
+    deconvolved = {
+        stains: deconvolve(rgb, stains)
+        for stains in {stains for stains, _ in requested}
+    }
+    if len(requested) == 1:
+        stains, index = requested[0]
+        return deconvolved[stains][..., index:index + 1]
+    return np.stack(
+        [deconvolved[stains][..., index] for stains, index in requested],
+        axis=-1
+    )
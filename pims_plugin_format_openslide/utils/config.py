@@ -0,0 +1,94 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+import os
+from functools import lru_cache
+from typing import Optional
+
+from pydantic import BaseSettings
+
+
+class Settings(BaseSettings):
+    """
+    Plugin settings. Every setting can be given as environment variable or
+    in the PIMS configuration file, prefixed by `OPENSLIDE_`.
+    """
+
+    # Build missing intermediate levels of sparse pyramids in a sidecar file
+    sparse_pyramid_sidecar: bool = False
+    # Maximum downsample ratio between two consecutive stored levels
+    sparse_pyramid_max_gap: float = 4.0
+    sidecar_workers: int = 1
+    sidecar_tile_size: int = 256
+    sidecar_quality: int = 90
+
+    # Formats converted in background to tiled pyramidal TIFF, as
+    # comma-separated identifiers (e.g. "NDPI,VMS,MRXS"), none if empty
+    conversion_formats: Optional[str] = None
+    conversion_tile_size: int = 256
+    conversion_quality: int = 90
+
+    # Process-wide OpenSlide handles and parsed metadata (entries)
+    handle_pool_size: int = 64
+    parsed_cache_size: int = 1024
+    # Decoded native tiles reused by tile-grid (DZI, IIIF) reads
+    decoded_tile_cache_bytes: int = 128 * 1024 * 1024
+
+    # Persistent encoded tile cache, shared by workers (disabled if no dir)
+    disk_cache_dir: Optional[str] = None
+    disk_cache_max_bytes: int = 32 * 1024 * 1024 * 1024
+
+    # Worker warm-up: file listing slides (one path per line) and/or access
+    # log from which most requested slides are taken (paths relative to root)
+    warmup_slides: Optional[str] = None
+    warmup_access_log: Optional[str] = None
+    warmup_root: Optional[str] = None
+    warmup_max_slides: int = 100
+    warmup_time_budget: float = 60.0
+    warmup_memory_budget: Optional[int] = None
+    warmup_workers: int = 4
+    warmup_overview_size: int = 1024
+
+    # Threads decoding native tiles of annotation and batch reads
+    read_workers: int = 4
+
+    # Streaming exports (see `OpenslideVipsReader.export_window`)
+    export_tile_size: int = 512
+    export_quality: int = 90
+
+    # Open JPEG files kept by the VMS reader
+    vms_file_handles: int = 32
+
+    # Memory kept by the pool of reusable NumPy output buffers
+    buffer_pool_max_bytes: int = 256 * 1024 * 1024
+
+    # Budget shared by handles, decoded tiles and buffers (unbounded if None)
+    memory_budget_bytes: Optional[int] = None
+    # Memory charged per OpenSlide handle, for its internal tile cache
+    openslide_handle_cache_bytes: int = 32 * 1024 * 1024
+    # libvips operation cache limit (libvips default if None)
+    vips_cache_max_mem: Optional[int] = None
+
+    # Instrumentation sink: None (disabled), 'log', 'prometheus' or 'memory'
+    instrumentation: Optional[str] = None
+
+    class Config:
+        env_prefix = 'OPENSLIDE_'
+        env_file = "pims-config.env"
+        env_file_encoding = 'utf-8'
+
+
+@lru_cache()
+def get_settings() -> Settings:
+    env_file = os.getenv('CONFIG_FILE', 'pims-config.env')
+    return Settings(_env_file=env_file)
@@ -0,0 +1,112 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+"""
+Background conversion of slides in slow formats to tiled pyramidal TIFF.
+
+Some layouts are slow for random access (NDPI single-strip levels, VMS JPEG
+mosaics, MRXS with many small fragments). Slides of formats listed in the
+conversion policy are transcoded once, in background, into a tiled
+pyramidal TIFF next to the slide, built like sidecar pyramids. Reads are
+served from the original slide until the converted copy is ready, then
+from the converted copy.
+
+The converted copy is renamed into place only when complete, and the
+parsed pyramid of the slide is dropped at that moment: reads that started
+with the original pyramid finish on the original slide, next reads use
+the converted copy. Converted tiers are sidecar tiers, so decoded and
+encoded tile caches never mix tiles of both.
+"""
+import logging
+from functools import partial
+from pathlib import Path
+from typing import Set, Tuple
+
+from pyvips import Error as VIPSError, Image as VIPSImage
+
+from pims.formats import AbstractFormat
+from pims.formats.utils.structures.pyramid import Pyramid
+from pims_plugin_format_openslide.utils.config import get_settings
+from pims_plugin_format_openslide.utils.sidecar import schedule_build, write_pyramid
+
+log = logging.getLogger("pims.app")
+
+
+def converted_path(path: Path) -> Path:
+    """Path of the converted copy of a slide."""
+    path = Path(path)
+    return path.with_name(f".{path.name}.converted.tif")
+
+
+def conversion_formats() -> Set[str]:
+    """Identifiers of formats to convert, from the conversion policy."""
+    formats = get_settings().conversion_formats or ''
+    return {name.strip().upper() for name in formats.split(',') if name.strip()}
+
+
+def is_converted(path: Path, dest: Path) -> bool:
+    """Whether a converted copy exists and is newer than the slide."""
+    try:
+        return dest.stat().st_mtime_ns >= Path(path).stat().st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def build_conversion(path: str, dest: Path):
+    settings = get_settings()
+    source = VIPSImage.openslideload(path)
+    if source.hasalpha():
+        source = source.flatten()
+    write_pyramid(
+        source, dest, settings.conversion_tile_size, settings.conversion_quality
+    )
+
+
+def _base_size(pyramid: Pyramid) -> Tuple[int, int]:
+    base = max(pyramid.tiers, key=lambda tier: tier.width)
+    return base.width, base.height
+
+
+def apply_conversion(format: AbstractFormat, pyramid: Pyramid) -> Pyramid:
+    """
+    Pyramid of the converted copy of a slide, if it is ready. Otherwise, the
+    given pyramid, and conversion is scheduled if the policy requires it.
+    """
+    if format.get_identifier().upper() not in conversion_formats():
+        return pyramid
+
+    dest = converted_path(format.path)
+    if not is_converted(format.path, dest):
+        schedule_build(
+            format.path, dest, partial(build_conversion, str(format.path), dest),
+            "Converted copy"
+        )
+        return pyramid
+
+    tile_size = get_settings().conversion_tile_size
+    converted = Pyramid()
+    try:
+        n_pages = VIPSImage.tiffload(str(dest)).get('n-pages')
+        for page in range(n_pages):
+            head = VIPSImage.tiffload(str(dest), page=page)
+            converted.insert_tier(
+                head.width, head.height, (tile_size, tile_size),
+                sidecar_path=str(dest), sidecar_page=page
+            )
+    except VIPSError as e:
+        log.warning(f"Converted copy {dest} is unreadable: {e}")
+        return pyramid
+    if _base_size(converted) != _base_size(pyramid):
+        log.warning(f"Converted copy {dest} does not match the slide size")
+        return pyramid
+    return converted
@@ -0,0 +1,170 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+"""
+Persistent cache of tiles (decoded or encoded), shared by worker processes.
+
+Entries are files named after the hash of their key (content-addressed),
+written atomically (temporary file and rename) so that readers never see
+partial tiles. Least recently used entries are evicted when the cache
+exceeds its size; hits refresh the entry modification time. Eviction is
+done by one process at a time, under an advisory lock.
+"""
+import fcntl
+import hashlib
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Hashable, Optional
+
+from pims_plugin_format_openslide.utils.config import get_settings
+from pims_plugin_format_openslide.utils.instrumentation import record_cache
+
+log = logging.getLogger("pims.app")
+
+HEADER_HASH_SIZE = 64 * 1024
+
+
+def slide_fingerprint(path) -> str:
+    """
+    Fingerprint of a slide from its size, modification time and a hash of
+    its header, so that a re-uploaded slide never matches old entries.
+    """
+    path = Path(path)
+    digest = hashlib.sha1()
+    if path.is_dir():
+        stat = path.stat()
+        digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return digest.hexdigest()
+
+    stat = path.stat()
+    digest.update(f"{stat.st_size}:{stat.st_mtime_ns}:".encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(HEADER_HASH_SIZE))
+    return digest.hexdigest()
+
+
+class DiskTileCache:
+    # Fraction of the size to free when the cache is full, to not evict on
+    # every write.
+    EVICTION_HEADROOM = 0.1
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._written = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: Hashable, extension: str) -> Path:
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return self.directory / digest[:2] / f"{digest}.{extension}"
+
+    def get(self, key: Hashable, extension: str) -> Optional[bytes]:
+        path = self._path(key, extension)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            record_cache('disk_tile_cache', hit=False)
+            return None
+        except OSError as e:
+            log.warning(f"Disk tile cache entry {path} is unreadable: {e}")
+            return None
+        record_cache('disk_tile_cache', hit=True)
+        return data
+
+    def put(self, key: Hashable, extension: str, data: bytes):
+        path = self._path(key, extension)
+        path.parent.mkdir(exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            log.warning(f"Disk tile cache entry {path} could not be written: {e}")
+            tmp.unlink(missing_ok=True)
+            return
+
+        with self._lock:
+            self._written += len(data)
+            # Scan the cache only after writing a fraction of its size.
+            must_evict = self._written > self.max_bytes * self.EVICTION_HEADROOM
+            if must_evict:
+                self._written = 0
+        if must_evict:
+            self.evict()
+
+    def size(self) -> int:
+        return sum(
+            entry.stat().st_size for entry in self.directory.glob('*/*')
+            if not entry.name.startswith('.')
+        )
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits."""
+        with open(self.directory / '.lock', 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # Another process is evicting.
+
+            entries = []
+            total = 0
+            for entry in self.directory.glob('*/*'):
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry))
+                total += stat.st_size
+            if total <= self.max_bytes:
+                return
+
+            target = self.max_bytes * (1 - self.EVICTION_HEADROOM)
+            for _, size, entry in sorted(entries, key=lambda e: e[0]):
+                if total <= target:
+                    break
+                try:
+                    entry.unlink()
+                    total -= size
+                except FileNotFoundError:
+                    pass
+
+    def clear(self):
+        for entry in self.directory.glob('*/*'):
+            entry.unlink(missing_ok=True)
+
+
+_cache: Optional[DiskTileCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_disk_tile_cache() -> Optional[DiskTileCache]:
+    """Disk tile cache, or None if it is disabled."""
+    global _cache
+    settings = get_settings()
+    if not settings.disk_cache_dir:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DiskTileCache(
+                    settings.disk_cache_dir, settings.disk_cache_max_bytes
+                )
+    return _cache
@@ -11,8 +11,12 @@
 #  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  * See the License for the specific language governing permissions and
 #  * limitations under the License.
-from typing import List, Optional, Union
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
+import numpy as np
 from pyvips import Image as VIPSImage
 
 from pims.formats import AbstractFormat
@@ -21,15 +25,82 @@ from pims.formats.utils.structures.metadata import ImageMetadata, MetadataStore
 from pims.formats.utils.structures.pyramid import Pyramid
 from pims.utils import UNIT_REGISTRY
 from pims.utils.types import parse_float, parse_int
+from pims_plugin_format_openslide.utils.batch import (
+    Extraction, Tile, chunks, plan_extractions
+)
+from pims_plugin_format_openslide.utils.buffers import get_buffer_pool, write_into
+from pims_plugin_format_openslide.utils.channels import (
+    VIPS_DTYPES, ChannelSpec, channel_list, flatten_array, is_stain_request, stain_channels,
+    to_numpy
+)
+from pims_plugin_format_openslide.utils.config import get_settings
+from pims_plugin_format_openslide.utils.conversion import apply_conversion
+from pims_plugin_format_openslide.utils.diskcache import get_disk_tile_cache, slide_fingerprint
+from pims_plugin_format_openslide.utils.export import ProgressCallback, StripWriter
+from pims_plugin_format_openslide.utils.geometry import rasterize
+from pims_plugin_format_openslide.utils.handles import (
+    fingerprint, get_handle_pool, get_tile_cache, shared_parsing
+)
+from pims_plugin_format_openslide.utils.instrumentation import (
+    count, is_enabled, timed, timed_method
+)
+from pims_plugin_format_openslide.utils.metadata import LazyMetadataStore
+from pims_plugin_format_openslide.utils.pyramid import cached_compact_pyramid
+from pims_plugin_format_openslide.utils.sidecar import add_sidecar_tiers
+from pims_plugin_format_openslide.utils.tiff import to_vips
+from pims_plugin_format_openslide.utils.tilegrid import (
+    DeepZoomGrid, Window, native_tiles, parse_iiif_region, parse_iiif_size
+)
 
+MAX_NATIVE_TILE_SIZE = 1024
+ENCODED_FORMATS = {'jpeg': 'jpg', 'webp': 'webp', 'png': 'png'}
 
-def cached_vips_openslide_file(format: AbstractFormat) -> VIPSImage:
+
+def cached_vips_openslide_file(
+    format: AbstractFormat, level: Optional[int] = None,
+    associated: Optional[str] = None
+) -> VIPSImage:
+    """
+    OpenSlide handle (of the slide, a level or an associated image) from
+    the process-wide handle pool, also cached on the format instance.
+    """
+    key = '_vipsos'
+    if level is not None:
+        key += f'_level{level}'
+    if associated is not None:
+        key += f'_{associated}'
     return format.get_cached(
-        '_vipsos', VIPSImage.openslideload, str(format.path)
+        key, get_handle_pool().openslide, str(format.path), level, associated
     )
 
 
+def _vips_fields_with_prefix(image: VIPSImage, prefix: str) -> List[str]:
+    return [
+        key.split('.', 1)[1] for key in image.get_fields()
+        if key.startswith(prefix + '.')
+    ]
+
+
+def _get_prefixed_vips_field(image: VIPSImage, prefix: str, key: str):
+    return get_vips_field(image, f"{prefix}.{key}")
+
+
+def flatten(im: VIPSImage, channels: Optional[List[int]] = None) -> VIPSImage:
+    """
+    Flatten alpha channel, if any. When channels are given, only these
+    channels are flattened and returned.
+    """
+    # Openslide gives image with alpha channel, sidecar pyramids do not.
+    if not im.hasalpha():
+        return im if channels is None else im[channels]
+    if channels is None:
+        return im.flatten()
+    return im[channels + [im.bands - 1]].flatten()
+
+
+@shared_parsing
 class OpenslideVipsParser(VipsParser):
+    @timed_method('parse_main_metadata')
     def parse_main_metadata(self) -> ImageMetadata:
         imd = super().parse_main_metadata()
 
@@ -39,6 +110,15 @@ class OpenslideVipsParser(VipsParser):
 
         return imd
 
+    def _parse_vips_known_metadata(self) -> ImageMetadata:
+        """
+        Known metadata of the plain vips parser, without reading OpenSlide
+        properties nor opening associated images. For vendor parsers which
+        get known metadata from their own (faster) parsing.
+        """
+        return super().parse_known_metadata()
+
+    @timed_method('parse_known_metadata')
     def parse_known_metadata(self) -> ImageMetadata:
         image = cached_vips_openslide_file(self.format)
 
@@ -56,8 +136,8 @@ class OpenslideVipsParser(VipsParser):
 
         for associated in ('macro', 'thumbnail', 'label'):
             if associated in get_vips_field(image, 'slide-associated-images', []):
-                head = VIPSImage.openslideload(
-                    str(self.format.path), associated=associated
+                head = cached_vips_openslide_file(
+                    self.format, associated=associated
                 )
                 imd_associated = getattr(imd, f'associated_{associated[:5]}')
                 imd_associated.width = head.width
@@ -70,15 +150,22 @@ class OpenslideVipsParser(VipsParser):
                 imd_associated.n_channels = n_channels
         return imd
 
+    @timed_method('parse_raw_metadata')
     def parse_raw_metadata(self) -> MetadataStore:
         image = cached_vips_openslide_file(self.format)
 
-        store = super().parse_raw_metadata()
-        for key in image.get_fields():
-            if '.' in key:
-                store.set(key, get_vips_field(image, key))
+        store = LazyMetadataStore.from_store(super().parse_raw_metadata())
+        prefixes = {key.split('.', 1)[0] for key in image.get_fields() if '.' in key}
+        for prefix in prefixes:
+            store.set_lazy(
+                prefix,
+                partial(_vips_fields_with_prefix, image, prefix),
+                partial(_get_prefixed_vips_field, image, prefix),
+                prefix=prefix
+            )
         return store
 
+    @timed_method('parse_pyramid')
     def parse_pyramid(self) -> Pyramid:
         image = cached_vips_openslide_file(self.format)
 
@@ -87,6 +174,7 @@ class OpenslideVipsParser(VipsParser):
         if n_levels is None:
             return super(OpenslideVipsParser, self).parse_pyramid()
 
+        stored = []
         for level in range(n_levels):
             prefix = f'openslide.level[{level}].'
             width = parse_int(get_vips_field(image, prefix + 'width'))
@@ -94,13 +182,359 @@ class OpenslideVipsParser(VipsParser):
             pyramid.insert_tier(
                 width, height,
                 (parse_int(get_vips_field(image, prefix + 'tile-width', width)),
-                 parse_int(get_vips_field(image, prefix + 'tile-height', height)))
+                 parse_int(get_vips_field(image, prefix + 'tile-height', height))),
+                openslide_level=level
             )
+            stored.append((width, height))
+
+        return apply_conversion(
+            self.format, add_sidecar_tiers(self.format, pyramid, stored)
+        )
+
+
+def _native_tile_size(pyramid, level: int) -> Tuple[int, int]:
+    # Levels without tiles (stripped) are read by blocks of reasonable size.
+    tile_width = int(pyramid.tile_widths[level])
+    tile_height = int(pyramid.tile_heights[level])
+    if tile_width > MAX_NATIVE_TILE_SIZE or tile_height > MAX_NATIVE_TILE_SIZE:
+        return MAX_NATIVE_TILE_SIZE, MAX_NATIVE_TILE_SIZE
+    return tile_width, tile_height
+
+
+def _paste(
+    out: np.ndarray, window: Window, tile: np.ndarray, tile_left: int,
+    tile_top: int
+):
+    """Copy the part of a native tile overlapping a tier window."""
+    x, y, w, h = window
+    x0, y0 = max(x, tile_left), max(y, tile_top)
+    x1 = min(x + w, tile_left + tile.shape[1])
+    y1 = min(y + h, tile_top + tile.shape[0])
+    out[y0 - y:y1 - y, x0 - x:x1 - x] = \
+        tile[y0 - tile_top:y1 - tile_top, x0 - tile_left:x1 - tile_left]
+
+
+def _decode(im: VIPSImage) -> np.ndarray:
+    """Produce the pixels of a (lazy) vips image."""
+    with timed('decode'):
+        array = to_numpy(im)
+    if is_enabled():
+        count('decoded_bytes', array.nbytes)
+    return array
+
+
+def _resize_array(array: np.ndarray, out_width: int, out_height: int) -> np.ndarray:
+    height, width, bands = array.shape
+    if (width, height) == (out_width, out_height):
+        return array
+    with timed('resize'):
+        return write_into(
+            to_vips(array), np.empty((out_height, out_width, bands), dtype=array.dtype)
+        )
+
+
+def _encode_lossless(array: np.ndarray) -> Optional[bytes]:
+    """
+    Encode a decoded tile as PNG (fast compression), None if PNG cannot
+    hold it losslessly (more than 4 channels, more than 16 bits).
+    """
+    if array.dtype not in (np.uint8, np.uint16) or array.shape[2] > 4:
+        return None
+    im = to_vips(array)
+    if array.dtype == np.uint16:
+        im = im.copy(interpretation='grey16' if im.bands < 3 else 'rgb16')
+    with timed('encode_lossless'):
+        return im.pngsave_buffer(compression=1)
+
+
+_executor: Optional[ThreadPoolExecutor] = None
 
-        return pyramid
+
+def get_read_executor() -> ThreadPoolExecutor:
+    """Threads decoding native tiles concurrently (libvips releases the GIL)."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=get_settings().read_workers,
+            thread_name_prefix="openslide-read"
+        )
+    return _executor
 
 
 class OpenslideVipsReader(VipsReader):
+    def _read_tier(self, tier) -> VIPSImage:
+        sidecar = tier.data.get('sidecar_path')
+        if sidecar is not None:
+            return VIPSImage.tiffload(sidecar, page=tier.data['sidecar_page'])
+
+        # Synthetic tiers shift tier indexes, stored levels are kept in data.
+        level = tier.data.get('openslide_level', tier.level)
+        return cached_vips_openslide_file(self.format, level=level)
+
+    def _read_area(
+        self, tier, left: int, top: int, width: int, height: int,
+        c: Optional[Union[int, List[int]]] = None
+    ) -> VIPSImage:
+        # Lazy: pixels are decoded when the image is consumed. Only
+        # requested channels are flattened and decoded.
+        im = self._read_tier(tier).extract_area(left, top, width, height)
+        return flatten(im, None if c is None else channel_list(c, im.bands))
+
+    def _read_area_array(
+        self, tier, left: int, top: int, width: int, height: int,
+        c: ChannelSpec = None
+    ) -> np.ndarray:
+        im = self._read_tier(tier).extract_area(left, top, width, height)
+        array = _decode(im)
+
+        with timed('extract_channels'):
+            n_channels = im.bands - 1 if im.hasalpha() else im.bands
+            if is_stain_request(c):
+                rgb = flatten_array(array, [0, 1, 2]) if im.hasalpha() else array
+                return stain_channels(rgb, c)
+
+            channels = channel_list(c, n_channels)
+            if im.hasalpha():
+                return flatten_array(array, channels)
+            return array[..., channels]
+
+    def _locate(self, region, out_width: int, out_height: int):
+        pyramid = cached_compact_pyramid(self.format)
+        with timed('tier_selection'):
+            # Region coordinates are given at region downsample.
+            downsample = getattr(region, 'downsample', 1)
+            level, window = pyramid.locate(
+                region.left * downsample, region.top * downsample,
+                region.width * downsample, region.height * downsample,
+                out_width, out_height
+            )
+        return pyramid.tiers[level], window
+
+    def _decode_native_tile(
+        self, pyramid, level: int, tx: int, ty: int
+    ) -> np.ndarray:
+        tile_width, tile_height = _native_tile_size(pyramid, level)
+        left, top = tx * tile_width, ty * tile_height
+        width = min(tile_width, int(pyramid.widths[level]) - left)
+        height = min(tile_height, int(pyramid.heights[level]) - top)
+        return _decode(
+            self._read_area(pyramid.tiers[level], left, top, width, height)
+        )
+
+    def _native_tile(self, pyramid, level: int, tx: int, ty: int) -> np.ndarray:
+        path = str(self.format.path)
+        # Tier indexes change when sidecar or converted tiers are added.
+        tier = pyramid.tiers[level]
+        key = (
+            path, self.format.get_cached('_fingerprint', fingerprint, path),
+            tier.data.get('sidecar_path'), tier.data.get('sidecar_page'),
+            level, tx, ty
+        )
+        return get_tile_cache().get_or_create(
+            key, lambda: self._decode_native_tile(pyramid, level, tx, ty)
+        )
+
+    def read_grid_window(
+        self, left: int, top: int, width: int, height: int,
+        out_width: int, out_height: int
+    ) -> np.ndarray:
+        """
+        Read a full resolution window resized to the output size, as a
+        (height, width, channels) array at native bit depth. Only native
+        tiles of the most appropriate tier covering the window are decoded,
+        and they are cached so that neighbouring and overlapping grid tiles
+        reuse them.
+        """
+        pyramid = cached_compact_pyramid(self.format)
+        with timed('tier_selection'):
+            level, window = pyramid.locate(
+                left, top, width, height, out_width, out_height
+            )
+        x, y, w, h = window
+        tile_width, tile_height = _native_tile_size(pyramid, level)
+        cols, rows = native_tiles(window, tile_width, tile_height)
+
+        out = None
+        for ty in rows:
+            for tx in cols:
+                tile = self._native_tile(pyramid, level, tx, ty)
+                if out is None:
+                    out = np.empty((h, w, tile.shape[2]), dtype=tile.dtype)
+                _paste(out, window, tile, tx * tile_width, ty * tile_height)
+        return _resize_array(out, out_width, out_height)
+
+    def _assemble(
+        self, pyramid, extraction: Extraction, tiles: Dict[Tile, np.ndarray],
+        background: int
+    ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        _, _, w, h = window = extraction.window
+        tile_width, tile_height = _native_tile_size(pyramid, extraction.level)
+        # Tiles are at native bit depth.
+        dtype = tiles[extraction.tiles[0]].dtype if extraction.tiles else np.uint8
+        out = np.full(
+            (h, w, self.format.main_imd.n_channels), background, dtype=dtype
+        )
+        for tile in extraction.tiles:
+            _, tx, ty = tile
+            _paste(out, window, tiles[tile], tx * tile_width, ty * tile_height)
+
+        mask = extraction.mask
+        out_width, out_height = extraction.out_width, extraction.out_height
+        if (w, h) != (out_width, out_height):
+            # Masked after resizing, not to blend background in the edges.
+            out = _resize_array(out, out_width, out_height)
+            if mask is not None:
+                mask = rasterize(
+                    extraction.geometry, extraction.bounds, out_width, out_height
+                )
+        if mask is not None:
+            out[~mask] = background
+        return out, mask
+
+    def read_annotation(
+        self, geometry, out_width: int, out_height: int, background: int = 0
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Read the bounding box of an annotation geometry (full resolution
+        coordinates, see `utils.geometry`) resized to the output size, as a
+        (height, width, channels) array at native bit depth where pixels
+        outside the geometry are set to `background`, along with the
+        coverage mask. Only native tiles intersecting the geometry are
+        decoded, in parallel; tiles of the bounding box outside the geometry
+        are skipped.
+        """
+        pyramid = cached_compact_pyramid(self.format)
+        with timed('rasterize'):
+            extraction, = plan_extractions(
+                [(geometry, out_width, out_height)], pyramid,
+                partial(_native_tile_size, pyramid)
+            )
+        if is_enabled():
+            cols, rows = native_tiles(extraction.window, *_native_tile_size(
+                pyramid, extraction.level
+            ))
+            count('skipped_tiles', len(cols) * len(rows) - len(extraction.tiles))
+
+        decoded = get_read_executor().map(
+            lambda tile: self._native_tile(pyramid, *tile), extraction.tiles
+        )
+        tiles = dict(zip(extraction.tiles, decoded))
+        return self._assemble(pyramid, extraction, tiles, background)
+
+    def read_annotations(
+        self, requests: Iterable[Tuple[Any, int, int]], background: int = 0,
+        chunk_size: int = 64
+    ) -> Iterator[Tuple[int, np.ndarray, Optional[np.ndarray]]]:
+        """
+        Read many regions or annotation geometries of the slide, given as
+        (region or geometry, output width, output height), see
+        `utils.batch.plan_extractions`. Results are yielded as they are
+        ready, as (request index, array, mask), in spatial order rather
+        than request order. Masks are None for regions.
+
+        Every native tile is decoded once, even if several requests
+        overlap it, and kept only while pending requests need it.
+        """
+        pyramid = cached_compact_pyramid(self.format)
+        with timed('rasterize'):
+            extractions = plan_extractions(
+                requests, pyramid, partial(_native_tile_size, pyramid)
+            )
+
+        tiles = dict()
+        for chunk, needed, released in chunks(extractions, chunk_size):
+            decoded = get_read_executor().map(
+                lambda tile: self._decode_native_tile(pyramid, *tile), needed
+            )
+            tiles.update(zip(needed, decoded))
+            if is_enabled():
+                count('decoded_tiles', len(needed))
+            for extraction in chunk:
+                out, mask = self._assemble(pyramid, extraction, tiles, background)
+                yield extraction.index, out, mask
+            for tile in released:
+                del tiles[tile]
+
+    def export_window(
+        self, region, out_width: int, out_height: int, dest,
+        format: str = 'tiff', c: ChannelSpec = None,
+        progress: Optional[ProgressCallback] = None
+    ) -> Path:
+        """
+        Export a window resized to the output size to a tiled pyramidal
+        TIFF or a JPEG file, without holding it in memory: the window is
+        read by strips of native tiles of the most appropriate tier, tiles
+        of a strip being decoded in parallel while the previous strip is
+        written, and resized at once while encoding (see `utils.export`).
+        Progress is reported to `progress`, if given, with the phase and its
+        completed fraction.
+        """
+        if min(region.width, region.height) <= 0 or min(out_width, out_height) <= 0:
+            raise ValueError(
+                f"Cannot export an empty window ({region.width}x{region.height} "
+                f"to {out_width}x{out_height})"
+            )
+        pyramid = cached_compact_pyramid(self.format)
+        tier, window = self._locate(region, out_width, out_height)
+        level = pyramid.tiers.index(tier)
+        x, y, w, h = window
+        tile_width, tile_height = _native_tile_size(pyramid, level)
+        cols, rows = native_tiles(window, tile_width, tile_height)
+
+        def read_strip(ty: int) -> List[Future]:
+            top = max(y, ty * tile_height)
+            height = min(y + h, (ty + 1) * tile_height) - top
+            futures = []
+            for tx in cols:
+                left = max(x, tx * tile_width)
+                width = min(x + w, (tx + 1) * tile_width) - left
+                futures.append(get_read_executor().submit(
+                    self._read_area_array, tier, left, top, width, height, c
+                ))
+            return futures
+
+        writer = None
+        try:
+            pending = read_strip(rows[0])
+            for i, ty in enumerate(rows):
+                strip_tiles = [future.result() for future in pending]
+                if i + 1 < len(rows):
+                    pending = read_strip(rows[i + 1])
+                strip = np.concatenate(strip_tiles, axis=1)
+                if writer is None:
+                    writer = StripWriter(
+                        dest, w, h, strip.shape[2], strip.dtype, format,
+                        out_width, out_height
+                    )
+                writer.write(max(y, ty * tile_height) - y, strip)
+                if progress is not None:
+                    progress('read', (i + 1) / len(rows))
+            return writer.save(progress)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def read_dzi_tile(
+        self, level: int, col: int, row: int, tile_size: int = 254,
+        overlap: int = 1
+    ) -> np.ndarray:
+        """Read a Deep Zoom tile, see `DeepZoomGrid`."""
+        pyramid = cached_compact_pyramid(self.format)
+        grid = DeepZoomGrid(
+            int(pyramid.widths[0]), int(pyramid.heights[0]), tile_size, overlap
+        )
+        window, (out_width, out_height) = grid.base_window(level, col, row)
+        return self.read_grid_window(*window, out_width, out_height)
+
+    def read_iiif_tile(self, region: str = 'full', size: str = 'max') -> np.ndarray:
+        """Read a IIIF Image API region at a given size."""
+        pyramid = cached_compact_pyramid(self.format)
+        window = parse_iiif_region(
+            region, int(pyramid.widths[0]), int(pyramid.heights[0])
+        )
+        out_width, out_height = parse_iiif_size(size, window[2], window[3])
+        return self.read_grid_window(*window, out_width, out_height)
+
     def read_thumb(
         self, out_width, out_height, precomputed=False,
         c: Optional[Union[int, List[int]]] = None, **other
@@ -108,10 +542,10 @@ class OpenslideVipsReader(VipsReader):
         if precomputed:
             imd = self.format.full_imd
             if imd.associated_thumb.exists:
-                im = VIPSImage.openslideload(
-                    str(self.format.path), associated='thumbnail'
-                ).flatten()
-                return self._extract_channels(im, c)
+                im = cached_vips_openslide_file(
+                    self.format, associated='thumbnail'
+                )
+                return flatten(im, None if c is None else channel_list(c, 0))
 
         return super().read_thumb(out_width, out_height, **other)
 
@@ -119,47 +553,156 @@ class OpenslideVipsReader(VipsReader):
         self, region, out_width, out_height,
         c: Optional[Union[int, List[int]]] = None, **other
     ):
-        out_size = (out_width, out_height)
-        tier = self.format.pyramid.most_appropriate_tier(region, out_size)
-        region = region.scale_to_tier(tier)
+        tier, window = self._locate(region, out_width, out_height)
+        return self._read_area(tier, *window, c)
 
-        level_page = VIPSImage.openslideload(
-            str(self.format.path), level=tier.level
-        )
-        im = level_page.extract_area(
-            region.left, region.top, region.width, region.height
-        ).flatten()
-        return self._extract_channels(im, c)
+    def read_window_array(
+        self, region, out_width: int, out_height: int, c: ChannelSpec = None
+    ) -> np.ndarray:
+        """
+        Read a window as a (height, width, channels) NumPy array, at the most
+        appropriate tier (not resized to the output size).
+        Channels are indexes (uint8 output, a view of the decoded buffer
+        when possible) or stain names such as 'hematoxylin' and 'eosin'
+        (float32 optical densities from colour deconvolution).
+        """
+        tier, window = self._locate(region, out_width, out_height)
+        return self._read_area_array(tier, *window, c)
 
     def read_tile(
         self, tile, c: Optional[Union[int, List[int]]] = None, **other
     ):
-        tier = tile.tier
-        level_page = VIPSImage.openslideload(
-            str(self.format.path), level=tier.level
-        )
-
         # There is no direct access to underlying tiles in vips
         # But the following computation match vips implementation so that only
         # the tile that has to be read is read.
         # https://github.com/jcupitt/tilesrv/blob/master/tilesrv.c#L461
-        im = level_page.extract_area(
-            tile.left, tile.top, tile.width, tile.height
-        ).flatten()
-        return self._extract_channels(im, c)
+        return self._cached_tile(tile, c, lambda: self._read_area(
+            tile.tier, tile.left, tile.top, tile.width, tile.height, c
+        ))
+
+    def _disk_cache_key(self, tile, c, *variant) -> Tuple:
+        tier = tile.tier
+        return (
+            self.format.get_cached(
+                '_slide_fingerprint', slide_fingerprint, self.format.path
+            ),
+            tier.data.get('sidecar_path'), tier.data.get('sidecar_page'),
+            tier.data.get('openslide_level', tier.level),
+            tile.left, tile.top, tile.width, tile.height,
+            None if c is None else tuple(channel_list(c, 0)),
+            *variant
+        )
+
+    def _cached_tile(
+        self, tile, c, decode: Callable[[], VIPSImage], *variant
+    ) -> VIPSImage:
+        """
+        Decoded tile from the disk tile cache, if enabled. Missing tiles are
+        decoded and stored losslessly, as PNG (see `_encode_lossless`).
+        """
+        cache = get_disk_tile_cache()
+        if cache is None:
+            return decode()
+        key = self._disk_cache_key(tile, c, *variant)
+        data = cache.get(key, 'png')
+        if data is not None:
+            return VIPSImage.new_from_buffer(data, '')
+
+        array = _decode(decode())
+        data = _encode_lossless(array)
+        if data is not None:
+            cache.put(key, 'png', data)
+        return to_vips(array)
+
+    def read_tile_into(
+        self, tile, out: Optional[np.ndarray] = None,
+        c: Optional[Union[int, List[int]]] = None
+    ) -> np.ndarray:
+        """
+        Decode a tile directly into a (height, width, channels) array of the
+        image dtype, either `out` or a buffer from the pool, which the caller
+        should give back with `get_buffer_pool().release()` once done.
+        """
+        im = self._read_area(
+            tile.tier, tile.left, tile.top, tile.width, tile.height, c
+        )
+        return self._write_into(im, out)
+
+    def read_window_into(
+        self, region, out_width: int, out_height: int,
+        out: Optional[np.ndarray] = None,
+        c: Optional[Union[int, List[int]]] = None
+    ) -> np.ndarray:
+        """
+        Decode a window resized to the output size directly into a
+        (out_height, out_width, channels) array, see `read_tile_into`.
+        """
+        tier, window = self._locate(region, out_width, out_height)
+        im = self._read_area(tier, *window, c)
+        if out is None:
+            out = get_buffer_pool().acquire(
+                (out_height, out_width, im.bands), VIPS_DTYPES[im.format]
+            )
+        return self._write_into(im, out)
+
+    @staticmethod
+    def _write_into(im: VIPSImage, out: Optional[np.ndarray]) -> np.ndarray:
+        if out is None:
+            out = get_buffer_pool().acquire(
+                (im.height, im.width, im.bands), VIPS_DTYPES[im.format]
+            )
+        with timed('decode'):
+            write_into(im, out)
+        if is_enabled():
+            count('decoded_bytes', out.nbytes)
+        return out
+
+    def read_encoded_tile(
+        self, tile, format: str = 'jpeg', quality: int = 75,
+        c: Optional[Union[int, List[int]]] = None
+    ) -> bytes:
+        """
+        Read a tile encoded as JPEG, WebP or PNG. When the disk tile cache
+        is enabled, encoded tiles are served from it without decoding.
+        """
+        extension = ENCODED_FORMATS[format]
+        cache = get_disk_tile_cache()
+        key = None
+        if cache is not None:
+            key = self._disk_cache_key(tile, c, format, quality)
+            data = cache.get(key, extension)
+            if data is not None:
+                return data
+
+        im = self._read_area(
+            tile.tier, tile.left, tile.top, tile.width, tile.height, c
+        )
+        # Pixels of the lazy image are decoded while encoding.
+        with timed('decode_encode'):
+            options = dict() if format == 'png' else dict(Q=quality)
+            data = im.write_to_buffer(f'.{extension}', **options)
+        if cache is not None:
+            cache.put(key, extension, data)
+        return data
+
+    def read_tile_array(self, tile, c: ChannelSpec = None) -> np.ndarray:
+        """Read a tile as a NumPy array, see `read_window_array`."""
+        return self._read_area_array(
+            tile.tier, tile.left, tile.top, tile.width, tile.height, c
+        )
 
     def read_label(self, out_width, out_height, **other):
         imd = self.format.full_imd
         if imd.associated_label.exists:
-            return VIPSImage.openslideload(
-                str(self.format.path), associated='label'
-            ).flatten()
+            return flatten(
+                cached_vips_openslide_file(self.format, associated='label')
+            )
         return None
 
     def read_macro(self, out_width, out_height, **other):
         imd = self.format.full_imd
         if imd.associated_macro.exists:
-            return VIPSImage.openslideload(
-                str(self.format.path), associated='macro'
-            ).flatten()
+            return flatten(
+                cached_vips_openslide_file(self.format, associated='macro')
+            )
         return None
@@ -0,0 +1,131 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+"""
+Streaming export of large regions to tiled pyramidal TIFF or JPEG files.
+
+Regions are read by strips of native tiles (see
+`OpenslideVipsReader.export_window`), so that memory usage depends on the
+region width only. Strips are written to a temporary raw file next to the
+destination, from which libvips streams the resize to the output size and
+the encoding. Resizing the whole region at once avoids seams between
+strips.
+"""
+import logging
+import os
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+from pyvips import Image as VIPSImage
+
+from pims_plugin_format_openslide.utils.buffers import resize_to
+from pims_plugin_format_openslide.utils.channels import VIPS_FORMATS
+from pims_plugin_format_openslide.utils.config import get_settings
+from pims_plugin_format_openslide.utils.instrumentation import timed
+
+log = logging.getLogger("pims.app")
+
+EXPORT_FORMATS = ('tiff', 'jpeg')
+# Largest JPEG dimension
+JPEG_MAX_SIZE = 65535
+
+# Called with the phase ('read' or 'encode') and its completed fraction
+ProgressCallback = Callable[[str, float], None]
+
+
+class StripWriter:
+    """
+    Image written by strips of rows to a temporary raw file, then resized
+    to the output size (if given) and encoded by libvips into the
+    destination, which is replaced atomically.
+    """
+
+    def __init__(
+        self, dest, width: int, height: int, bands: int, dtype,
+        format: str = 'tiff', out_width: Optional[int] = None,
+        out_height: Optional[int] = None
+    ):
+        out_width = width if out_width is None else out_width
+        out_height = height if out_height is None else out_height
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format {format}, use one of {EXPORT_FORMATS}")
+        dtype = np.dtype(dtype)
+        if format == 'jpeg':
+            if dtype != np.uint8 or bands not in (1, 3):
+                raise ValueError("JPEG exports must be 8-bit, with 1 or 3 channels")
+            if max(out_width, out_height) > JPEG_MAX_SIZE:
+                raise ValueError(f"JPEG exports are limited to {JPEG_MAX_SIZE} pixels")
+        if dtype.name not in VIPS_FORMATS:
+            raise ValueError(f"Unsupported pixel type {dtype}")
+
+        self.dest = Path(dest)
+        self.width, self.height, self.bands = width, height, bands
+        self.out_width, self.out_height = out_width, out_height
+        self.dtype = dtype
+        self.format = format
+        self.raw = self.dest.with_name(f".{self.dest.name}.{os.getpid()}.raw")
+        self.array = np.memmap(
+            self.raw, dtype=dtype, mode='w+', shape=(height, width, bands)
+        )
+
+    def write(self, top: int, strip: np.ndarray):
+        self.array[top:top + strip.shape[0]] = strip
+
+    def save(self, progress: Optional[ProgressCallback] = None) -> Path:
+        settings = get_settings()
+        self.array.flush()
+        im = VIPSImage.rawload(
+            str(self.raw), self.width, self.height, self.bands,
+            format=VIPS_FORMATS[self.dtype.name]
+        )
+        im = resize_to(im, self.out_width, self.out_height)
+        if self.bands == 3 and self.dtype == np.uint8:
+            im = im.copy(interpretation='srgb')
+        if progress is not None:
+            im.set_progress(True)
+            im.signal_connect(
+                'eval', lambda image, status: progress('encode', status.percent / 100)
+            )
+
+        tmp = self.dest.with_name(f".{self.dest.name}.{os.getpid()}.tmp")
+        try:
+            with timed('encode'):
+                if self.format == 'jpeg':
+                    im.jpegsave(str(tmp), Q=settings.export_quality)
+                else:
+                    # JPEG compression is only available for 8-bit images.
+                    options = dict(compression='jpeg', Q=settings.export_quality) \
+                        if self.dtype == np.uint8 else dict(compression='deflate')
+                    im.tiffsave(
+                        str(tmp), tile=True, pyramid=True, bigtiff=True,
+                        tile_width=settings.export_tile_size,
+                        tile_height=settings.export_tile_size, **options
+                    )
+            os.replace(tmp, self.dest)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        if progress is not None:
+            progress('encode', 1.0)
+        return self.dest
+
+    def close(self):
+        del self.array
+        self.raw.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
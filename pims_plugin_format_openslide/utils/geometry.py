@@ -0,0 +1,119 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+"""
+Rasterization of annotation geometries onto tier and native tile grids.
+
+Geometries are given in full resolution coordinates, either as objects
+implementing `__geo_interface__` (e.g. Shapely geometries, as used by
+PIMS annotations) or as a sequence of (x, y) polygon vertices.
+"""
+from typing import Any, Iterator, List, Sequence, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+Window = Tuple[int, int, int, int]
+Coordinates = Sequence[Tuple[float, float]]
+
+
+def geometry_parts(geometry: Any) -> Iterator[Tuple[str, List[Coordinates]]]:
+    """
+    Simple parts of a geometry, as (type, rings) where type is 'Polygon'
+    (exterior ring then holes), 'LineString' or 'Point'.
+    """
+    if not hasattr(geometry, '__geo_interface__') and not isinstance(geometry, dict):
+        yield 'Polygon', [list(geometry)]
+        return
+
+    shape = geometry if isinstance(geometry, dict) else geometry.__geo_interface__
+    kind, coordinates = shape['type'], shape.get('coordinates')
+    if kind == 'Polygon':
+        yield kind, list(coordinates)
+    elif kind in ('LineString', 'LinearRing'):
+        yield 'LineString', [coordinates]
+    elif kind == 'Point':
+        yield kind, [[coordinates]]
+    elif kind in ('MultiPolygon', 'MultiLineString', 'MultiPoint'):
+        simple = kind[len('Multi'):]
+        for part in coordinates:
+            yield from geometry_parts({'type': simple, 'coordinates': part})
+    elif kind == 'GeometryCollection':
+        for part in shape['geometries']:
+            yield from geometry_parts(part)
+    else:
+        raise ValueError(f"Unsupported geometry type {kind}")
+
+
+def geometry_bounds(geometry: Any) -> Window:
+    """Full resolution integer window enclosing a geometry."""
+    points = np.array([
+        point for _, rings in geometry_parts(geometry)
+        for ring in rings for point in ring
+    ], dtype=float).reshape(-1, 2)
+    if len(points) == 0:
+        raise ValueError("Empty geometry")
+    left, top = np.floor(points.min(axis=0)).astype(int)
+    right, bottom = np.floor(points.max(axis=0)).astype(int) + 1
+    return int(left), int(top), int(right - left), int(bottom - top)
+
+
+def rasterize(
+    geometry: Any, window: Window, width: int, height: int
+) -> np.ndarray:
+    """
+    Coverage mask (height, width) of a geometry over a full resolution
+    window scaled to the given size. Lines and points cover the pixels they
+    go through.
+    """
+    left, top, window_width, window_height = window
+    sx, sy = width / window_width, height / window_height
+
+    def scale(ring: Coordinates) -> List[Tuple[float, float]]:
+        return [((x - left) * sx, (y - top) * sy) for x, y, *_ in ring]
+
+    mask = Image.new('1', (width, height), 0)
+    draw = ImageDraw.Draw(mask)
+    for kind, rings in geometry_parts(geometry):
+        if kind == 'Polygon':
+            draw.polygon(scale(rings[0]), fill=1, outline=1)
+            for hole in rings[1:]:
+                draw.polygon(scale(hole), fill=0, outline=0)
+        elif kind == 'LineString':
+            draw.line(scale(rings[0]), fill=1)
+        else:
+            draw.point(scale(rings[0]), fill=1)
+    return np.array(mask, dtype=bool)
+
+
+def covered_tiles(
+    mask: np.ndarray, window: Window, tile_width: int, tile_height: int
+) -> List[Tuple[int, int]]:
+    """
+    Native tiles (column, row) of a tier intersecting a mask rasterized
+    over a window of this tier.
+    """
+    x, y, width, height = window
+    tiles = []
+    for ty in range(y // tile_height, (y + height - 1) // tile_height + 1):
+        y0 = max(ty * tile_height - y, 0)
+        y1 = min((ty + 1) * tile_height - y, height)
+        rows = mask[y0:y1]
+        if not rows.any():
+            continue
+        for tx in range(x // tile_width, (x + width - 1) // tile_width + 1):
+            x0 = max(tx * tile_width - x, 0)
+            x1 = min((tx + 1) * tile_width - x, width)
+            if rows[:, x0:x1].any():
+                tiles.append((tx, ty))
+    return tiles
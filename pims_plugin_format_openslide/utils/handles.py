@@ -0,0 +1,295 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+"""
+Process-wide caches shared by format instances of the same slide.
+
+PIMS creates format instances per request, so that caches attached to a
+format instance (`get_cached`) do not outlive the request. OpenSlide
+handles and parsed metadata are kept here, keyed by the slide path and
+fingerprint (size and modification time), so that a modified slide is
+never served from stale entries.
+"""
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+from pyvips import Image as VIPSImage
+
+from pims_plugin_format_openslide.utils.config import get_settings
+from pims_plugin_format_openslide.utils.instrumentation import record_cache, timed
+
+Fingerprint = Tuple[int, int]
+# Handle pool key (in place of a level) of compact pyramid views
+COMPACT_PYRAMID = 'compact_pyramid'
+
+
+def fingerprint(path) -> Fingerprint:
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache with a maximum entry count and,
+    if `sizeof` is given, a maximum size in bytes.
+
+    If a memory governor is attached (see `utils.memory`), it is notified
+    after every insertion to enforce the process-wide memory budget.
+    """
+
+    def __init__(
+        self, name: str, max_entries: int, max_bytes: Optional[int] = None,
+        sizeof: Optional[Callable[[Any], int]] = None
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.governor = None
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        # Size and last access time of entries
+        self._sizes = dict()
+        self._accessed = dict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _size(self, key: Hashable, value: Any) -> int:
+        return self.sizeof(value) if self.sizeof is not None else 0
+
+    def _pop(self, key: Hashable) -> int:
+        del self._entries[key]
+        self._accessed.pop(key, None)
+        size = self._sizes.pop(key, 0)
+        self.nbytes -= size
+        return size
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or (
+            self.max_bytes is not None and self.nbytes > self.max_bytes
+            and len(self._entries) > 1
+        ):
+            self._pop(next(iter(self._entries)))
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._accessed[key] = time.monotonic()
+                record_cache(self.name, hit=True)
+                return self._entries[key]
+        record_cache(self.name, hit=False)
+
+        # Created outside the lock: concurrent misses may both create the
+        # value, the first one stored wins.
+        value = factory()
+        inserted = False
+        with self._lock:
+            if key in self._entries:
+                value = self._entries[key]
+            else:
+                self._entries[key] = value
+                size = self._size(key, value)
+                self._sizes[key] = size
+                self.nbytes += size
+                inserted = True
+            self._entries.move_to_end(key)
+            self._accessed[key] = time.monotonic()
+            self._evict()
+        if inserted and self.governor is not None:
+            self.governor.enforce()
+        return value
+
+    def oldest(self) -> Optional[float]:
+        """Last access time of the least recently used entry, if any."""
+        with self._lock:
+            if not self._entries:
+                return None
+            return self._accessed.get(next(iter(self._entries)), 0.)
+
+    def pop_oldest(self) -> int:
+        """Drop the least recently used entry and return its size."""
+        with self._lock:
+            if not self._entries:
+                return 0
+            return self._pop(next(iter(self._entries)))
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]):
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._accessed.clear()
+            self.nbytes = 0
+
+
+class HandlePool(LRUCache):
+    """
+    OpenSlide handles (whole slide, levels and associated images), and the
+    compact pyramid view of slides (see `utils.pyramid`).
+
+    Associated images are decoded in memory when opened, their size is
+    known. Slide and level handles are charged the size of the OpenSlide
+    tile cache held by every handle.
+    """
+
+    def __init__(self, name: str, max_entries: int, handle_bytes: int = 0):
+        super().__init__(name, max_entries)
+        self.handle_bytes = handle_bytes
+
+    def _size(self, key: Hashable, value: Any) -> int:
+        if key[2] == COMPACT_PYRAMID:
+            return value.nbytes
+        if key[3] is not None:
+            return value.width * value.height * value.bands
+        return self.handle_bytes
+
+    def openslide(
+        self, path: str, level: Optional[int] = None,
+        associated: Optional[str] = None
+    ) -> VIPSImage:
+        path = str(path)
+        options = dict()
+        if level is not None:
+            options['level'] = level
+        if associated is not None:
+            options['associated'] = associated
+
+        def _load():
+            with timed('openslideload'):
+                return VIPSImage.openslideload(path, **options)
+
+        key = (path, fingerprint(path), level, associated)
+        return self.get_or_create(key, _load)
+
+
+    def compact_pyramid(
+        self, path: str, format_name: str, build: Callable[[], Any]
+    ) -> Any:
+        path = str(path)
+        key = (path, fingerprint(path), COMPACT_PYRAMID, format_name)
+        return self.get_or_create(key, build)
+
+
+class ParsedCache(LRUCache):
+    """
+    Results of parser methods. Callers get their own copy of a result, as
+    format instances complete and modify parsed metadata in place.
+    """
+
+    def get_or_parse(
+        self, path: str, format_name: str, phase: str,
+        parse: Callable[[], Any]
+    ) -> Any:
+        key = (str(path), fingerprint(path), format_name, phase)
+        return copy.deepcopy(self.get_or_create(key, parse))
+
+
+_handles: Optional[HandlePool] = None
+_parsed: Optional[ParsedCache] = None
+_tiles: Optional[LRUCache] = None
+
+
+def _govern(name: str, cache):
+    # Imported here, the memory governor module imports this one.
+    from pims_plugin_format_openslide.utils.memory import get_memory_governor
+    get_memory_governor().register(name, cache)
+
+
+def get_handle_pool() -> HandlePool:
+    global _handles
+    if _handles is None:
+        settings = get_settings()
+        _handles = HandlePool(
+            'handle_pool', settings.handle_pool_size,
+            settings.openslide_handle_cache_bytes
+        )
+        _govern('handle_pool', _handles)
+    return _handles
+
+
+def get_parsed_cache() -> ParsedCache:
+    global _parsed
+    if _parsed is None:
+        _parsed = ParsedCache('parsed_cache', get_settings().parsed_cache_size)
+    return _parsed
+
+
+def get_tile_cache() -> LRUCache:
+    """Decoded native tiles (NumPy arrays), bounded in bytes."""
+    global _tiles
+    if _tiles is None:
+        _tiles = LRUCache(
+            'decoded_tile_cache', max_entries=2 ** 20,
+            max_bytes=get_settings().decoded_tile_cache_bytes,
+            sizeof=lambda array: array.nbytes
+        )
+        _govern('decoded_tile_cache', _tiles)
+    return _tiles
+
+
+def invalidate(path):
+    """Drop cached handles, parsed metadata and decoded tiles of a slide."""
+    path = str(path)
+    get_handle_pool().invalidate(lambda key: key[0] == path)
+    get_parsed_cache().invalidate(lambda key: key[0] == path)
+    get_tile_cache().invalidate(lambda key: key[0] == path)
+
+
+SHARED_PARSER_METHODS = (
+    'parse_main_metadata', 'parse_known_metadata', 'parse_pyramid'
+)
+
+_active = threading.local()
+
+
+def shared_parsing(cls):
+    """
+    Class decorator sharing results of parser methods across format
+    instances. Overridden methods calling `super()` are cached once. Every
+    call returns a copy of the shared result.
+    """
+    def _wrap(name, func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            active = _active.__dict__.setdefault('phases', set())
+            if name in active or args or kwargs:
+                return func(self, *args, **kwargs)
+            active.add(name)
+            try:
+                return get_parsed_cache().get_or_parse(
+                    self.format.path, type(self.format).__name__, name,
+                    lambda: func(self)
+                )
+            finally:
+                active.discard(name)
+        wrapper.__shared_parsing__ = True
+        return wrapper
+
+    for name in SHARED_PARSER_METHODS:
+        func = getattr(cls, name, None)
+        if func is None or getattr(func, '__shared_parsing__', False):
+            continue
+        setattr(cls, name, _wrap(name, func))
+    return cls
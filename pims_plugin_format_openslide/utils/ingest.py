@@ -0,0 +1,328 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+"""
+Batch ingestion of slides in OpenSlide formats.
+
+Slides are checked, parsed, thumbnailed and histogrammed in a process pool.
+Each stage has its own concurrency limit shared by all worker processes, so
+that e.g. I/O bound checking is not starved by CPU bound histograms.
+Results are streamed as they complete and appended to a JSON lines journal,
+which is used to skip already ingested slides when a batch is resumed.
+
+Usage:
+    python -m pims_plugin_format_openslide.utils.ingest --output out/ slides/*.svs
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+log = logging.getLogger("pims.app")
+
+STAGES = ('check', 'parse', 'thumbnail', 'histogram')
+
+DEFAULT_STAGE_LIMITS = {
+    'check': None,
+    'parse': None,
+    'thumbnail': 2,
+    'histogram': 2,
+}
+
+THUMBNAIL_SIZE = 512
+
+# Stage semaphores, inherited by worker processes.
+_semaphores: Dict[str, Any] = dict()
+
+
+def _init_worker(semaphores: Dict[str, Any]):
+    global _semaphores
+    _semaphores = semaphores
+
+
+@contextmanager
+def _stage(name: str, timings: Dict[str, float]):
+    semaphore = _semaphores.get(name)
+    if semaphore is not None:
+        semaphore.acquire()
+    try:
+        start = time.perf_counter()
+        yield
+        timings[name] = time.perf_counter() - start
+    finally:
+        if semaphore is not None:
+            semaphore.release()
+
+
+def openslide_formats() -> List[type]:
+    from pims_plugin_format_openslide.bif import BifFormat
+    from pims_plugin_format_openslide.mrxs import MRXSFormat
+    from pims_plugin_format_openslide.ndpi import NDPIFormat
+    from pims_plugin_format_openslide.philips import PhilipsFormat
+    from pims_plugin_format_openslide.scn import SCNFormat
+    from pims_plugin_format_openslide.svs import SVSFormat
+    from pims_plugin_format_openslide.vms import VMSFormat
+
+    return [
+        SVSFormat, NDPIFormat, PhilipsFormat, BifFormat, SCNFormat,
+        VMSFormat, MRXSFormat
+    ]
+
+
+def _fingerprint(path: Path) -> dict:
+    stat = path.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _output_dir(output: Path, path: Path) -> Path:
+    digest = hashlib.sha1(str(path.resolve()).encode()).hexdigest()[:12]
+    return output / f"{path.stem}-{digest}"
+
+
+def ingest_slide(
+    path: str, output: Optional[str], stages: Sequence[str] = STAGES
+) -> dict:
+    """
+    Run ingestion stages on one slide. Never raises: failures are reported
+    in the result, with the stage that failed.
+    """
+    path = Path(path)
+    result = {"path": str(path), "status": "ok"}
+    timings = dict()
+    stage = None
+    try:
+        stage = 'check'
+        from pims.files.file import Path as PIMSPath
+        from pims.formats.utils.abstract import CachedDataPath
+
+        result.update(_fingerprint(path))
+        with _stage(stage, timings):
+            proxy = CachedDataPath(PIMSPath(path))
+            format_class = next(
+                (f for f in openslide_formats() if f.match(proxy)), None
+            )
+        if format_class is None:
+            result["status"] = "unsupported"
+            return result
+        format = format_class.from_proxy(proxy)
+        result["format"] = format_class.get_name()
+
+        if 'parse' in stages:
+            stage = 'parse'
+            with _stage(stage, timings):
+                imd = format.main_imd
+                full_imd = format.full_imd
+                pyramid = format.pyramid
+            result.update(
+                width=imd.width, height=imd.height,
+                n_channels=imd.n_channels, pixel_type=str(imd.pixel_type),
+                n_tiers=pyramid.n_levels,
+                physical_size_x=(
+                    full_imd.physical_size_x.to("micrometers").magnitude
+                    if full_imd.physical_size_x is not None else None
+                )
+            )
+
+        if output is None:
+            return result
+        dest = _output_dir(Path(output), path)
+        dest.mkdir(parents=True, exist_ok=True)
+        result["output"] = str(dest)
+
+        if 'thumbnail' in stages:
+            stage = 'thumbnail'
+            with _stage(stage, timings):
+                thumb = format.reader.read_thumb(
+                    THUMBNAIL_SIZE, THUMBNAIL_SIZE, precomputed=True
+                )
+                thumb = thumb.thumbnail_image(
+                    THUMBNAIL_SIZE, height=THUMBNAIL_SIZE
+                )
+                thumb.write_to_file(str(dest / "thumbnail.jpg"))
+
+        if 'histogram' in stages:
+            stage = 'histogram'
+            with _stage(stage, timings):
+                from pims.api.utils.models import HistogramType
+                from pims.files.file import HISTOGRAM_STEM
+                from pims.files.image import Image
+                from pims.processing.histograms.utils import build_histogram_file
+
+                image = Image(PIMSPath(path), format=format)
+                build_histogram_file(
+                    image, PIMSPath(dest / HISTOGRAM_STEM), HistogramType.FAST
+                )
+    except Exception as e:  # noqa
+        result.update(
+            status="error", stage=stage, error=f"{type(e).__name__}: {e}",
+            traceback=traceback.format_exc()
+        )
+    finally:
+        result["timings"] = timings
+    return result
+
+
+def read_journal(journal: Path) -> Dict[str, dict]:
+    """Last journal entry of every slide. A truncated last line is ignored."""
+    entries = dict()
+    if not journal.exists():
+        return entries
+    with open(journal) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            entries[entry["path"]] = entry
+    return entries
+
+
+def _is_done(entry: Optional[dict], path: Path) -> bool:
+    if entry is None or entry["status"] == "error":
+        return False
+    try:
+        fingerprint = _fingerprint(path)
+    except OSError:
+        return False
+    return all(entry.get(k) == v for k, v in fingerprint.items())
+
+
+class Throughput:
+    """Slides per minute since the start of a batch."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.done = 0
+        self.failed = 0
+
+    def update(self, result: dict):
+        self.done += 1
+        if result["status"] == "error":
+            self.failed += 1
+
+    @property
+    def slides_per_minute(self) -> float:
+        elapsed = time.perf_counter() - self.start
+        return 60 * self.done / elapsed if elapsed > 0 else 0.0
+
+
+def ingest(
+    paths: Iterable[str], output: Optional[str] = None,
+    journal: Optional[str] = None, stages: Sequence[str] = STAGES,
+    workers: Optional[int] = None,
+    stage_limits: Optional[Dict[str, Optional[int]]] = None,
+    throughput: Optional[Throughput] = None
+) -> Iterator[dict]:
+    """
+    Ingest slides in a process pool and yield results as they complete.
+
+    Slides successfully ingested according to the journal, and unchanged
+    since then, are skipped. Stage limits bound the number of slides in a
+    stage at the same time, across all workers (`None` is unbounded).
+    """
+    stages = [s for s in STAGES if s in stages or s == 'check']
+    workers = workers or os.cpu_count() or 1
+    limits = {**DEFAULT_STAGE_LIMITS, **(stage_limits or dict())}
+    journal = Path(journal) if journal else None
+    done = read_journal(journal) if journal else dict()
+    throughput = throughput or Throughput()
+
+    # Vips thread pools do not survive fork, workers are spawned.
+    context = multiprocessing.get_context("spawn")
+    semaphores = {
+        stage: context.BoundedSemaphore(limit)
+        for stage, limit in limits.items() if limit is not None
+    }
+
+    journal_file = open(journal, "a") if journal else None
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=context,
+            initializer=_init_worker, initargs=(semaphores,)
+        ) as executor:
+            pending = set()
+            paths = iter(paths)
+            exhausted = False
+            while True:
+                # Bound in-flight submissions for very large batches.
+                while not exhausted and len(pending) < 2 * workers:
+                    path = next(paths, None)
+                    if path is None:
+                        exhausted = True
+                    elif not _is_done(done.get(str(path)), Path(path)):
+                        pending.add(executor.submit(
+                            ingest_slide, str(path), output, stages
+                        ))
+                if not pending:
+                    break
+
+                completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    result = future.result()
+                    if journal_file is not None:
+                        journal_file.write(json.dumps(result) + "\n")
+                        journal_file.flush()
+                        os.fsync(journal_file.fileno())
+                    throughput.update(result)
+                    yield result
+    finally:
+        if journal_file is not None:
+            journal_file.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--output', help="Directory for thumbnails and histograms")
+    parser.add_argument('--journal', default="ingest-journal.jsonl")
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--stages', default=','.join(STAGES))
+    for stage in STAGES:
+        parser.add_argument(
+            f'--{stage}-limit', type=int, default=DEFAULT_STAGE_LIMITS[stage],
+            help=f"Maximum number of slides in {stage} stage at the same time"
+        )
+    args = parser.parse_args(argv)
+    # Progress goes to the PIMS logger, on stderr when run from the shell.
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    throughput = Throughput()
+    results = ingest(
+        args.paths, args.output, args.journal, args.stages.split(','),
+        args.workers, {s: getattr(args, f'{s}_limit') for s in STAGES},
+        throughput
+    )
+    for result in results:
+        log.info(
+            f"[{throughput.done}] {result['status']:<11} {result['path']} "
+            f"({throughput.slides_per_minute:.1f} slides/min)"
+        )
+        if result['status'] == 'error':
+            log.error(f"    {result['stage']}: {result['error']}")
+    log.info(
+        f"{throughput.done} slides, {throughput.failed} failed, "
+        f"{throughput.slides_per_minute:.1f} slides/min"
+    )
+    return 1 if throughput.failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,250 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+"""
+Lightweight instrumentation of reader and parser hot paths.
+
+Phase timings, decoded bytes and cache hits/misses are sent to a pluggable
+sink. The sink is configured from settings on first use; when there is
+none, instrumented code only pays a global lookup per call.
+
+Vips images are lazy: pixels are decoded when an image is consumed, so
+reads are timed where pixels are produced ('decode', 'decode_encode'),
+not where the vips pipeline is built.
+"""
+import json
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from functools import wraps
+from typing import Callable, Dict, Optional, Tuple
+
+from pims_plugin_format_openslide.utils.config import get_settings
+
+log = logging.getLogger("pims.app")
+
+
+class Sink(ABC):
+    @abstractmethod
+    def observe(self, metric: str, value: float, **labels):
+        """Record a measure (timing, size) in a distribution."""
+
+    @abstractmethod
+    def increment(self, metric: str, value: float = 1, **labels):
+        """Increment a counter."""
+
+
+class LoggingSink(Sink):
+    """Structured logs, one JSON object per event."""
+
+    def __init__(self, logger: logging.Logger = log, level: int = logging.DEBUG):
+        self.logger = logger
+        self.level = level
+
+    def _log(self, kind: str, metric: str, value: float, labels: dict):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, json.dumps(
+                {"kind": kind, "metric": metric, "value": value, **labels}
+            ))
+
+    def observe(self, metric: str, value: float, **labels):
+        self._log("observe", metric, value, labels)
+
+    def increment(self, metric: str, value: float = 1, **labels):
+        self._log("increment", metric, value, labels)
+
+
+class PrometheusSink(Sink):
+    """
+    Prometheus histograms and counters (requires `prometheus_client`).
+    A metric is registered once, with the labels of its first event: every
+    event of a metric must give the same labels.
+    """
+
+    PREFIX = "pims_openslide_"
+
+    def __init__(self, registry=None):
+        import prometheus_client
+        self._client = prometheus_client
+        self._registry = registry or prometheus_client.REGISTRY
+        self._metrics = dict()
+        self._lock = threading.Lock()
+
+    def _get(self, kind, metric: str, labels: dict):
+        collector = self._metrics.get(metric)
+        if collector is None:
+            with self._lock:
+                collector = self._metrics.get(metric)
+                if collector is None:
+                    collector = kind(
+                        self.PREFIX + metric, metric.replace('_', ' '),
+                        sorted(labels), registry=self._registry
+                    )
+                    self._metrics[metric] = collector
+        return collector.labels(**labels) if labels else collector
+
+    def observe(self, metric: str, value: float, **labels):
+        self._get(self._client.Histogram, metric, labels).observe(value)
+
+    def increment(self, metric: str, value: float = 1, **labels):
+        self._get(self._client.Counter, metric, labels).inc(value)
+
+
+class MemorySink(Sink):
+    """Aggregate in memory (count, total), for benchmarks and debugging."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.observations = defaultdict(lambda: [0, 0.0])
+        self.counters = defaultdict(float)
+
+    @staticmethod
+    def _key(metric: str, labels: dict) -> Tuple:
+        return (metric,) + tuple(sorted(labels.items()))
+
+    def observe(self, metric: str, value: float, **labels):
+        with self._lock:
+            entry = self.observations[self._key(metric, labels)]
+            entry[0] += 1
+            entry[1] += value
+
+    def increment(self, metric: str, value: float = 1, **labels):
+        with self._lock:
+            self.counters[self._key(metric, labels)] += value
+
+
+SINKS: Dict[str, Callable[[], Sink]] = {
+    'log': LoggingSink,
+    'prometheus': PrometheusSink,
+    'memory': MemorySink,
+}
+
+# Sink configured from settings on first use, see `get_sink`.
+_UNCONFIGURED = object()
+_sink = _UNCONFIGURED
+_sink_lock = threading.Lock()
+
+
+def set_sink(sink: Optional[Sink]):
+    """Set the instrumentation sink. `None` disables instrumentation."""
+    global _sink
+    _sink = sink
+
+
+def get_sink() -> Optional[Sink]:
+    sink = _sink
+    if sink is _UNCONFIGURED:
+        with _sink_lock:
+            if _sink is _UNCONFIGURED:
+                set_sink(_sink_from_settings())
+            sink = _sink
+    return sink
+
+
+def _sink_from_settings() -> Optional[Sink]:
+    name = get_settings().instrumentation
+    if not name:
+        return None
+    try:
+        return SINKS[name]()
+    except (KeyError, ImportError) as e:
+        log.warning(f"Instrumentation sink '{name}' is unavailable: {e}")
+        return None
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Timer:
+    __slots__ = ('sink', 'phase', 'labels', 'start')
+
+    def __init__(self, sink: Sink, phase: str, labels: dict):
+        self.sink = sink
+        self.phase = phase
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.sink.observe(
+            "phase_seconds", time.perf_counter() - self.start,
+            phase=self.phase, **self.labels
+        )
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed(phase: str, format: str = ""):
+    """Context manager timing a phase, labelled with the format if known."""
+    sink = get_sink()
+    if sink is None:
+        return _NULL_TIMER
+    return _Timer(sink, phase, {"format": format})
+
+
+_active = threading.local()
+
+
+def timed_method(phase: str):
+    """
+    Decorator timing a parser or reader method, labelled with the format.
+    Overridden methods calling `super()` are only timed once.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            sink = get_sink()
+            if sink is None:
+                return func(self, *args, **kwargs)
+
+            active = _active.__dict__.setdefault('phases', set())
+            if phase in active:
+                return func(self, *args, **kwargs)
+            active.add(phase)
+            try:
+                labels = {"format": type(self.format).__name__}
+                with _Timer(sink, phase, labels):
+                    return func(self, *args, **kwargs)
+            finally:
+                active.discard(phase)
+        return wrapper
+    return decorator
+
+
+def count(metric: str, value: float = 1, **labels):
+    sink = get_sink()
+    if sink is not None:
+        sink.increment(metric, value, **labels)
+
+
+def record_cache(cache: str, hit: bool):
+    sink = get_sink()
+    if sink is not None:
+        sink.increment("cache_total", cache=cache, result="hit" if hit else "miss")
+
+
+def is_enabled() -> bool:
+    return get_sink() is not None
@@ -0,0 +1,69 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+"""
+Lazy imports, so that registering formats at PIMS startup does not import
+pyvips, tifffile and format implementations.
+
+Format modules only define format classes. Their checker, parser and
+reader classes are `LazyClass` descriptors, imported from the vendor
+implementation module on first access, e.g. when a checker runs.
+"""
+import importlib
+from typing import Callable
+
+ENGINE = 'pims_plugin_format_openslide.utils.engine'
+PLANES = 'pims_plugin_format_openslide.utils.planes'
+HISTOGRAM = 'pims.formats.utils.histogram'
+
+
+class LazyClass:
+    """Class attribute importing `module.name` on first access."""
+
+    def __init__(self, module: str, name: str):
+        self.module = module
+        self.name = name
+        self.attr = None
+
+    def __set_name__(self, owner, attr: str):
+        self.attr = attr
+
+    def resolve(self):
+        return getattr(importlib.import_module(self.module), self.name)
+
+    def __get__(self, instance, owner):
+        value = self.resolve()
+        # Next accesses are plain attribute lookups.
+        if self.attr is not None and owner is not None:
+            setattr(owner, self.attr, value)
+        return value
+
+    def __repr__(self):
+        return f"LazyClass({self.module}.{self.name})"
+
+
+def lazy_module_getattr(module_name: str, *modules: str) -> Callable:
+    """
+    Module `__getattr__` (PEP 562) looking up missing names in other
+    modules, imported on first access. It keeps names moved to vendor
+    modules importable from format modules.
+    """
+    def __getattr__(name: str):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        for module in modules:
+            mod = importlib.import_module(module)
+            if hasattr(mod, name):
+                return getattr(mod, name)
+        raise AttributeError(f"module {module_name!r} has no attribute {name!r}")
+    return __getattr__
@@ -0,0 +1,127 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+"""
+Process-wide memory governor.
+
+Handles (with their OpenSlide tile cache), associated images, decoded
+tiles and free output buffers are held by separate caches, each bounded
+on its own. The governor enforces a single budget over all of them:
+when exceeded, free buffers are dropped first, then the least recently
+used entries across caches are evicted. The libvips operation cache has
+its own limit (`vips_cache_max_mem`) and is not part of the budget.
+
+`memory_usage()` reports current usage, e.g. for autoscaling decisions.
+"""
+import os
+import resource
+import threading
+from typing import Dict, Optional
+
+import pyvips
+
+from pims_plugin_format_openslide.utils.config import get_settings
+from pims_plugin_format_openslide.utils.instrumentation import count
+
+
+def current_rss() -> int:
+    """Resident set size of the current process, in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # Peak RSS, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryGovernor:
+    def __init__(self, budget: Optional[int] = None):
+        self.budget = budget
+        self._caches = dict()
+        self._lock = threading.Lock()
+
+    def register(self, name: str, cache):
+        """
+        Put a cache under the budget. Caches with a `trim(nbytes)` method
+        hold free memory, dropped first. Others must provide `oldest()`
+        and `pop_oldest()`, as `LRUCache`.
+        """
+        self._caches[name] = cache
+        cache.governor = self
+
+    @property
+    def nbytes(self) -> int:
+        return sum(cache.nbytes for cache in self._caches.values())
+
+    def usage(self) -> Dict[str, int]:
+        usage = {name: cache.nbytes for name, cache in self._caches.items()}
+        usage['total'] = sum(usage.values())
+        if self.budget is not None:
+            usage['budget'] = self.budget
+        return usage
+
+    def enforce(self) -> int:
+        """Evict cached memory until usage fits the budget. Return freed bytes."""
+        if self.budget is None:
+            return 0
+        # A single thread evicts, others go on: the budget is soft.
+        if not self._lock.acquire(blocking=False):
+            return 0
+        try:
+            excess = self.nbytes - self.budget
+            if excess <= 0:
+                return 0
+            freed = 0
+            for cache in self._caches.values():
+                if hasattr(cache, 'trim') and freed < excess:
+                    freed += cache.trim(excess - freed)
+
+            lru = [c for c in self._caches.items() if not hasattr(c[1], 'trim')]
+            while freed < excess:
+                candidates = [(cache.oldest(), name, cache) for name, cache in lru]
+                candidates = [c for c in candidates if c[0] is not None]
+                if not candidates:
+                    break
+                _, name, cache = min(candidates, key=lambda c: c[0])
+                freed += cache.pop_oldest()
+                count('memory_evictions', cache=name)
+            return freed
+        finally:
+            self._lock.release()
+
+
+_governor: Optional[MemoryGovernor] = None
+_governor_lock = threading.Lock()
+
+
+def get_memory_governor() -> MemoryGovernor:
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                settings = get_settings()
+                if settings.vips_cache_max_mem is not None:
+                    pyvips.cache_set_max_mem(settings.vips_cache_max_mem)
+                _governor = MemoryGovernor(settings.memory_budget_bytes)
+    return _governor
+
+
+def memory_usage() -> Dict[str, int]:
+    """
+    Bytes held by every governed cache, their total, the budget (if any),
+    the libvips operation cache limit and the process RSS.
+    """
+    usage = get_memory_governor().usage()
+    usage['vips_cache_max_mem'] = pyvips.cache_get_max_mem()
+    usage['rss'] = current_rss()
+    return usage
@@ -0,0 +1,196 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from pims.formats.utils.structures.metadata import MetadataStore
+
+
+class LazyNamespace:
+    __slots__ = ('keys', 'getter', 'prefix', 'loaded', '_keys')
+
+    def __init__(
+        self, keys: Callable[[], Iterable[str]], getter: Callable[[str], Any],
+        prefix: Optional[str] = None
+    ):
+        self.keys = keys
+        self.getter = getter
+        # Key prefix given to the store, if different from the namespace.
+        self.prefix = prefix
+        self.loaded = set()
+        self._keys = None
+
+    def list_keys(self) -> List[str]:
+        if self._keys is None:
+            self._keys = list(self.keys())
+        return self._keys
+
+
+def _split_namespaced_key(namespaced_key: str) -> Tuple[str, str]:
+    split = namespaced_key.split('.', 1)
+    if len(split) < 2:
+        return "", namespaced_key
+    return split[0].upper(), split[1]
+
+
+class LazyMetadataStore(MetadataStore):
+    """
+    Metadata store whose namespaces are read on demand from a cached file
+    handle. Looking up a key only reads this key, listing a namespace or the
+    whole store reads the concerned lazy namespaces once.
+    """
+
+    def __init__(self, store: Optional[MetadataStore] = None):
+        super().__init__()
+        if store is not None:
+            # Adopt the eager namespaces of `store`, values are shared.
+            self._namedstores.update(store._namedstores)
+        self._lazy: Dict[str, LazyNamespace] = dict()
+        self._lazy_lock = threading.RLock()
+
+    @classmethod
+    def from_store(cls, store: MetadataStore) -> 'LazyMetadataStore':
+        """Take over the (eager) content of an existing store."""
+        return cls(store)
+
+    def set_lazy(
+        self, namespace: str, keys: Callable[[], Iterable[str]],
+        getter: Callable[[str], Any], prefix: Optional[str] = None
+    ):
+        """
+        Register a lazy namespace. `keys` lists the keys (without namespace)
+        and `getter` reads the value of one of them.
+        """
+        self._lazy[namespace.upper()] = LazyNamespace(keys, getter, prefix)
+
+    def _store(self, namespace: str, lazy: LazyNamespace, key: str):
+        if key in lazy.loaded:
+            return
+        lazy.loaded.add(key)
+        value = lazy.getter(key)
+        if lazy.prefix is not None:
+            super().set(f"{lazy.prefix}.{key}", value)
+        else:
+            super().set(key, value, namespace=namespace)
+
+    def _materialize_key(self, namespaced_key: str):
+        if not self._lazy:
+            return
+        namespace, key = _split_namespaced_key(namespaced_key)
+        lazy = self._lazy.get(namespace)
+        if lazy is not None and key in lazy.list_keys():
+            with self._lazy_lock:
+                self._store(namespace, lazy, key)
+
+    def _materialize(self, namespace: Optional[str] = None):
+        if not self._lazy:
+            return
+        with self._lazy_lock:
+            if namespace is None:
+                namespaces = list(self._lazy.keys())
+            else:
+                namespaces = [namespace.upper()]
+            for ns in namespaces:
+                lazy = self._lazy.pop(ns, None)
+                if lazy is None:
+                    continue
+                for key in lazy.list_keys():
+                    self._store(ns, lazy, key)
+
+    # Key access: read only the requested key.
+
+    def get(self, namespaced_key, *args, **kwargs):
+        self._materialize_key(namespaced_key)
+        return super().get(namespaced_key, *args, **kwargs)
+
+    def get_value(self, namespaced_key, *args, **kwargs):
+        self._materialize_key(namespaced_key)
+        return super().get_value(namespaced_key, *args, **kwargs)
+
+    def get_metadata_type(self, namespaced_key, *args, **kwargs):
+        self._materialize_key(namespaced_key)
+        return super().get_metadata_type(namespaced_key, *args, **kwargs)
+
+    def __getitem__(self, namespaced_key):
+        self._materialize_key(namespaced_key)
+        return super().__getitem__(namespaced_key)
+
+    def __contains__(self, namespaced_key):
+        self._materialize_key(namespaced_key)
+        return super().__contains__(namespaced_key)
+
+    # Namespace access: read the requested namespace.
+
+    def get_namedstore(self, namespace, *args, **kwargs):
+        self._materialize(namespace)
+        return super().get_namedstore(namespace, *args, **kwargs)
+
+    # Full access: read every lazy namespace.
+
+    def keys(self):
+        self._materialize()
+        return super().keys()
+
+    def values(self):
+        self._materialize()
+        return super().values()
+
+    def items(self):
+        self._materialize()
+        return super().items()
+
+    def flatten(self):
+        self._materialize()
+        return super().flatten()
+
+    def __iter__(self):
+        self._materialize()
+        return super().__iter__()
+
+    def __len__(self):
+        self._materialize()
+        return super().__len__()
+
+    def __repr__(self):
+        self._materialize()
+        return super().__repr__()
+
+    def namespaces(self) -> List[str]:
+        """Namespaces available in the store, without reading them."""
+        return sorted(set(self._namedstores.keys()) | set(self._lazy.keys()))
+
+    def page(
+        self, namespace: str, offset: int = 0, limit: Optional[int] = None
+    ) -> List[Tuple[str, Any]]:
+        """
+        Get (key, value) pairs of a namespace, reading only the requested
+        page for lazy namespaces.
+        """
+        namespace = namespace.upper()
+        lazy = self._lazy.get(namespace)
+        if lazy is None:
+            keys = sorted(self.get_namedstore(namespace) or [])
+            end = None if limit is None else offset + limit
+            return [
+                (key, self.get_value(f"{namespace}.{key}"))
+                for key in keys[offset:end]
+            ]
+
+        keys = sorted(lazy.list_keys())
+        end = None if limit is None else offset + limit
+        return [(key, lazy.getter(key)) for key in keys[offset:end]]
+
+    def select(self, namespaced_keys: Iterable[str]) -> Dict[str, Any]:
+        """Get values of some keys, reading only these keys."""
+        return {key: self.get_value(key) for key in namespaced_keys}
@@ -0,0 +1,200 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+"""
+Focal planes (z-stacks) of TIFF-based slides.
+
+OpenSlide only gives access to one focal plane. Z-stacked TIFF slides
+(e.g. Aperio SVS) store the planes of every pyramid level in one page with
+an ImageDepth greater than 1, read here with tifffile. Extended focus
+fuses the planes of a window into a single image.
+"""
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from pims.formats import AbstractFormat
+from pims.formats.utils.engines.tifffile import cached_tifffile
+from pims.formats.utils.structures.metadata import ImageMetadata
+from pims_plugin_format_openslide.utils.channels import (
+    channel_list, is_stain_request, stain_channels, to_numpy
+)
+from pims_plugin_format_openslide.utils.engine import (
+    OpenslideVipsReader, get_read_executor
+)
+from pims_plugin_format_openslide.utils.instrumentation import timed
+from pims_plugin_format_openslide.utils.tiff import (
+    TiffTileReader, cached_tiff_tile_reader, to_vips
+)
+
+FUSION_METHODS = ('sharpest', 'max', 'min', 'mean')
+# Side of the neighbourhood on which focus of a plane is measured
+FOCUS_WINDOW = 9
+
+
+@dataclass
+class ZPlanes:
+    n_planes: int
+    # Page index of every z-stacked level, by (width, height)
+    pages: Dict[Tuple[int, int], int] = field(default_factory=dict)
+
+
+def find_z_planes(tf) -> Optional[ZPlanes]:
+    """Z-stacked pages of a TIFF file, if any."""
+    pages = dict()
+    depths = []
+    for index, page in enumerate(tf.pages):
+        if page.imagedepth > 1:
+            pages.setdefault((page.imagewidth, page.imagelength), index)
+            depths.append(page.imagedepth)
+    if not pages:
+        return None
+    return ZPlanes(min(depths), pages)
+
+
+def _load_z_planes(format: AbstractFormat) -> Optional[ZPlanes]:
+    return find_z_planes(cached_tifffile(format))
+
+
+def cached_z_planes(format: AbstractFormat) -> Optional[ZPlanes]:
+    return format.get_cached('_z_planes', _load_z_planes, format)
+
+
+def apply_z_planes(imd: ImageMetadata, planes: Optional[ZPlanes]) -> ImageMetadata:
+    if planes is not None:
+        imd.depth = planes.n_planes
+    return imd
+
+
+def _box_sum(image: np.ndarray, size: int) -> np.ndarray:
+    """Sum over a size x size neighbourhood of the last two axes."""
+    pad = size // 2
+    padded = np.pad(image, [(0, 0)] * (image.ndim - 2) + [(pad + 1, pad)] * 2, mode='edge')
+    integral = padded.cumsum(axis=-1).cumsum(axis=-2)
+    return integral[..., size:, size:] - integral[..., :-size, size:] \
+        - integral[..., size:, :-size] + integral[..., :-size, :-size]
+
+
+def fuse_planes(stack: np.ndarray, method: str = 'sharpest') -> np.ndarray:
+    """
+    Fuse a (planes, height, width, channels) stack into one image. The
+    'sharpest' method takes every pixel from the plane with the highest
+    local contrast (Laplacian energy), others are projections.
+    """
+    if method == 'max':
+        return stack.max(axis=0)
+    if method == 'min':
+        return stack.min(axis=0)
+    if method == 'mean':
+        return stack.mean(axis=0).astype(stack.dtype)
+    if method != 'sharpest':
+        raise ValueError(f"Unknown fusion method {method}, use one of {FUSION_METHODS}")
+
+    gray = stack.astype(np.float32).mean(axis=-1)
+    padded = np.pad(gray, [(0, 0), (1, 1), (1, 1)], mode='edge')
+    laplacian = 4 * gray - padded[:, :-2, 1:-1] - padded[:, 2:, 1:-1] \
+        - padded[:, 1:-1, :-2] - padded[:, 1:-1, 2:]
+    energy = _box_sum(laplacian ** 2, FOCUS_WINDOW)
+    best = energy.argmax(axis=0)
+    return np.take_along_axis(stack, best[None, :, :, None], axis=0)[0]
+
+
+class ZStackReader(OpenslideVipsReader):
+    """
+    Reads of z-stacked levels go through tifffile, for the requested plane
+    (first plane by default), at native bit depth. Other levels are read
+    with OpenSlide.
+    """
+
+    def _plane_reader(self, tier) -> Optional[TiffTileReader]:
+        if tier.data.get('sidecar_path') is not None:
+            return None
+        planes = cached_z_planes(self.format)
+        if planes is None:
+            return None
+        index = planes.pages.get((tier.width, tier.height))
+        if index is None:
+            return None
+        return cached_tiff_tile_reader(
+            self.format, cached_tifffile(self.format), index
+        )
+
+    def _read_area(
+        self, tier, left: int, top: int, width: int, height: int,
+        c=None, z: Optional[int] = None
+    ):
+        reader = self._plane_reader(tier)
+        if reader is None:
+            return super()._read_area(tier, left, top, width, height, c)
+        samples = None if c is None else channel_list(c, reader.n_samples)
+        with timed('read_plane'):
+            array = reader.read(left, top, width, height, z or 0, samples)
+        return to_vips(array)
+
+    def _read_area_array(
+        self, tier, left: int, top: int, width: int, height: int, c=None,
+        z: Optional[int] = None
+    ) -> np.ndarray:
+        reader = self._plane_reader(tier)
+        stains = is_stain_request(c)
+        if reader is None or (stains and reader.dtype != np.uint8):
+            # Colour deconvolution needs 8-bit RGB, given by OpenSlide.
+            return super()._read_area_array(tier, left, top, width, height, c)
+        if stains:
+            rgb = reader.read(left, top, width, height, z or 0, [0, 1, 2])
+            return stain_channels(rgb, c)
+        samples = None if c is None else channel_list(c, reader.n_samples)
+        return reader.read(left, top, width, height, z or 0, samples)
+
+    def read_window(self, region, out_width, out_height, c=None, z=None, **other):
+        tier, window = self._locate(region, out_width, out_height)
+        return self._read_area(tier, *window, c, z)
+
+    def read_window_array(
+        self, region, out_width: int, out_height: int, c=None,
+        z: Optional[int] = None
+    ) -> np.ndarray:
+        tier, window = self._locate(region, out_width, out_height)
+        return self._read_area_array(tier, *window, c, z)
+
+    def read_tile(self, tile, c=None, z=None, **other):
+        return self._cached_tile(tile, c, lambda: self._read_area(
+            tile.tier, tile.left, tile.top, tile.width, tile.height, c, z
+        ), z or 0)
+
+    def read_tile_array(self, tile, c=None, z: Optional[int] = None) -> np.ndarray:
+        return self._read_area_array(
+            tile.tier, tile.left, tile.top, tile.width, tile.height, c, z
+        )
+
+    def read_extended_focus(
+        self, region, out_width: int, out_height: int,
+        method: str = 'sharpest', c=None
+    ) -> np.ndarray:
+        """
+        Read a window on all focal planes concurrently and fuse them (see
+        `fuse_planes`), as a (height, width, channels) array at the most
+        appropriate tier.
+        """
+        tier, window = self._locate(region, out_width, out_height)
+        reader = self._plane_reader(tier)
+        if reader is None:
+            return to_numpy(self._read_area(tier, *window, c))
+
+        samples = None if c is None else channel_list(c, reader.n_samples)
+        planes: List[np.ndarray] = list(get_read_executor().map(
+            lambda z: reader.read(*window, z, samples), range(reader.depth)
+        ))
+        with timed('fuse_planes'):
+            return fuse_planes(np.stack(planes), method)
@@ -0,0 +1,120 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+from typing import List, Tuple
+
+import numpy as np
+
+from pims.formats import AbstractFormat
+from pims.formats.utils.structures.pyramid import Pyramid
+from pims_plugin_format_openslide.utils.handles import get_handle_pool
+
+Window = Tuple[int, int, int, int]
+
+
+class CompactPyramid:
+    """
+    Array-backed view of a pyramid, from largest to smallest tier.
+    Tier selection and window scaling work on plain numbers, without
+    allocating region or tier objects per request. Tier objects are shared
+    with the source pyramid, not copied.
+    """
+    __slots__ = (
+        'widths', 'heights', 'tile_widths', 'tile_heights',
+        'width_factors', 'height_factors', 'average_factors', 'tiers'
+    )
+
+    def __init__(
+        self, widths, heights, tile_widths, tile_heights, tiers: List = None
+    ):
+        self.widths = np.asarray(widths, dtype=np.int64)
+        self.heights = np.asarray(heights, dtype=np.int64)
+        self.tile_widths = np.asarray(tile_widths, dtype=np.int32)
+        self.tile_heights = np.asarray(tile_heights, dtype=np.int32)
+        self.width_factors = self.widths[0] / self.widths
+        self.height_factors = self.heights[0] / self.heights
+        self.average_factors = (self.width_factors + self.height_factors) / 2
+        self.tiers = tiers
+
+    @classmethod
+    def from_pyramid(cls, pyramid: Pyramid) -> 'CompactPyramid':
+        tiers = sorted(pyramid.tiers, key=lambda t: t.width, reverse=True)
+        return cls(
+            [t.width for t in tiers], [t.height for t in tiers],
+            [t.tile_width for t in tiers], [t.tile_height for t in tiers],
+            tiers
+        )
+
+    def __len__(self) -> int:
+        return len(self.widths)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in self.__slots__[:-1])
+
+    def levels_for_downsamples(self, downsamples) -> np.ndarray:
+        """
+        Most appropriate level for each downsample factor: the smallest
+        tier which is not smaller than requested.
+        """
+        levels = np.searchsorted(
+            self.average_factors, np.asarray(downsamples), side='right'
+        ) - 1
+        return np.clip(levels, 0, len(self) - 1)
+
+    def level_for_downsample(self, downsample: float) -> int:
+        return int(self.levels_for_downsamples(downsample))
+
+    def scale_window(
+        self, level: int, left: float, top: float, width: float, height: float
+    ) -> Window:
+        """
+        Scale a window given at full resolution to a level. The scaled window
+        covers the whole requested area and is clipped to level bounds.
+        """
+        wf = self.width_factors[level]
+        hf = self.height_factors[level]
+        x0 = max(int(left // wf), 0)
+        y0 = max(int(top // hf), 0)
+        x1 = min(int(np.ceil((left + width) / wf)), int(self.widths[level]))
+        y1 = min(int(np.ceil((top + height) / hf)), int(self.heights[level]))
+        return x0, y0, max(x1 - x0, 1), max(y1 - y0, 1)
+
+    def locate(
+        self, left: float, top: float, width: float, height: float,
+        out_width: int, out_height: int
+    ) -> Tuple[int, Window]:
+        """
+        Get the most appropriate level to read a full resolution window at
+        a given output size, and the window scaled to that level.
+        """
+        downsample = (width / out_width + height / out_height) / 2
+        level = self.level_for_downsample(downsample)
+        return level, self.scale_window(level, left, top, width, height)
+
+
+def _shared_compact_pyramid(format: AbstractFormat) -> CompactPyramid:
+    return get_handle_pool().compact_pyramid(
+        format.path, type(format).__name__,
+        lambda: CompactPyramid.from_pyramid(format.pyramid)
+    )
+
+
+def cached_compact_pyramid(format: AbstractFormat) -> CompactPyramid:
+    """
+    Compact pyramid view of a slide, kept in the process-wide handle pool
+    (as long as the slide handles) and cached on the format instance.
+    """
+    return format.get_cached(
+        '_compact_pyramid', _shared_compact_pyramid, format
+    )
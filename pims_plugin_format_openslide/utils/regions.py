@@ -0,0 +1,78 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+"""
+Spatial index of the rectangular regions (e.g. scanned tissue areas) of a
+slide, as sorted interval arrays.
+"""
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from pims_plugin_format_openslide.utils.tilegrid import Window
+
+
+class RegionIndex:
+    """
+    Index of rectangular regions, given as (left, top, width, height)
+    windows, sorted by left bound. Queries only test regions whose left
+    bound is compatible with the queried window.
+    """
+
+    def __init__(self, windows: Sequence[Window]):
+        windows = np.asarray(windows, dtype=np.int64).reshape(-1, 4)
+        self.order = np.argsort(windows[:, 0], kind='stable')
+        windows = windows[self.order]
+        self.lefts = windows[:, 0]
+        self.tops = windows[:, 1]
+        self.rights = windows[:, 0] + windows[:, 2]
+        self.bottoms = windows[:, 1] + windows[:, 3]
+        self.max_width = int(windows[:, 2].max()) if len(windows) else 0
+
+    def __len__(self) -> int:
+        return len(self.lefts)
+
+    def _candidates(self, left: int, right: int) -> slice:
+        # Regions starting after the window or ending before it are skipped.
+        return slice(
+            np.searchsorted(self.lefts, left - self.max_width, side='right'),
+            np.searchsorted(self.lefts, right, side='left')
+        )
+
+    def intersecting(self, window: Window) -> List[int]:
+        """Indexes of the regions intersecting a window."""
+        left, top, width, height = window
+        right, bottom = left + width, top + height
+        candidates = self._candidates(left, right)
+        hits = (
+            (self.rights[candidates] > left)
+            & (self.tops[candidates] < bottom)
+            & (self.bottoms[candidates] > top)
+        )
+        return sorted(
+            int(i) for i in self.order[candidates][hits]
+        )
+
+    def containing(self, window: Window) -> Optional[int]:
+        """Index of a region containing the whole window, if any."""
+        left, top, width, height = window
+        candidates = self._candidates(left, left + width)
+        hits = np.flatnonzero(
+            (self.lefts[candidates] <= left)
+            & (self.rights[candidates] >= left + width)
+            & (self.tops[candidates] <= top)
+            & (self.bottoms[candidates] >= top + height)
+        )
+        if len(hits) == 0:
+            return None
+        return int(self.order[candidates][hits[0]])
@@ -0,0 +1,164 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from pyvips import Error as VIPSError, Image as VIPSImage
+
+from pims.formats import AbstractFormat
+from pims.formats.utils.structures.pyramid import Pyramid
+from pims_plugin_format_openslide.utils.config import get_settings
+from pims_plugin_format_openslide.utils.handles import invalidate
+
+log = logging.getLogger("pims.app")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_pending = set()
+_lock = threading.Lock()
+
+
+def sidecar_path(path: Path, source_level: int) -> Path:
+    """Path of the sidecar pyramid built from a given stored level."""
+    path = Path(path)
+    return path.with_name(f".{path.name}.levels-{source_level}.tif")
+
+
+def find_gaps(downsamples: List[float], max_gap: float) -> List[int]:
+    """
+    Get stored levels whose next stored level is more than `max_gap`
+    times smaller.
+    """
+    return [
+        level for level in range(len(downsamples) - 1)
+        if downsamples[level + 1] / downsamples[level] > max_gap
+    ]
+
+
+def write_pyramid(source: VIPSImage, dest: Path, tile_size: int, quality: int):
+    """
+    Write a tiled pyramidal TIFF of an image, atomically (temporary file and
+    rename). Vips streams the source region by region so that memory usage
+    does not depend on the image size.
+    """
+    tmp = dest.with_name(f"{dest.name}.{os.getpid()}.tmp")
+    try:
+        source.tiffsave(
+            str(tmp), tile=True, pyramid=True, bigtiff=True,
+            tile_width=tile_size, tile_height=tile_size,
+            compression='jpeg', Q=quality
+        )
+        os.replace(tmp, dest)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def build_sidecar(path: str, source_level: int, dest: Path):
+    """
+    Write a tiled pyramidal TIFF whose first page is the source level
+    downsampled by 2.
+    """
+    settings = get_settings()
+    source = VIPSImage.openslideload(path, level=source_level)
+    if source.hasalpha():
+        source = source.flatten()
+    write_pyramid(
+        source.shrink(2, 2), dest, settings.sidecar_tile_size,
+        settings.sidecar_quality
+    )
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=get_settings().sidecar_workers,
+            thread_name_prefix="openslide-sidecar"
+        )
+    return _executor
+
+
+def schedule_build(
+    path: Path, dest: Path, build: Callable[[], None], name: str = "Sidecar pyramid"
+):
+    """
+    Build a file derived from a slide in background, at most once at a
+    time per file. Cached handles, parsed metadata and decoded tiles of the
+    slide are dropped once it is built, so that next parsing uses it.
+    """
+    with _lock:
+        if dest in _pending:
+            return
+        _pending.add(dest)
+
+    def _run():
+        try:
+            build()
+            invalidate(path)
+            log.info(f"{name} {dest} has been built.")
+        except (VIPSError, OSError) as e:
+            log.warning(f"{name} {dest} could not be built: {e}")
+        finally:
+            with _lock:
+                _pending.discard(dest)
+
+    _get_executor().submit(_run)
+
+
+def schedule_sidecar_build(path: Path, source_level: int, dest: Path):
+    """Build a sidecar in background, at most once at a time per file."""
+    schedule_build(path, dest, partial(build_sidecar, str(path), source_level, dest))
+
+
+def add_sidecar_tiers(
+    format: AbstractFormat, pyramid: Pyramid, stored: List[Tuple[int, int]]
+) -> Pyramid:
+    """
+    Insert synthetic tiers in sparse pyramids, from sidecar pyramids built
+    between stored levels (given as (width, height) tuples). Missing sidecars
+    are scheduled for build and will be available for next parsing.
+    """
+    settings = get_settings()
+    if not settings.sparse_pyramid_sidecar or len(stored) < 2:
+        return pyramid
+
+    base_width = stored[0][0]
+    downsamples = [base_width / width for width, _ in stored]
+    for level in find_gaps(downsamples, settings.sparse_pyramid_max_gap):
+        dest = sidecar_path(format.path, level)
+        if not dest.exists():
+            schedule_sidecar_build(format.path, level, dest)
+            continue
+
+        try:
+            n_pages = VIPSImage.tiffload(str(dest)).get('n-pages')
+            for page in range(n_pages):
+                head = VIPSImage.tiffload(str(dest), page=page)
+                # Keep only tiers at least 2 times larger than next stored level
+                if 2 * base_width / head.width > downsamples[level + 1]:
+                    break
+                pyramid.insert_tier(
+                    head.width, head.height,
+                    (settings.sidecar_tile_size, settings.sidecar_tile_size),
+                    sidecar_path=str(dest), sidecar_page=page
+                )
+        except VIPSError as e:
+            log.warning(f"Sidecar pyramid {dest} is unreadable: {e}")
+
+    return pyramid
@@ -0,0 +1,144 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+"""
+Direct access to the tiles (or strips) of a TIFF page with tifffile, at
+native bit depth and for any focal plane, bypassing OpenSlide.
+
+Decoded tiles are kept in the process-wide decoded tile cache, keyed by
+page, plane and sample so that planes and channels are cached
+independently.
+"""
+from typing import List, Optional
+
+import numpy as np
+
+from pyvips import Image as VIPSImage
+
+from pims_plugin_format_openslide.utils.channels import VIPS_FORMATS
+from pims_plugin_format_openslide.utils.handles import fingerprint, get_tile_cache
+from pims_plugin_format_openslide.utils.instrumentation import count, is_enabled, timed
+
+
+def to_vips(array: np.ndarray) -> VIPSImage:
+    """Wrap a (height, width, samples) array in a vips image, without copy."""
+    array = np.ascontiguousarray(array)
+    height, width, bands = array.shape
+    return VIPSImage.new_from_memory(
+        array.data, width, height, bands, VIPS_FORMATS[array.dtype.name]
+    )
+
+
+class TiffTileReader:
+    """Tiles of a TIFF page, decoded by tifffile."""
+
+    def __init__(self, path: str, page_index: int, page):
+        self.path = str(path)
+        self.page_index = page_index
+        self.page = page
+        self.fingerprint = fingerprint(self.path)
+        # Tiles are read concurrently from the shared file handle.
+        page.parent.filehandle.set_lock(True)
+
+        self.width = page.imagewidth
+        self.height = page.imagelength
+        self.depth = page.imagedepth
+        self.dtype = page.dtype
+        self.separate = page.planarconfig == 2
+        self.n_samples = page.samplesperpixel
+        if page.is_tiled:
+            self.tile_width, self.tile_height = page.tilewidth, page.tilelength
+            self.tile_depth = page.tiledepth
+        else:
+            # Strips are tiles as wide as the image.
+            self.tile_width = self.width
+            self.tile_height = min(page.rowsperstrip or self.height, self.height)
+            self.tile_depth = 1
+        self.cols = -(-self.width // self.tile_width)
+        self.rows = -(-self.height // self.tile_height)
+        self.depth_tiles = -(-self.depth // self.tile_depth)
+
+    def _segment(self, z: int, row: int, col: int, sample: int) -> np.ndarray:
+        index = (
+            (sample * self.depth_tiles + z // self.tile_depth) * self.rows + row
+        ) * self.cols + col
+        offset = self.page.dataoffsets[index]
+        length = self.page.databytecounts[index]
+        fh = self.page.parent.filehandle
+        data = None
+        if length:
+            with timed('read_segment'), fh.lock:
+                fh.seek(offset)
+                data = fh.read(length)
+        with timed('decode'):
+            segment, _, shape = self.page.decode(
+                data, index, jpegtables=self.page.jpegtables
+            )
+        if segment is None:
+            segment = np.zeros(shape, dtype=self.dtype)
+        if is_enabled():
+            count('decoded_segment_bytes', segment.nbytes)
+        # (depth, height, width, samples) to (height, width, samples)
+        return segment[z % self.tile_depth]
+
+    def tile(self, z: int, row: int, col: int, sample: int = 0) -> np.ndarray:
+        """
+        Decoded tile, as a (height, width, samples) array. For separate
+        sample planes, only the given sample is decoded.
+        """
+        key = (
+            self.path, self.fingerprint, 'tiff', self.page_index,
+            z, row, col, sample if self.separate else None
+        )
+        return get_tile_cache().get_or_create(
+            key, lambda: self._segment(z, row, col, sample)
+        )
+
+    def read(
+        self, left: int, top: int, width: int, height: int, z: int = 0,
+        samples: Optional[List[int]] = None, out: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Read a window of a plane as a (height, width, samples) array of
+        native dtype, with only the requested samples (all if None).
+        """
+        if not 0 <= z < self.depth:
+            raise ValueError(f"Invalid plane {z} (depth {self.depth})")
+        if samples is None:
+            samples = list(range(self.n_samples))
+        if out is None:
+            out = np.empty((height, width, len(samples)), dtype=self.dtype)
+
+        for row in range(top // self.tile_height, (top + height - 1) // self.tile_height + 1):
+            for col in range(left // self.tile_width, (left + width - 1) // self.tile_width + 1):
+                tile_left, tile_top = col * self.tile_width, row * self.tile_height
+                x0, y0 = max(left, tile_left), max(top, tile_top)
+                x1 = min(left + width, tile_left + self.tile_width, self.width)
+                y1 = min(top + height, tile_top + self.tile_height, self.height)
+                target = out[y0 - top:y1 - top, x0 - left:x1 - left]
+                source = (slice(y0 - tile_top, y1 - tile_top),
+                          slice(x0 - tile_left, x1 - tile_left))
+                if self.separate:
+                    for i, sample in enumerate(samples):
+                        target[..., i] = self.tile(z, row, col, sample)[source][..., 0]
+                else:
+                    target[...] = self.tile(z, row, col)[source][..., samples]
+        return out
+
+
+def cached_tiff_tile_reader(format, tf, page_index: int) -> TiffTileReader:
+    """Tile reader of a page of a tifffile handle, cached on the format."""
+    return format.get_cached(
+        f'_tiff_tiles{page_index}', TiffTileReader,
+        format.path, page_index, tf.pages[page_index]
+    )
@@ -0,0 +1,155 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+"""
+Deep Zoom (DZI) and IIIF tile grids.
+
+Viewers request tiles on power-of-two levels and with tile sizes that do not
+match native tiers. Grid tiles are mapped to full resolution windows, which
+are read from the native tiles of the most appropriate tier (see
+`OpenslideVipsReader.read_grid_window`).
+"""
+import math
+import re
+from typing import List, Tuple
+
+Window = Tuple[int, int, int, int]
+
+
+class DeepZoomGrid:
+    """
+    Deep Zoom tile grid of an image, as in the Deep Zoom Image (DZI) format:
+    level 0 is 1x1 pixel, last level is the full resolution image.
+    """
+
+    def __init__(
+        self, width: int, height: int, tile_size: int = 254, overlap: int = 1
+    ):
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.overlap = overlap
+
+        dimensions = [(width, height)]
+        while dimensions[-1] != (1, 1):
+            w, h = dimensions[-1]
+            dimensions.append((max(1, math.ceil(w / 2)), max(1, math.ceil(h / 2))))
+        self.level_dimensions: List[Tuple[int, int]] = dimensions[::-1]
+
+    @property
+    def level_count(self) -> int:
+        return len(self.level_dimensions)
+
+    def tile_count(self, level: int) -> Tuple[int, int]:
+        w, h = self.level_dimensions[level]
+        return math.ceil(w / self.tile_size), math.ceil(h / self.tile_size)
+
+    def tile_window(self, level: int, col: int, row: int) -> Window:
+        """Window of a tile, overlap included, in level coordinates."""
+        if not 0 <= level < self.level_count:
+            raise ValueError(f"Invalid level {level}")
+        cols, rows = self.tile_count(level)
+        if not (0 <= col < cols and 0 <= row < rows):
+            raise ValueError(f"Invalid tile ({col}, {row}) at level {level}")
+
+        w, h = self.level_dimensions[level]
+        x = col * self.tile_size - (self.overlap if col > 0 else 0)
+        y = row * self.tile_size - (self.overlap if row > 0 else 0)
+        x1 = min((col + 1) * self.tile_size + self.overlap, w)
+        y1 = min((row + 1) * self.tile_size + self.overlap, h)
+        return x, y, x1 - x, y1 - y
+
+    def base_window(self, level: int, col: int, row: int) -> Tuple[Window, Tuple[int, int]]:
+        """
+        Full resolution window of a tile and the tile output size.
+        """
+        x, y, w, h = self.tile_window(level, col, row)
+        level_width, level_height = self.level_dimensions[level]
+        sx = self.width / level_width
+        sy = self.height / level_height
+        left, top = round(x * sx), round(y * sy)
+        right = min(round((x + w) * sx), self.width)
+        bottom = min(round((y + h) * sy), self.height)
+        return (left, top, right - left, bottom - top), (w, h)
+
+
+_IIIF_REGION = re.compile(r'^(pct:)?([\d.]+),([\d.]+),([\d.]+),([\d.]+)$')
+_IIIF_SIZE = re.compile(r'^(\^)?(!)?(\d*),(\d*)$')
+
+
+def parse_iiif_region(region: str, width: int, height: int) -> Window:
+    """Full resolution window of a IIIF Image API region parameter."""
+    if region == 'full':
+        return 0, 0, width, height
+    if region == 'square':
+        side = min(width, height)
+        return (width - side) // 2, (height - side) // 2, side, side
+
+    match = _IIIF_REGION.match(region)
+    if match is None:
+        raise ValueError(f"Invalid IIIF region '{region}'")
+    values = [float(v) for v in match.groups()[1:]]
+    if match.group(1):
+        values = [
+            values[0] * width / 100, values[1] * height / 100,
+            values[2] * width / 100, values[3] * height / 100
+        ]
+    left, top, w, h = (int(round(v)) for v in values)
+    w, h = min(w, width - left), min(h, height - top)
+    if w <= 0 or h <= 0:
+        raise ValueError(f"IIIF region '{region}' is outside the image")
+    return left, top, w, h
+
+
+def parse_iiif_size(size: str, region_width: int, region_height: int) -> Tuple[int, int]:
+    """Output size of a IIIF Image API size parameter."""
+    if size in ('full', 'max', '^max'):
+        return region_width, region_height
+    if size.lstrip('^').startswith('pct:'):
+        scale = float(size.lstrip('^')[4:]) / 100
+        return max(1, round(region_width * scale)), max(1, round(region_height * scale))
+
+    match = _IIIF_SIZE.match(size)
+    if match is None or not (match.group(3) or match.group(4)):
+        raise ValueError(f"Invalid IIIF size '{size}'")
+    w = int(match.group(3)) if match.group(3) else None
+    h = int(match.group(4)) if match.group(4) else None
+    if match.group(2) and w and h:
+        scale = min(w / region_width, h / region_height)
+        return max(1, round(region_width * scale)), max(1, round(region_height * scale))
+    if w is None:
+        w = max(1, round(region_width * h / region_height))
+    if h is None:
+        h = max(1, round(region_height * w / region_width))
+    return w, h
+
+
+def clip_window(window: Window, width: int, height: int) -> Window:
+    """Part of a window inside an image."""
+    left, top, w, h = window
+    x0, y0 = max(left, 0), max(top, 0)
+    x1, y1 = min(left + w, width), min(top + h, height)
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError(f"Window {window} is outside the image")
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def native_tiles(
+    window: Window, tile_width: int, tile_height: int
+) -> Tuple[range, range]:
+    """Columns and rows of native tiles covering a window at a tier."""
+    left, top, width, height = window
+    return (
+        range(left // tile_width, (left + width - 1) // tile_width + 1),
+        range(top // tile_height, (top + height - 1) // tile_height + 1)
+    )
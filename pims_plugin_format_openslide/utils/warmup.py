@@ -0,0 +1,199 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+"""
+Warm-up of a worker before it accepts traffic.
+
+Hot slides, given explicitly or found in recent access logs, are opened
+to prime the process-wide handle pool and parsed metadata cache, and the
+tier used for overview rendering is decoded to fill OpenSlide tile cache.
+It is meant to be run in the worker process, e.g. from a gunicorn
+`post_worker_init` hook:
+
+    def post_worker_init(worker):
+        from pims_plugin_format_openslide.utils.warmup import warm_up_from_settings
+        warm_up_from_settings()
+"""
+import logging
+import os
+import re
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional
+
+from pims_plugin_format_openslide.utils.config import get_settings
+from pims_plugin_format_openslide.utils.memory import current_rss
+
+log = logging.getLogger("pims.app")
+
+# Image paths in PIMS routes, e.g. `GET /image/upload1/processed/x.svs/tile/...`
+ACCESS_LOG_PATTERN = re.compile(
+    r'/image/(?P<path>\S+?)/(?:info|tile|normalized-tile|window|thumb|resized|'
+    r'associated|histogram|metadata)'
+)
+
+
+def slides_from_access_log(
+    log_path: str, root: Optional[str] = None, limit: int = 100,
+    max_lines: int = 100000, pattern: re.Pattern = ACCESS_LOG_PATTERN
+) -> List[str]:
+    """
+    Most requested slides among the last lines of an access log, most
+    requested first. Paths are made absolute with `root`, if given.
+    """
+    with open(log_path, errors='replace') as f:
+        lines = deque(f, maxlen=max_lines)
+
+    counts = Counter()
+    for line in lines:
+        match = pattern.search(line)
+        if match:
+            counts[match.group('path')] += 1
+
+    slides = []
+    for path, _ in counts.most_common():
+        if root is not None:
+            path = os.path.join(root, path.lstrip('/'))
+        if os.path.exists(path):
+            slides.append(path)
+            if len(slides) >= limit:
+                break
+    return slides
+
+
+@dataclass
+class WarmupReport:
+    warmed: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+    skipped: List[str] = field(default_factory=list)
+    elapsed: float = 0.0
+    rss_growth: int = 0
+
+
+def warm_slide(path: str, overview_size: int) -> bool:
+    """
+    Open a slide, parse its metadata and decode its overview tier.
+    Return False if the slide is not in an OpenSlide format.
+    """
+    from pims.files.file import Path as PIMSPath
+    from pims.formats.utils.abstract import CachedDataPath
+    from pims_plugin_format_openslide.utils.ingest import openslide_formats
+    from pims_plugin_format_openslide.utils.pyramid import cached_compact_pyramid
+
+    proxy = CachedDataPath(PIMSPath(path))
+    format_class = next((f for f in openslide_formats() if f.match(proxy)), None)
+    if format_class is None:
+        return False
+
+    format = format_class.from_proxy(proxy)
+    format.main_imd  # noqa
+    format.full_imd  # noqa
+    pyramid = cached_compact_pyramid(format)
+
+    width, height = int(pyramid.widths[0]), int(pyramid.heights[0])
+    level, (left, top, w, h) = pyramid.locate(
+        0, 0, width, height, overview_size, overview_size
+    )
+    reader = format.reader
+    if hasattr(reader, '_read_area'):
+        # Decoding fills the tile cache of the pooled OpenSlide handle.
+        reader._read_area(pyramid.tiers[level], left, top, w, h).avg()
+    return True
+
+
+def warm_up(
+    paths: Iterable[str], time_budget: float = 60,
+    memory_budget: Optional[int] = None, workers: int = 4,
+    overview_size: int = 1024
+) -> WarmupReport:
+    """
+    Warm slides up concurrently, in the given order, until the time budget
+    (seconds) or the memory budget (RSS growth, bytes) is exhausted.
+    Remaining slides are reported as skipped.
+    """
+    report = WarmupReport()
+    start = time.perf_counter()
+    start_rss = current_rss()
+    paths = list(paths)
+
+    def exhausted() -> bool:
+        if time.perf_counter() - start > time_budget:
+            return True
+        return memory_budget is not None \
+            and current_rss() - start_rss > memory_budget
+
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="openslide-warmup"
+    ) as executor:
+        pending = iter(paths)
+        futures = dict()
+        for path in pending:
+            futures[executor.submit(warm_slide, path, overview_size)] = path
+            if len(futures) >= workers:
+                break
+
+        while futures:
+            for future in as_completed(list(futures)):
+                path = futures.pop(future)
+                try:
+                    if future.result():
+                        report.warmed.append(path)
+                    else:
+                        report.skipped.append(path)
+                except Exception as e:  # noqa
+                    log.warning(f"Warm-up of {path} failed: {e}")
+                    report.failed.append(path)
+
+                if exhausted():
+                    report.skipped.extend(pending)
+                    break
+                following = next(pending, None)
+                if following is not None:
+                    futures[executor.submit(
+                        warm_slide, following, overview_size
+                    )] = following
+                break
+
+    report.elapsed = time.perf_counter() - start
+    report.rss_growth = current_rss() - start_rss
+    return report
+
+
+def warm_up_from_settings() -> Optional[WarmupReport]:
+    """Warm up slides listed in settings, if any."""
+    settings = get_settings()
+    paths = []
+    if settings.warmup_slides:
+        with open(settings.warmup_slides) as f:
+            paths.extend(line.strip() for line in f if line.strip())
+    if settings.warmup_access_log:
+        paths.extend(slides_from_access_log(
+            settings.warmup_access_log, settings.warmup_root,
+            limit=settings.warmup_max_slides
+        ))
+    paths = list(dict.fromkeys(paths))[:settings.warmup_max_slides]
+    if not paths:
+        return None
+
+    report = warm_up(
+        paths, settings.warmup_time_budget, settings.warmup_memory_budget,
+        settings.warmup_workers, settings.warmup_overview_size
+    )
+    log.info(
+        f"Warm-up: {len(report.warmed)} slides warmed, "
+        f"{len(report.failed)} failed, {len(report.skipped)} skipped "
+        f"in {report.elapsed:.1f}s (RSS +{report.rss_growth / 2**20:.0f} MiB)"
+    )
+    return report
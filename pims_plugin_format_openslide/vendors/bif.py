@@ -0,0 +1,261 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+import json
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+from xml.parsers.expat import ExpatError, ParserCreate
+from zipfile import BadZipFile
+
+import numpy as np
+
+from pims.formats import AbstractFormat
+from pims.formats.utils.abstract import CachedDataPath
+from pims.formats.utils.engines.tifffile import TifffileChecker, cached_tifffile
+from pims.formats.utils.engines.vips import cached_vips_file, get_vips_field
+from pims.formats.utils.structures.metadata import ImageMetadata
+from pims.utils import UNIT_REGISTRY
+from pims.utils.types import parse_datetime, parse_float, parse_int
+from pims_plugin_format_openslide.utils.engine import OpenslideVipsParser
+from pims_plugin_format_openslide.utils.handles import shared_parsing
+from pims_plugin_format_openslide.utils.instrumentation import timed_method
+
+log = logging.getLogger("pims.app")
+
+VENTANA_DIRECTIONS = ('LEFT', 'RIGHT', 'UP', 'DOWN')
+VENTANA_XML_CHUNK = 65536
+VENTANA_ASSOCIATED = {
+    'label image': 'macro', 'label_image': 'macro', 'thumbnail': 'thumbnail'
+}
+XMP_TAG = 700
+
+VENTANA_IMAGES_DTYPE = np.dtype([
+    ('aoi', np.int16), ('scanned', np.bool_),
+    ('tile_width', np.int32), ('tile_height', np.int32),
+    ('n_rows', np.int32), ('n_cols', np.int32),
+    ('pos_x', np.int32), ('pos_y', np.int32),
+])
+VENTANA_JOINTS_DTYPE = np.dtype([
+    ('aoi', np.int16), ('tile1', np.int32), ('tile2', np.int32),
+    ('direction', np.uint8), ('overlap_x', np.int16), ('overlap_y', np.int16),
+    ('confidence', np.int16), ('joined', np.bool_),
+])
+
+
+class VentanaMetadata:
+    """
+    Ventana XMP metadata: iScan attributes, scanned areas (AOI) and the
+    tile-joint table (overlap between adjacent stored tiles).
+    """
+
+    def __init__(
+        self, iscan: Dict[str, str], images: np.ndarray, joints: np.ndarray
+    ):
+        self.iscan = iscan
+        self.images = images
+        self.joints = joints
+
+    def save(self, path: Path, source: Path):
+        stat = os.stat(source)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp, 'wb') as f:
+                np.savez(
+                    f, images=self.images, joints=self.joints,
+                    iscan=np.array(json.dumps(self.iscan)),
+                    source=np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+                )
+            os.replace(tmp, path)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+    @classmethod
+    def load(cls, path: Path, source: Path) -> Optional['VentanaMetadata']:
+        """Load persisted metadata, if still valid for the source file."""
+        try:
+            stat = os.stat(source)
+            with np.load(path, allow_pickle=False) as data:
+                if tuple(data['source']) != (stat.st_size, stat.st_mtime_ns):
+                    return None
+                return cls(
+                    json.loads(str(data['iscan'])),
+                    data['images'], data['joints']
+                )
+        except (OSError, KeyError, ValueError, BadZipFile):
+            return None
+
+
+class _VentanaXMLHandler:
+    """Streaming (expat) handler keeping iScan attributes and tile joints."""
+
+    def __init__(self):
+        self.iscan = dict()
+        self.images = []
+        self.joints = []
+        self._aoi = 0
+
+    def start(self, tag: str, attrs: dict):
+        if tag == 'iScan':
+            self.iscan.update(attrs)
+        elif tag == 'ImageInfo':
+            aoi = parse_int(attrs.get('AOIIndex'))
+            self._aoi = aoi if aoi is not None else len(self.images)
+            self.images.append((
+                self._aoi, attrs.get('AOIScanned') == '1',
+                parse_int(attrs.get('Width')) or 0,
+                parse_int(attrs.get('Height')) or 0,
+                parse_int(attrs.get('NumRows')) or 0,
+                parse_int(attrs.get('NumCols')) or 0,
+                parse_int(attrs.get('Pos-X')) or 0,
+                parse_int(attrs.get('Pos-Y')) or 0,
+            ))
+        elif tag == 'TileJointInfo':
+            direction = attrs.get('Direction', '').upper()
+            if direction not in VENTANA_DIRECTIONS:
+                return
+            self.joints.append((
+                self._aoi,
+                parse_int(attrs.get('Tile1')) or 0,
+                parse_int(attrs.get('Tile2')) or 0,
+                VENTANA_DIRECTIONS.index(direction),
+                parse_int(attrs.get('OverlapX')) or 0,
+                parse_int(attrs.get('OverlapY')) or 0,
+                parse_int(attrs.get('Confidence')) or 0,
+                attrs.get('FlagJoined') == '1',
+            ))
+
+    def close(self) -> VentanaMetadata:
+        return VentanaMetadata(
+            self.iscan,
+            np.array(self.images, dtype=VENTANA_IMAGES_DTYPE),
+            np.array(self.joints, dtype=VENTANA_JOINTS_DTYPE)
+        )
+
+
+def parse_ventana_xml(*packets: bytes) -> VentanaMetadata:
+    """Parse Ventana XMP packets (iScan and EncodeInfo) in a streaming way."""
+    handler = _VentanaXMLHandler()
+    for packet in packets:
+        parser = ParserCreate()
+        parser.StartElementHandler = handler.start
+        for i in range(0, len(packet), VENTANA_XML_CHUNK):
+            parser.Parse(packet[i:i + VENTANA_XML_CHUNK], False)
+        parser.Parse(b'', True)
+    return handler.close()
+
+
+def ventana_metadata_path(path: Path) -> Path:
+    path = Path(path)
+    return path.with_name(f".{path.name}.ventana.npz")
+
+
+def _load_ventana_metadata(format: AbstractFormat) -> Optional[VentanaMetadata]:
+    persisted = ventana_metadata_path(format.path)
+    metadata = VentanaMetadata.load(persisted, format.path)
+    if metadata is not None:
+        return metadata
+
+    packets = []
+    for page in cached_tifffile(format).pages:
+        tag = page.tags.get(XMP_TAG)
+        if tag is not None:
+            value = tag.value
+            packets.append(value.encode() if isinstance(value, str) else value)
+    if not packets:
+        return None
+
+    try:
+        metadata = parse_ventana_xml(*packets)
+    except ExpatError:
+        return None
+    try:
+        metadata.save(persisted, format.path)
+    except OSError as e:
+        log.warning(f"Ventana metadata could not be persisted to {persisted}: {e}")
+    return metadata
+
+
+def cached_ventana_metadata(format: AbstractFormat) -> Optional[VentanaMetadata]:
+    return format.get_cached('_ventana', _load_ventana_metadata, format)
+
+
+class BifChecker(TifffileChecker):
+    @classmethod
+    def match(cls, pathlike: CachedDataPath) -> bool:
+        try:
+            if super().match(pathlike):
+                tf = cls.get_tifffile(pathlike)
+                return tf.is_bif
+            return False
+        except RuntimeError:
+            return False
+
+
+@shared_parsing
+class BifParser(OpenslideVipsParser):
+    @timed_method('parse_known_metadata')
+    def parse_known_metadata(self) -> ImageMetadata:
+        ventana = cached_ventana_metadata(self.format)
+        if ventana is None or not ventana.iscan:
+            return self._parse_known_metadata_from_openslide()
+
+        imd = self._parse_vips_known_metadata()
+        iscan = ventana.iscan
+
+        imd.acquisition_datetime = self.parse_acquisition_date(
+            iscan.get('ScanDate')
+        )
+        imd.microscope.model = iscan.get('ScannerModel')
+        imd.objective.nominal_magnification = parse_float(
+            iscan.get('Magnification')
+        )
+        resolution = parse_float(iscan.get('ScanRes'))
+        if resolution is not None and resolution > 0:
+            imd.physical_size_x = resolution * UNIT_REGISTRY("micrometers")
+            imd.physical_size_y = imd.physical_size_x
+
+        for page in cached_tifffile(self.format).pages:
+            name = VENTANA_ASSOCIATED.get((page.description or '').lower())
+            if name is None:
+                continue
+            associated = getattr(imd, f'associated_{name[:5]}')
+            associated.width = page.imagewidth
+            associated.height = page.imagelength
+            associated.n_channels = page.samplesperpixel
+
+        imd.is_complete = True
+        return imd
+
+    def _parse_known_metadata_from_openslide(self) -> ImageMetadata:
+        image = cached_vips_file(self.format)
+
+        imd = super().parse_known_metadata()
+
+        imd.acquisition_datetime = self.parse_acquisition_date(
+            get_vips_field(image, 'ventana.ScanDate')
+        )
+
+        imd.microscope.model = get_vips_field(image, 'ventana.ScannerModel')
+        imd.is_complete = True
+        return imd
+
+    @staticmethod
+    def parse_acquisition_date(date: str) -> Optional[datetime]:
+        # Have seen: 8/18/2014 09:44:30 | 8/30/2017 12:04:52 PM
+        return parse_datetime(
+            date, ["%m/%d/%Y %H:%M:%S", "%m/%d/%Y %H:%M:%S %p"]
+        )
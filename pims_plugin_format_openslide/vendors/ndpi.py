@@ -0,0 +1,123 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+from tifffile import astype
+
+from pims.cache import cached_property
+from pims.formats.utils.abstract import CachedDataPath
+from pims.formats.utils.engines.tifffile import TifffileChecker, TifffileParser, cached_tifffile
+from pims.formats.utils.structures.metadata import ImageMetadata, MetadataStore
+from pims.formats.utils.structures.pyramid import Pyramid
+from pims.utils.types import parse_float, parse_int
+from pims_plugin_format_openslide.utils.conversion import apply_conversion
+from pims_plugin_format_openslide.utils.engine import cached_vips_openslide_file
+from pims_plugin_format_openslide.utils.handles import shared_parsing
+from pims_plugin_format_openslide.utils.instrumentation import timed_method
+from pims_plugin_format_openslide.utils.metadata import LazyMetadataStore
+from pims_plugin_format_openslide.utils.sidecar import add_sidecar_tiers
+
+
+class NDPIChecker(TifffileChecker):
+    @classmethod
+    def match(cls, pathlike: CachedDataPath) -> bool:
+        try:
+            if super().match(pathlike):
+                tf = cls.get_tifffile(pathlike)
+                return tf.is_ndpi
+            return False
+        except RuntimeError:
+            return False
+
+
+@shared_parsing
+class NDPIParser(TifffileParser):
+    @cached_property
+    def _parsed_ndpi_tags(self) -> dict:
+        tags = self.baseline.ndpi_tags
+
+        comments = tags.get("Comments", None)
+        if comments:
+            # Comments tag (65449): ASCII key=value pairs (not always present)
+            lines = comments.split('\n')
+            for line in lines:
+                key, value = line.split('=')
+                tags[key.strip()] = astype(value.strip())
+            del tags["Comments"]
+        return tags
+
+    @timed_method('parse_known_metadata')
+    def parse_known_metadata(self) -> ImageMetadata:
+        imd = super().parse_known_metadata()
+        ndpi_metadata = self._parsed_ndpi_tags
+
+        # Magnification extracted by OpenSlide: nominal_magnification
+        # Magnification extracted by BioFormats: calibrated_magnification
+        imd.objective.nominal_magnification = parse_float(
+            ndpi_metadata.get("Magnification")
+        )
+        imd.objective.calibrated_magnification = parse_float(
+            ndpi_metadata.get("Objective.Lens.Magnificant")  # noqa
+        )  # Not a typo!
+
+        imd.microscope.model = ndpi_metadata.get("Model")
+
+        # NDPI series: Baseline, Macro, Map
+        for series in cached_tifffile(self.format).series:
+            name = series.name.lower()
+            if name == "macro":
+                associated = imd.associated_macro
+            else:
+                continue
+            page = series[0]
+            associated.width = page.imagewidth
+            associated.height = page.imagelength
+            associated.n_channels = page.samplesperpixel
+
+        imd.is_complete = True
+        return imd
+
+    @timed_method('parse_raw_metadata')
+    def parse_raw_metadata(self) -> MetadataStore:
+        store = LazyMetadataStore.from_store(super().parse_raw_metadata())
+
+        skipped_tags = ('McuStarts', '65439')
+        store.set_lazy(
+            "HAMAMATSU",
+            lambda: (k for k in self._parsed_ndpi_tags if k not in skipped_tags),
+            lambda key: self._parsed_ndpi_tags[key]
+        )
+        return store
+
+    @timed_method('parse_pyramid')
+    def parse_pyramid(self) -> Pyramid:
+        # Tifffile is inconsistent with Openslide
+        # https://github.com/cgohlke/tifffile/issues/41
+        openslide = cached_vips_openslide_file(self.format)
+
+        pyramid = Pyramid()
+        stored = []
+        for level in range(parse_int(openslide.get('openslide.level-count'))):
+            prefix = f'openslide.level[{level}].'
+            width = parse_int(openslide.get(prefix + 'width'))
+            height = parse_int(openslide.get(prefix + 'height'))
+            pyramid.insert_tier(
+                width, height,
+                (parse_int(openslide.get(prefix + 'tile-width')),
+                 parse_int(openslide.get(prefix + 'tile-height'))),
+                openslide_level=level
+            )
+            stored.append((width, height))
+
+        return apply_conversion(
+            self.format, add_sidecar_tiers(self.format, pyramid, stored)
+        )
@@ -0,0 +1,290 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+import re
+from base64 import b64decode
+from binascii import Error as BinasciiError
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from xml.parsers.expat import ExpatError, ParserCreate
+
+from pims.cache import cached_property
+from pims.formats.utils.abstract import CachedDataPath
+from pims.formats.utils.engines.tifffile import TifffileChecker, cached_tifffile
+from pims.formats.utils.engines.vips import cached_vips_file, get_vips_field
+from pims.formats.utils.structures.metadata import ImageMetadata, MetadataStore
+from pims.utils import UNIT_REGISTRY
+from pims_plugin_format_openslide.utils.engine import (
+    OpenslideVipsParser, cached_vips_openslide_file
+)
+from pims_plugin_format_openslide.utils.handles import shared_parsing
+from pims_plugin_format_openslide.utils.instrumentation import timed_method
+from pims_plugin_format_openslide.utils.planes import apply_z_planes, cached_z_planes
+
+PHILIPS_ASSOCIATED = {'LABELIMAGE': 'label', 'MACROIMAGE': 'macro'}
+PHILIPS_REQUIRED_ATTRIBUTES = {
+    'DICOM_ACQUISITION_DATETIME', 'DICOM_MANUFACTURERS_MODEL_NAME',
+    'DICOM_PIXEL_SPACING', 'PIIM_PIXEL_DATA_REPRESENTATION_NUMBER',
+    'PIM_DP_IMAGE_TYPE'
+}
+# Associated images are base64 JPEG: only the beginning (with SOF) is kept.
+PHILIPS_IMAGE_DATA = 'PIM_DP_IMAGE_DATA'
+PHILIPS_IMAGE_DATA_PREFIX = 16384
+PHILIPS_XML_CHUNK = 65536
+
+_FLOAT_RE = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
+
+def _jpeg_size(data: bytes) -> Optional[Tuple[int, int, int]]:
+    """Get (width, height, components) from a JPEG header (SOFn segment)."""
+    i = 2
+    while i + 10 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(data[i + 5:i + 7], 'big')
+            width = int.from_bytes(data[i + 7:i + 9], 'big')
+            return width, height, data[i + 9]
+        i += 2 + int.from_bytes(data[i + 2:i + 4], 'big')
+    return None
+
+
+class PhilipsXMLMetadata:
+    def __init__(self):
+        # Flattened attributes, keys named as OpenSlide philips.* properties
+        self.attributes: Dict[str, str] = dict()
+        # (row, column) pixel spacing in mm, per pixel data representation
+        self.pixel_spacings: List[Tuple[float, float]] = list()
+        # Associated image name -> (width, height, n_channels)
+        self.associated: Dict[str, Tuple[int, int, int]] = dict()
+
+
+class _PhilipsXMLHandler:
+    """
+    Streaming (expat) handler for Philips TIFF XML description.
+    Only required attributes are buffered, unless `full` is set.
+    """
+
+    def __init__(self, full: bool = False):
+        self.full = full
+        self.result = PhilipsXMLMetadata()
+        self._frames = []
+        self._spacings = []
+
+    def start(self, tag: str, attrs: dict):
+        parent = self._frames[-1] if self._frames else None
+        if tag == 'Attribute':
+            name = attrs.get('Name', '')
+            prefix = parent.get('prefix', '') if parent else ''
+            capture = name == PHILIPS_IMAGE_DATA or self.full \
+                or name in PHILIPS_REQUIRED_ATTRIBUTES
+            self._frames.append({
+                'tag': tag, 'name': name, 'key': prefix + name,
+                'capture': capture, 'chunks': [], 'size': 0, 'children': 0
+            })
+        elif tag == 'DataObject':
+            attribute = next(
+                (f for f in reversed(self._frames) if f['tag'] == 'Attribute'),
+                None
+            )
+            if attribute is None:
+                prefix = ''
+            else:
+                prefix = f"{attribute['key']}[{attribute['children']}]."
+                attribute['children'] += 1
+            self._frames.append({
+                'tag': tag, 'type': attrs.get('ObjectType'),
+                'prefix': prefix, 'attrs': dict()
+            })
+        else:
+            self._frames.append({'tag': tag})
+
+    def data(self, text: str):
+        frame = self._frames[-1] if self._frames else None
+        if frame is None or frame['tag'] != 'Attribute' or not frame['capture']:
+            return
+        if frame['name'] == PHILIPS_IMAGE_DATA:
+            if frame['size'] >= PHILIPS_IMAGE_DATA_PREFIX:
+                return
+            text = text[:PHILIPS_IMAGE_DATA_PREFIX - frame['size']]
+        frame['chunks'].append(text)
+        frame['size'] += len(text)
+
+    def end(self, tag: str):
+        frame = self._frames.pop()
+        parent = self._frames[-1] if self._frames else None
+        if tag == 'Attribute' and frame['capture']:
+            value = ''.join(frame['chunks']).strip()
+            if parent is not None and parent['tag'] == 'DataObject':
+                parent['attrs'][frame['name']] = value
+            if frame['name'] != PHILIPS_IMAGE_DATA and frame['children'] == 0:
+                self.result.attributes[frame['key']] = value
+        elif tag == 'DataObject':
+            self._end_object(frame)
+
+    def _end_object(self, frame: dict):
+        attrs = frame['attrs']
+        if frame['type'] == 'DPScannedImage':
+            name = PHILIPS_ASSOCIATED.get(attrs.get('PIM_DP_IMAGE_TYPE'))
+            data = attrs.get(PHILIPS_IMAGE_DATA)
+            if name and data:
+                try:
+                    size = _jpeg_size(b64decode(data[:len(data) // 4 * 4]))
+                except (BinasciiError, ValueError):
+                    size = None
+                if size:
+                    self.result.associated[name] = size
+        elif frame['type'] == 'PixelDataRepresentation':
+            spacing = [float(v) for v in _FLOAT_RE.findall(
+                attrs.get('DICOM_PIXEL_SPACING', '')
+            )]
+            if len(spacing) >= 2:
+                number = attrs.get('PIIM_PIXEL_DATA_REPRESENTATION_NUMBER', '')
+                number = int(number) if number.isdigit() else len(self._spacings)
+                self._spacings.append((number, (spacing[0], spacing[1])))
+
+    def close(self) -> PhilipsXMLMetadata:
+        self.result.pixel_spacings = [s for _, s in sorted(self._spacings)]
+        return self.result
+
+
+def parse_philips_xml(description: str, full: bool = False) -> PhilipsXMLMetadata:
+    """
+    Parse Philips TIFF XML description in a streaming way. Only elements
+    required for known metadata are kept, unless `full` is set.
+    """
+    handler = _PhilipsXMLHandler(full)
+    parser = ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+    parser.CharacterDataHandler = handler.data
+    for i in range(0, len(description), PHILIPS_XML_CHUNK):
+        parser.Parse(description[i:i + PHILIPS_XML_CHUNK], False)
+    parser.Parse('', True)
+    return handler.close()
+
+
+class PhilipsChecker(TifffileChecker):
+    @classmethod
+    def match(cls, pathlike: CachedDataPath) -> bool:
+        try:
+            if super().match(pathlike):
+                tf = cls.get_tifffile(pathlike)
+                return tf.is_philips
+            return False
+        except RuntimeError:
+            return False
+
+
+@shared_parsing
+class PhilipsParser(OpenslideVipsParser):
+    def _philips_description(self) -> str:
+        return cached_tifffile(self.format).pages[0].description
+
+    @cached_property
+    def _philips_metadata(self) -> Optional[PhilipsXMLMetadata]:
+        try:
+            return parse_philips_xml(self._philips_description())
+        except (ExpatError, ValueError, TypeError):
+            return None
+
+    @cached_property
+    def _philips_raw_attributes(self) -> Dict[str, str]:
+        try:
+            return parse_philips_xml(
+                self._philips_description(), full=True
+            ).attributes
+        except (ExpatError, ValueError, TypeError):
+            image = cached_vips_openslide_file(self.format)
+            return {
+                key.split('.', 1)[1]: get_vips_field(image, key)
+                for key in image.get_fields() if key.startswith('philips.')
+            }
+
+    @timed_method('parse_main_metadata')
+    def parse_main_metadata(self) -> ImageMetadata:
+        return apply_z_planes(
+            super().parse_main_metadata(), cached_z_planes(self.format)
+        )
+
+    @timed_method('parse_known_metadata')
+    def parse_known_metadata(self) -> ImageMetadata:
+        philips = self._philips_metadata
+        if philips is None:
+            return self._parse_known_metadata_from_openslide()
+
+        imd = self._parse_vips_known_metadata()
+        acquisition_date = self.parse_acquisition_date(
+            philips.attributes.get('DICOM_ACQUISITION_DATETIME')
+        )
+        if acquisition_date:
+            imd.acquisition_datetime = acquisition_date
+        imd.microscope.model = philips.attributes.get(
+            'DICOM_MANUFACTURERS_MODEL_NAME'
+        )
+
+        if philips.pixel_spacings:
+            # DICOM pixel spacing is (row, column) in millimeters
+            row, column = philips.pixel_spacings[0]
+            if column > 0:
+                imd.physical_size_x = column * 1000 * UNIT_REGISTRY("micrometers")
+            if row > 0:
+                imd.physical_size_y = row * 1000 * UNIT_REGISTRY("micrometers")
+
+        for name, (width, height, n_channels) in philips.associated.items():
+            imd_associated = getattr(imd, f'associated_{name[:5]}')
+            imd_associated.width = width
+            imd_associated.height = height
+            imd_associated.n_channels = n_channels
+
+        imd.is_complete = True
+        return imd
+
+    def _parse_known_metadata_from_openslide(self) -> ImageMetadata:
+        image = cached_vips_file(self.format)
+
+        imd = super().parse_known_metadata()
+
+        acquisition_date = self.parse_acquisition_date(
+            get_vips_field(image, 'philips.DICOM_ACQUISITION_DATETIME')
+        )
+        if acquisition_date:
+            imd.acquisition_datetime = acquisition_date
+
+        imd.is_complete = True
+        return imd
+
+    @timed_method('parse_raw_metadata')
+    def parse_raw_metadata(self) -> MetadataStore:
+        store = super().parse_raw_metadata()
+        if self._philips_metadata is None:
+            return store
+
+        # Replace philips.* OpenSlide properties by our own parsing.
+        store.set_lazy(
+            "philips",
+            lambda: self._philips_raw_attributes.keys(),
+            lambda key: self._philips_raw_attributes[key],
+            prefix="philips"
+        )
+        return store
+
+    @staticmethod
+    def parse_acquisition_date(date: str) -> Optional[datetime]:
+        # Have seen: 20181019105847.000000
+        try:
+            return datetime.strptime(date, "%Y%m%d%H%M%S.%f")
+        except (ValueError, TypeError):
+            return None
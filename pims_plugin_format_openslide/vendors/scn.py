@@ -0,0 +1,445 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from xml.etree import ElementTree
+
+import numpy as np
+from pyvips import Image as VIPSImage
+
+from pims.formats import AbstractFormat
+from pims.formats.utils.abstract import CachedDataPath
+from pims.formats.utils.engines.tifffile import TifffileChecker, cached_tifffile
+from pims.formats.utils.engines.vips import cached_vips_file, get_vips_field
+from pims.formats.utils.structures.metadata import ImageChannel, ImageMetadata, MetadataStore
+from pims.formats.utils.structures.pyramid import Pyramid
+from pims.utils import UNIT_REGISTRY
+from pims.utils.types import parse_datetime, parse_float
+from pims_plugin_format_openslide.utils.channels import channel_list, is_stain_request
+from pims_plugin_format_openslide.utils.engine import (
+    OpenslideVipsParser, OpenslideVipsReader, flatten
+)
+from pims_plugin_format_openslide.utils.handles import shared_parsing
+from pims_plugin_format_openslide.utils.instrumentation import count, timed, timed_method
+from pims_plugin_format_openslide.utils.pyramid import cached_compact_pyramid
+from pims_plugin_format_openslide.utils.regions import RegionIndex
+from pims_plugin_format_openslide.utils.tiff import cached_tiff_tile_reader, to_vips
+
+log = logging.getLogger("pims.app")
+
+# Tolerance when matching a tier downsample with a region resolution
+DOWNSAMPLE_TOLERANCE = 0.01
+
+
+@dataclass
+class SCNRegion:
+    """
+    Scanned region of a Leica SCN slide. Bounds are in level 0 pixels of
+    the merged view. Resolutions are (downsample, IFD) pairs, from the
+    largest; channels are the IFDs of every channel, per resolution.
+    """
+    name: str
+    left: int
+    top: int
+    width: int
+    height: int
+    resolutions: List[Tuple[float, int]] = field(default_factory=list)
+    illumination: Optional[str] = None
+    channels: List[Tuple[int, ...]] = field(default_factory=list)
+
+    @property
+    def window(self) -> Tuple[int, int, int, int]:
+        return self.left, self.top, self.width, self.height
+
+    @property
+    def is_fluorescence(self) -> bool:
+        return self.illumination == 'fluorescence' \
+            or any(len(ifds) > 1 for ifds in self.channels)
+
+    def _resolution(self, downsample: float) -> Optional[int]:
+        for index, (resolution, _) in enumerate(self.resolutions):
+            if abs(resolution / downsample - 1) < DOWNSAMPLE_TOLERANCE:
+                return index
+        return None
+
+    def ifd_for_downsample(self, downsample: float) -> Optional[int]:
+        index = self._resolution(downsample)
+        return None if index is None else self.resolutions[index][1]
+
+    def channel_ifds_for_downsample(self, downsample: float) -> Optional[Tuple[int, ...]]:
+        index = self._resolution(downsample)
+        return None if index is None else self.channels[index]
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _children(element: ElementTree.Element, name: str) -> List[ElementTree.Element]:
+    return [child for child in element if _local(child.tag) == name]
+
+
+def _text(element: ElementTree.Element, path: str) -> Optional[str]:
+    found = element.find(path)
+    return None if found is None else found.text
+
+
+class SCNRegions:
+    """
+    Regions of a slide with their spatial index, and the level 0 size of
+    the merged view.
+    """
+
+    def __init__(
+        self, regions: List[SCNRegion], width: int = 0, height: int = 0,
+        nm_per_pixel: Optional[float] = None,
+        channel_names: Optional[List[str]] = None,
+        properties: Optional[Dict[str, str]] = None
+    ):
+        self.regions = regions
+        self.index = RegionIndex([region.window for region in regions])
+        self.width = width
+        self.height = height
+        self.nm_per_pixel = nm_per_pixel
+        self.channel_names = channel_names or []
+        self.properties = properties or dict()
+
+    @property
+    def is_fluorescence(self) -> bool:
+        return len(self.regions) > 0 and self.regions[0].is_fluorescence
+
+    def __len__(self) -> int:
+        return len(self.regions)
+
+    def __iter__(self):
+        return iter(self.regions)
+
+
+def parse_scn_regions(xml: str) -> SCNRegions:
+    """
+    Regions of the main images of a SCN XML description. The macro image,
+    whose view is the whole collection, is excluded. Brightfield images
+    are preferred: fluorescence images, with one IFD per channel, are only
+    indexed in slides without brightfield image, as OpenSlide does not
+    read them.
+    """
+    root = ElementTree.fromstring(xml)
+    collections = _children(root, 'collection')
+    if not collections:
+        return SCNRegions([])
+    collection = collections[0]
+    collection_size = (collection.get('sizeX'), collection.get('sizeY'))
+
+    images = []
+    for image in _children(collection, 'image'):
+        views = _children(image, 'view')
+        pixels = _children(image, 'pixels')
+        if not views or not pixels:
+            continue
+        view = views[0]
+        if (view.get('sizeX'), view.get('sizeY')) == collection_size \
+                and int(view.get('offsetX', 0)) == 0 \
+                and int(view.get('offsetY', 0)) == 0:
+            continue  # macro
+
+        # Resolution index: (width, IFD of every channel)
+        dimensions = dict()
+        for dimension in _children(pixels[0], 'dimension'):
+            if int(dimension.get('z', 0)) != 0:
+                continue
+            _, ifds = dimensions.setdefault(
+                int(dimension.get('r', 0)), (int(dimension.get('sizeX')), dict())
+            )
+            ifds.setdefault(int(dimension.get('c', 0)), int(dimension.get('ifd')))
+        if 0 not in dimensions:
+            continue
+        images.append((image, view, dimensions))
+
+    def is_brightfield(image, dimensions):
+        return len(dimensions[0][1]) == 1 \
+            and _text(image, './/{*}illuminationSource') != 'fluorescence'
+
+    brightfield = [entry for entry in images if is_brightfield(entry[0], entry[2])]
+    images = brightfield or images
+    if not images:
+        return SCNRegions([])
+    first, view, dimensions = images[0]
+    # All regions must have the channels of the first one.
+    n_channels = len(dimensions[0][1])
+    images = [entry for entry in images if len(entry[2][0][1]) == n_channels]
+
+    # Level 0 of the merged view has the resolution of the first main image.
+    nm_per_pixel = int(view.get('sizeX')) / dimensions[0][0]
+
+    regions = []
+    for image, view, dimensions in images:
+        width = round(int(view.get('sizeX')) / nm_per_pixel)
+        resolutions = [dimensions[r] for r in sorted(dimensions)]
+        regions.append(SCNRegion(
+            image.get('name', ''),
+            int(int(view.get('offsetX')) // nm_per_pixel),
+            int(int(view.get('offsetY')) // nm_per_pixel),
+            width, round(int(view.get('sizeY')) / nm_per_pixel),
+            [(width / size, ifds[min(ifds)]) for size, ifds in resolutions],
+            _text(image, './/{*}illuminationSource'),
+            [tuple(ifds[c] for c in sorted(ifds)) for _, ifds in resolutions]
+        ))
+
+    names = [
+        channel.get('name') or f'C{index}' for index, channel
+        in enumerate(first.findall('.//{*}channelSettings/{*}channel'))
+    ]
+    device = first.find('{*}device')
+    properties = {
+        'creation-date': _text(first, '{*}creationDate'),
+        'device-model': None if device is None else device.get('model'),
+        'objective': _text(first, './/{*}objective'),
+    }
+    return SCNRegions(
+        regions,
+        round(int(collection.get('sizeX')) / nm_per_pixel),
+        round(int(collection.get('sizeY')) / nm_per_pixel),
+        nm_per_pixel,
+        names if len(names) == n_channels else [f'C{c}' for c in range(n_channels)],
+        {key: value for key, value in properties.items() if value is not None}
+    )
+
+
+def _load_scn_regions(format: AbstractFormat) -> SCNRegions:
+    try:
+        xml = cached_tifffile(format).pages[0].description
+        return parse_scn_regions(xml)
+    except (ElementTree.ParseError, ValueError, TypeError) as e:
+        log.warning(f"SCN regions of {format.path} could not be parsed: {e}")
+        return SCNRegions([])
+
+
+def cached_scn_regions(format: AbstractFormat) -> SCNRegions:
+    return format.get_cached('_scn_regions', _load_scn_regions, format)
+
+
+class SCNChecker(TifffileChecker):
+    @classmethod
+    def match(cls, pathlike: CachedDataPath) -> bool:
+        try:
+            if super().match(pathlike):
+                tf = cls.get_tifffile(pathlike)
+                return tf.is_scn
+            return False
+        except RuntimeError:
+            return False
+
+
+@shared_parsing
+class SCNParser(OpenslideVipsParser):
+    """
+    Fluorescence slides, which OpenSlide does not read, are parsed from the
+    SCN XML description and the TIFF pages of their regions.
+    """
+
+    def _fluorescence(self) -> Optional[SCNRegions]:
+        regions = cached_scn_regions(self.format)
+        return regions if regions.is_fluorescence else None
+
+    @timed_method('parse_main_metadata')
+    def parse_main_metadata(self) -> ImageMetadata:
+        regions = self._fluorescence()
+        if regions is None:
+            return super().parse_main_metadata()
+
+        page = cached_tifffile(self.format).pages[regions.regions[0].resolutions[0][1]]
+        imd = ImageMetadata()
+        imd.width = regions.width
+        imd.height = regions.height
+        imd.depth = 1
+        imd.duration = 1
+        imd.n_concrete_channels = len(regions.channel_names)
+        imd.n_samples = 1
+        imd.pixel_type = page.dtype
+        imd.significant_bits = page.bitspersample
+        for index, name in enumerate(regions.channel_names):
+            imd.set_channel(ImageChannel(index=index, suggested_name=name))
+        return imd
+
+    @timed_method('parse_known_metadata')
+    def parse_known_metadata(self) -> ImageMetadata:
+        regions = self._fluorescence()
+        if regions is not None:
+            imd = self._parse_vips_known_metadata()
+            if regions.nm_per_pixel:
+                imd.physical_size_x = regions.nm_per_pixel * UNIT_REGISTRY("nanometers")
+                imd.physical_size_y = imd.physical_size_x
+            imd.objective.nominal_magnification = parse_float(
+                regions.properties.get('objective')
+            )
+            imd.acquisition_datetime = parse_datetime(
+                regions.properties.get('creation-date')
+            )
+            imd.microscope.model = regions.properties.get('device-model')
+            imd.is_complete = True
+            return imd
+
+        image = cached_vips_file(self.format)
+
+        imd = super().parse_known_metadata()
+        imd.acquisition_datetime = parse_datetime(
+            get_vips_field(image, 'leica.creation-date')
+        )
+        imd.microscope.model = get_vips_field(image, 'leica.device-model')
+        imd.is_complete = True
+        return imd
+
+    @timed_method('parse_raw_metadata')
+    def parse_raw_metadata(self) -> MetadataStore:
+        if self._fluorescence() is not None:
+            # Plain vips raw metadata, OpenSlide properties are not read.
+            return super(OpenslideVipsParser, self).parse_raw_metadata()
+        return super().parse_raw_metadata()
+
+    @timed_method('parse_pyramid')
+    def parse_pyramid(self) -> Pyramid:
+        regions = self._fluorescence()
+        if regions is None:
+            return super().parse_pyramid()
+
+        # Resolutions of the first region (sidecar pyramids are built
+        # with OpenSlide, so they are not available).
+        tf = cached_tifffile(self.format)
+        pyramid = Pyramid()
+        for downsample, ifd in regions.regions[0].resolutions:
+            page = tf.pages[ifd]
+            width = max(1, round(regions.width / downsample))
+            height = max(1, round(regions.height / downsample))
+            tile_size = (page.tilewidth, page.tilelength) if page.is_tiled \
+                else (width, height)
+            pyramid.insert_tier(width, height, tile_size)
+        return pyramid
+
+
+class SCNReader(OpenslideVipsReader):
+    """
+    Reads falling entirely in gaps between regions return blank data
+    without I/O. Reads inside a single region are routed to the pyramid of
+    this region rather than to the OpenSlide merged view.
+
+    Channels of fluorescence slides are read from their own IFDs with
+    tifffile, at native bit depth: only requested channels are decoded and
+    there is no compositing.
+    """
+
+    def _read_fluorescence(
+        self, regions: SCNRegions, tier, left: int, top: int, width: int,
+        height: int, c=None
+    ) -> np.ndarray:
+        tf = cached_tifffile(self.format)
+        pyramid = cached_compact_pyramid(self.format)
+        downsample = int(pyramid.widths[0]) / tier.width
+        window = (
+            int(left * downsample), int(top * downsample),
+            max(1, round(width * downsample)), max(1, round(height * downsample))
+        )
+        channels = channel_list(c, len(regions.channel_names))
+        dtype = tf.pages[regions.regions[0].resolutions[0][1]].dtype
+        out = np.zeros((height, width, len(channels)), dtype=dtype)
+
+        with timed('region_lookup'):
+            intersecting = regions.index.intersecting(window)
+        if not intersecting:
+            count('blank_reads')
+            return out
+
+        for index in intersecting:
+            region = regions.regions[index]
+            ifds = region.channel_ifds_for_downsample(downsample)
+            if ifds is None:
+                continue
+            x = round(region.left / downsample)
+            y = round(region.top / downsample)
+            page = tf.pages[ifds[0]]
+            x0, y0 = max(left, x), max(top, y)
+            x1 = min(left + width, x + page.imagewidth)
+            y1 = min(top + height, y + page.imagelength)
+            if x1 <= x0 or y1 <= y0:
+                continue
+            for i, channel in enumerate(channels):
+                reader = cached_tiff_tile_reader(self.format, tf, ifds[channel])
+                reader.read(
+                    x0 - x, y0 - y, x1 - x0, y1 - y0,
+                    out=out[y0 - top:y1 - top, x0 - left:x1 - left, i:i + 1]
+                )
+        return out
+
+    def _read_area(
+        self, tier, left: int, top: int, width: int, height: int, c=None
+    ) -> VIPSImage:
+        regions = cached_scn_regions(self.format)
+        if regions.is_fluorescence:
+            return to_vips(
+                self._read_fluorescence(regions, tier, left, top, width, height, c)
+            )
+        if len(regions) == 0 or tier.data.get('sidecar_path') is not None:
+            return super()._read_area(tier, left, top, width, height, c)
+
+        pyramid = cached_compact_pyramid(self.format)
+        downsample = int(pyramid.widths[0]) / tier.width
+        window = (
+            int(left * downsample), int(top * downsample),
+            max(1, round(width * downsample)), max(1, round(height * downsample))
+        )
+        with timed('region_lookup'):
+            intersecting = regions.index.intersecting(window)
+        if not intersecting:
+            count('blank_reads')
+            n_channels = self.format.main_imd.n_samples
+            bands = n_channels if c is None else len(channel_list(c, n_channels))
+            return VIPSImage.black(width, height, bands=bands)
+
+        if len(intersecting) == 1:
+            index = regions.index.containing(window)
+            if index is not None:
+                im = self._read_region_area(
+                    regions.regions[index], downsample, left, top, width, height, c
+                )
+                if im is not None:
+                    return im
+        return super()._read_area(tier, left, top, width, height, c)
+
+    def _read_area_array(
+        self, tier, left: int, top: int, width: int, height: int, c=None
+    ) -> np.ndarray:
+        regions = cached_scn_regions(self.format)
+        if not regions.is_fluorescence:
+            return super()._read_area_array(tier, left, top, width, height, c)
+        if is_stain_request(c):
+            raise ValueError("Stain channels are only available for brightfield slides")
+        return self._read_fluorescence(regions, tier, left, top, width, height, c)
+
+    def _read_region_area(
+        self, region: SCNRegion, downsample: float, left: int, top: int,
+        width: int, height: int, c=None
+    ) -> Optional[VIPSImage]:
+        ifd = region.ifd_for_downsample(downsample)
+        if ifd is None:
+            return None
+        page = self.format.get_cached(
+            f'_scn_ifd{ifd}', VIPSImage.tiffload, str(self.format.path), page=ifd
+        )
+        x = left - round(region.left / downsample)
+        y = top - round(region.top / downsample)
+        if x < 0 or y < 0 or x + width > page.width or y + height > page.height:
+            return None
+        im = page.extract_area(x, y, width, height)
+        return flatten(im, None if c is None else channel_list(c, im.bands))
@@ -0,0 +1,265 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+import re
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from pint import Quantity
+from tifffile import astype
+
+from pims.cache import cached_property
+from pims.formats.utils.abstract import CachedDataPath
+from pims.formats.utils.engines.tifffile import TifffileChecker, TifffileParser, cached_tifffile
+from pims.formats.utils.structures.metadata import ImageMetadata, MetadataStore
+from pims.utils import UNIT_REGISTRY
+from pims.utils.types import parse_float
+from pims_plugin_format_openslide.utils.handles import shared_parsing
+from pims_plugin_format_openslide.utils.instrumentation import timed_method
+from pims_plugin_format_openslide.utils.metadata import LazyMetadataStore
+from pims_plugin_format_openslide.utils.planes import (
+    ZStackReader, apply_z_planes, cached_z_planes
+)
+from pims_plugin_format_openslide.utils.pyramid import cached_compact_pyramid
+from pims_plugin_format_openslide.utils.tiff import cached_tiff_tile_reader, to_vips
+
+
+APERIO_KNOWN_KEYS = ('MPP', 'AppMag', 'Date', 'Time')
+
+# One '|'-separated 'key = value' item. Values may be double-quoted (and then
+# contain '|'), or contain ' = '. Items without '=' do not match. A quoted
+# value must end the item, otherwise (e.g. unclosed quote) it ends at '|'.
+_APERIO_ITEM = re.compile(
+    r'\|\s*([^|=]*?)\s*=[ \t]*("(?:[^"\\]|\\.)*"(?=\s*(?:\||$))|[^|]*)'
+)
+
+
+def _find_named_series(tf, name):
+    return next((s for s in tf.series if s.name.lower() == name), None)
+
+
+def tokenize_aperio_description(
+    description: str, keys: Optional[Iterable[str]] = None
+) -> Dict[str, str]:
+    """
+    Get items of an Aperio image description as raw strings, in a single
+    pass. The format is unspecified: malformed items are skipped and the
+    last occurrence of a repeated key wins. If `keys` are given, only these
+    items are kept.
+    """
+    if not description.startswith('Aperio '):
+        raise ValueError('invalid Aperio image description')
+
+    result = {}
+    end = description.find('|')
+    headers = description[:end if end >= 0 else None].split('\n', 1)
+    header = headers[0].strip().rsplit(None, 1)  # 'Aperio Image Library'
+    if len(header) == 2:
+        result[header[0].strip()] = header[1].strip()
+    if len(headers) == 2:
+        result['Description'] = headers[1].strip()  # TODO: parse this?
+    if end < 0:
+        return result
+
+    wanted = set(keys) if keys is not None else None
+    for match in _APERIO_ITEM.finditer(description, end):
+        key = match.group(1)
+        if not key or (wanted is not None and key not in wanted):
+            continue
+        value = match.group(2).strip()
+        if len(value) >= 2 and value[0] == value[-1] == '"':
+            value = value[1:-1]
+        result[key] = value
+    return result
+
+
+def parse_aperio_description(
+    description: str, keys: Optional[Iterable[str]] = None
+) -> dict:
+    """Get items of an Aperio image description, with typed values."""
+    return {
+        key: astype(value)
+        for key, value in tokenize_aperio_description(description, keys).items()
+    }
+
+
+def native_levels(tf) -> Optional[Dict[Tuple[int, int], int]]:
+    """
+    Page index of every baseline level, by (width, height), for slides
+    with more than 8 bits per sample. None for 8-bit slides.
+    """
+    baseline = tf.series[0]
+    if baseline.levels[0].keyframe.dtype == np.uint8:
+        return None
+    return {
+        (level.keyframe.imagewidth, level.keyframe.imagelength): level.keyframe.index
+        for level in baseline.levels
+    }
+
+
+class SVSChecker(TifffileChecker):
+    @classmethod
+    def match(cls, pathlike: CachedDataPath) -> bool:
+        try:
+            if super().match(pathlike):
+                tf = cls.get_tifffile(pathlike)
+                return tf.is_svs
+            return False
+        except RuntimeError:
+            return False
+
+
+@shared_parsing
+class SVSParser(TifffileParser):
+    @cached_property
+    def _svs_description_items(self) -> Dict[str, str]:
+        """
+        Return metadata from Aperio image description as dict of raw strings.
+        The Aperio image description format is unspecified.
+        """
+        return tokenize_aperio_description(self.baseline.description)
+
+    @cached_property
+    def _known_svs_description(self) -> dict:
+        """Return only metadata needed for known metadata, with typed values."""
+        return parse_aperio_description(
+            self.baseline.description, APERIO_KNOWN_KEYS
+        )
+
+    @staticmethod
+    def parse_physical_size(
+        physical_size: Optional[str], unit: Optional[str] = None
+    ) -> Optional[Quantity]:
+        if physical_size is not None:
+            physical_size = parse_float(physical_size)
+            if physical_size is not None and physical_size > 0:
+                return physical_size * UNIT_REGISTRY("micrometers")
+        return None
+
+    @staticmethod
+    def parse_acquisition_date(
+        date: Optional[str], time: Optional[str] = None
+    ) -> Optional[datetime]:
+        """
+        Date examples: 11/25/13 , 2013-12-05T12:49:03.69Z
+        Time examples: 15:10:34
+        """
+        try:
+            if date and time:
+                return datetime.strptime(f"{date} {time}", "%m/%d/%y %H:%M:%S")
+            elif date:
+                return datetime.strptime(date, "%Y-%m-%dT%H:%M:%SZ")
+            else:
+                return None
+        except (ValueError, TypeError):
+            return None
+
+    @timed_method('parse_main_metadata')
+    def parse_main_metadata(self) -> ImageMetadata:
+        return apply_z_planes(
+            super().parse_main_metadata(), cached_z_planes(self.format)
+        )
+
+    @timed_method('parse_known_metadata')
+    def parse_known_metadata(self) -> ImageMetadata:
+        imd = super().parse_known_metadata()
+        svs_metadata = self._known_svs_description
+
+        imd.description = self.baseline.description
+        imd.acquisition_datetime = self.parse_acquisition_date(
+            svs_metadata.get("Date"), svs_metadata.get("Time"))
+
+        imd.physical_size_x = self.parse_physical_size(svs_metadata.get("MPP"))
+        imd.physical_size_y = imd.physical_size_x
+        imd.objective.nominal_magnification = parse_float(
+            svs_metadata.get("AppMag")
+        )
+
+        for series in cached_tifffile(self.format).series:
+            name = series.name.lower()
+            if name == "thumbnail":
+                associated = imd.associated_thumb
+            elif name == "label":
+                associated = imd.associated_label
+            elif name == "macro":
+                associated = imd.associated_macro
+            else:
+                continue
+            page = series[0]
+            associated.width = page.imagewidth
+            associated.height = page.imagelength
+            associated.n_channels = page.samplesperpixel
+
+        imd.is_complete = True
+        return imd
+
+    @timed_method('parse_raw_metadata')
+    def parse_raw_metadata(self) -> MetadataStore:
+        store = LazyMetadataStore.from_store(super().parse_raw_metadata())
+        store.set_lazy(
+            "APERIO",
+            lambda: self._svs_description_items.keys(),
+            lambda key: astype(self._svs_description_items[key])
+        )
+        return store
+
+
+class SVSReader(ZStackReader):
+    """
+    Slides with more than 8 bits per sample, which OpenSlide cannot read,
+    are read with tifffile at native bit depth.
+    """
+
+    def _native_levels(self) -> Optional[Dict[Tuple[int, int], int]]:
+        return self.format.get_cached(
+            '_svs_native_levels', native_levels, cached_tifffile(self.format)
+        )
+
+    def _plane_reader(self, tier):
+        levels = self._native_levels()
+        if levels is not None and tier.data.get('sidecar_path') is None:
+            index = levels.get((tier.width, tier.height))
+            if index is not None:
+                return cached_tiff_tile_reader(
+                    self.format, cached_tifffile(self.format), index
+                )
+        return super()._plane_reader(tier)
+
+    def read_thumb(self, out_width, out_height, precomputed=False, c=None, **other):
+        if self._native_levels() is None:
+            return super().read_thumb(out_width, out_height, precomputed, c, **other)
+        pyramid = cached_compact_pyramid(self.format)
+        level, window = pyramid.locate(
+            0, 0, int(pyramid.widths[0]), int(pyramid.heights[0]),
+            out_width, out_height
+        )
+        return self._read_area(pyramid.tiers[level], *window, c)
+
+    def _read_associated(self, name: str):
+        series = _find_named_series(cached_tifffile(self.format), name)
+        if series is None:
+            return None
+        array = series.asarray()
+        return to_vips(array if array.ndim == 3 else array[..., np.newaxis])
+
+    def read_label(self, out_width, out_height, **other):
+        if self._native_levels() is None:
+            return super().read_label(out_width, out_height, **other)
+        return self._read_associated('label')
+
+    def read_macro(self, out_width, out_height, **other):
+        if self._native_levels() is None:
+            return super().read_macro(out_width, out_height, **other)
+        return self._read_associated('macro')
@@ -0,0 +1,525 @@
+#  * Copyright (c) 2020-2021. Authors: see NOTICE file.
+#  *
+#  * Licensed under the Apache License, Version 2.0 (the "License");
+#  * you may not use this file except in compliance with the License.
+#  * You may obtain a copy of the License at
+#  *
+#  *      http://www.apache.org/licenses/LICENSE-2.0
+#  *
+#  * Unless required by applicable law or agreed to in writing, software
+#  * distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+"""
+Hamamatsu VMS index and reader.
+
+A VMS slide is a .vms key file, a grid of large JPEG files with restart
+markers and an optional .opt optimisation file holding the offset of the
+first restart interval of every MCU row. The key file, JPEG headers and
+restart interval offsets are parsed once into a compact index, persisted
+next to the .vms file. Level 0 reads then only decode the restart
+intervals they need: their entropy-coded data is assembled into a small
+JPEG (as OpenSlide does), decoded by libvips.
+
+References
+    https://openslide.org/formats/hamamatsu/
+"""
+import json
+import logging
+import os
+import struct
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from pyvips import Image as VIPSImage
+
+from pims.formats import AbstractFormat
+from pims_plugin_format_openslide.utils.channels import channel_list
+from pims_plugin_format_openslide.utils.config import get_settings
+from pims_plugin_format_openslide.utils.engine import OpenslideVipsReader, flatten
+from pims_plugin_format_openslide.utils.instrumentation import count, timed
+
+log = logging.getLogger("pims.app")
+
+VMS_HEADER = '[Virtual Microscope Specimen]'
+OPT_RECORD_SIZE = 40
+SCAN_CHUNK_SIZE = 64 * 1024 * 1024
+
+SOF_MARKERS = (0xC0, 0xC1, 0xC2)
+DRI_MARKER = 0xDD
+SOS_MARKER = 0xDA
+EOI = b'\xff\xd9'
+
+
+def parse_vms(path: Path) -> Dict[str, str]:
+    """Keys and values of a .vms key file."""
+    with open(path, 'r', errors='replace') as f:
+        if f.readline().strip() != VMS_HEADER:
+            raise ValueError(f"{path} is not a VMS key file")
+        keys = dict()
+        for line in f:
+            if '=' in line:
+                key, value = line.split('=', 1)
+                keys[key.strip()] = value.strip()
+    return keys
+
+
+def vms_image_files(keys: Dict[str, str]) -> Dict[Tuple[int, int], str]:
+    """JPEG file names of the level 0 grid, by (column, row)."""
+    files = dict()
+    for key, value in keys.items():
+        if key == 'ImageFile':
+            files[(0, 0)] = value
+        elif key.startswith('ImageFile(') and key.endswith(')'):
+            col, row = key[len('ImageFile('):-1].split(',')
+            files[(int(col), int(row))] = value
+    return files
+
+
+@dataclass
+class JPEGHeader:
+    header: bytes  # from SOI to the end of the SOS segment
+    width: int
+    height: int
+    mcu_width: int
+    mcu_height: int
+    restart_interval: int
+    sof_offset: int  # offset of the SOF height field in the header
+
+    @property
+    def mcus_across(self) -> int:
+        return -(-self.width // self.mcu_width)
+
+    @property
+    def mcus_down(self) -> int:
+        return -(-self.height // self.mcu_height)
+
+    @property
+    def intervals_across(self) -> int:
+        return self.mcus_across // self.restart_interval
+
+    @property
+    def is_indexable(self) -> bool:
+        # Restart intervals must not span several MCU rows.
+        return self.restart_interval > 0 \
+            and self.mcus_across % self.restart_interval == 0
+
+    def with_size(self, width: int, height: int) -> bytes:
+        header = bytearray(self.header)
+        header[self.sof_offset:self.sof_offset + 4] = struct.pack('>HH', height, width)
+        return bytes(header)
+
+
+def parse_jpeg_header(f) -> JPEGHeader:
+    """Parse a JPEG file header, up to the start of entropy-coded data."""
+    f.seek(0)
+    if f.read(2) != b'\xff\xd8':
+        raise ValueError("Not a JPEG file")
+    header = bytearray(b'\xff\xd8')
+    size = mcu = sof_offset = None
+    restart_interval = 0
+    while True:
+        marker = f.read(2)
+        if len(marker) != 2 or marker[0] != 0xFF:
+            raise ValueError("Invalid JPEG marker")
+        length_bytes = f.read(2)
+        segment = f.read(struct.unpack('>H', length_bytes)[0] - 2)
+        if marker[1] in SOF_MARKERS:
+            sof_offset = len(header) + 5
+            height, width = struct.unpack('>HH', segment[1:5])
+            n_components = segment[5]
+            sampling = [segment[7 + 3 * i] for i in range(n_components)]
+            h = max(s >> 4 for s in sampling) if n_components > 1 else 1
+            v = max(s & 0xF for s in sampling) if n_components > 1 else 1
+            size, mcu = (width, height), (8 * h, 8 * v)
+        elif marker[1] == DRI_MARKER:
+            restart_interval = struct.unpack('>H', segment[:2])[0]
+        header += marker + length_bytes + segment
+        if marker[1] == SOS_MARKER:
+            break
+    if size is None:
+        raise ValueError("JPEG file without frame header")
+    return JPEGHeader(
+        bytes(header), size[0], size[1], mcu[0], mcu[1],
+        restart_interval, sof_offset
+    )
+
+
+def scan_restart_markers(f, start: int, end: int) -> np.ndarray:
+    """Offsets of the restart markers of entropy-coded data, in chunks."""
+    markers = []
+    position = start
+    while position < end:
+        f.seek(position)
+        chunk = np.frombuffer(
+            f.read(min(SCAN_CHUNK_SIZE + 1, end - position)), dtype=np.uint8
+        )
+        candidates = np.flatnonzero(chunk[:-1] == 0xFF)
+        following = chunk[candidates + 1]
+        found = candidates[(following >= 0xD0) & (following <= 0xD7)]
+        markers.append(found.astype(np.int64) + position)
+        position += SCAN_CHUNK_SIZE
+    if not markers:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(markers)
+
+
+def restart_interval_starts(
+    f, header: JPEGHeader, file_size: int,
+    opt_row_starts: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Data offset of every restart interval, followed by the offset of the
+    end of image marker plus 2, so that interval `k` spans
+    `starts[k]:starts[k + 1] - 2`. When there is one interval per MCU
+    row, row starts of the .opt file are used, after checking that they
+    follow restart markers. Otherwise entropy-coded data is scanned.
+    """
+    f.seek(file_size - 2)
+    eoi = file_size - 2 if f.read(2) == EOI else file_size
+    n_intervals = header.intervals_across * header.mcus_down
+
+    if opt_row_starts is not None and header.intervals_across == 1 \
+            and len(opt_row_starts) == n_intervals:
+        valid = True
+        for offset in opt_row_starts[1:]:
+            if not len(header.header) + 2 <= offset <= eoi:
+                valid = False
+                break
+            f.seek(int(offset) - 2)
+            marker = f.read(2)
+            if len(marker) != 2 or marker[0] != 0xFF or not 0xD0 <= marker[1] <= 0xD7:
+                valid = False
+                break
+        if valid:
+            return np.concatenate((
+                [len(header.header)], opt_row_starts[1:], [eoi + 2]
+            )).astype(np.int64)
+
+    markers = scan_restart_markers(f, len(header.header), eoi)
+    if len(markers) != n_intervals - 1:
+        raise ValueError(
+            f"Found {len(markers)} restart markers, expected {n_intervals - 1}"
+        )
+    return np.concatenate((
+        [len(header.header)], markers + 2, [eoi + 2]
+    )).astype(np.int64)
+
+
+def read_opt(path: Path) -> np.ndarray:
+    """Offsets of the .opt optimisation file (first 8 bytes of records)."""
+    records = np.fromfile(path, dtype=np.uint8)
+    records = records[:len(records) // OPT_RECORD_SIZE * OPT_RECORD_SIZE]
+    records = records.reshape(-1, OPT_RECORD_SIZE)
+    return records[:, :8].copy().view('<i8').ravel()
+
+
+class VMSIndex:
+    """
+    Index of the level 0 JPEG files of a VMS slide: grid position, header
+    and restart interval offsets of every file.
+    """
+
+    def __init__(
+        self, files: List[str], grid: np.ndarray, headers: List[JPEGHeader],
+        starts: List[np.ndarray]
+    ):
+        self.files = files
+        self.grid = grid
+        self.headers = headers
+        self.starts = starts
+
+        n_cols, n_rows = grid.max(axis=0) + 1 if len(grid) else (0, 0)
+        widths, heights = np.zeros(n_cols, np.int64), np.zeros(n_rows, np.int64)
+        for (col, row), header in zip(grid, headers):
+            if row == 0:
+                widths[col] = header.width
+            if col == 0:
+                heights[row] = header.height
+        self.col_lefts = np.concatenate(([0], np.cumsum(widths)))
+        self.row_tops = np.concatenate(([0], np.cumsum(heights)))
+        self._by_position = {
+            (int(col), int(row)): i for i, (col, row) in enumerate(grid)
+        }
+
+    @property
+    def width(self) -> int:
+        return int(self.col_lefts[-1])
+
+    @property
+    def height(self) -> int:
+        return int(self.row_tops[-1])
+
+    @classmethod
+    def build(cls, vms_path: Path) -> 'VMSIndex':
+        directory = vms_path.parent
+        keys = parse_vms(vms_path)
+        positions = vms_image_files(keys)
+        opt_starts = None
+        if keys.get('OptimisationFile'):
+            try:
+                opt_starts = read_opt(directory / keys['OptimisationFile'])
+            except OSError as e:
+                log.warning(f"VMS optimisation file could not be read: {e}")
+
+        files, grid, headers, starts = [], [], [], []
+        opt_position = 0
+        for (col, row), name in sorted(positions.items(), key=lambda p: p[0][::-1]):
+            path = directory / name
+            with open(path, 'rb') as f:
+                header = parse_jpeg_header(f)
+                row_starts = None
+                if opt_starts is not None:
+                    row_starts = opt_starts[opt_position:opt_position + header.mcus_down]
+                    opt_position += header.mcus_down
+                file_starts = np.empty(0, dtype=np.int64)
+                if header.is_indexable:
+                    file_starts = restart_interval_starts(
+                        f, header, os.fstat(f.fileno()).st_size, row_starts
+                    )
+            files.append(name)
+            grid.append((col, row))
+            headers.append(header)
+            starts.append(file_starts)
+        return cls(files, np.array(grid, dtype=np.int64).reshape(-1, 2), headers, starts)
+
+    def _source(self, vms_path: Path) -> np.ndarray:
+        stats = [os.stat(vms_path)] + [
+            os.stat(vms_path.parent / name) for name in self.files
+        ]
+        return np.array(
+            [(stat.st_size, stat.st_mtime_ns) for stat in stats], dtype=np.int64
+        )
+
+    def save(self, path: Path, vms_path: Path):
+        geometry = np.array([
+            (h.width, h.height, h.mcu_width, h.mcu_height, h.restart_interval,
+             h.sof_offset) for h in self.headers
+        ], dtype=np.int64).reshape(-1, 6)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp, 'wb') as f:
+            np.savez(
+                f, files=np.array(json.dumps(self.files)), grid=self.grid,
+                geometry=geometry,
+                headers=np.frombuffer(b''.join(h.header for h in self.headers), np.uint8),
+                header_lengths=np.array([len(h.header) for h in self.headers], np.int64),
+                starts=np.concatenate(self.starts or [np.empty(0, np.int64)]),
+                start_counts=np.array([len(s) for s in self.starts], np.int64),
+                source=self._source(vms_path)
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path, vms_path: Path) -> Optional['VMSIndex']:
+        """Load a persisted index, if still valid for the slide files."""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                files = json.loads(str(data['files']))
+                header_bytes = data['headers'].tobytes()
+                header_ends = np.cumsum(data['header_lengths'])
+                start_ends = np.cumsum(data['start_counts'])
+                headers, starts = [], []
+                for i, geometry in enumerate(data['geometry']):
+                    header_start = header_ends[i - 1] if i > 0 else 0
+                    headers.append(JPEGHeader(
+                        header_bytes[header_start:header_ends[i]],
+                        *(int(v) for v in geometry)
+                    ))
+                    start = start_ends[i - 1] if i > 0 else 0
+                    starts.append(data['starts'][start:start_ends[i]])
+                index = cls(files, data['grid'], headers, starts)
+                if not np.array_equal(index._source(vms_path), data['source']):
+                    return None
+                return index
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def locate(self, left: int, top: int, width: int, height: int):
+        """
+        Parts of a level 0 window in JPEG files, as (file index, window in
+        the file, position in the window).
+        """
+        cols = np.searchsorted(self.col_lefts, [left, left + width - 1], side='right') - 1
+        rows = np.searchsorted(self.row_tops, [top, top + height - 1], side='right') - 1
+        for row in range(rows[0], rows[1] + 1):
+            for col in range(cols[0], cols[1] + 1):
+                i = self._by_position.get((col, row))
+                if i is None:
+                    continue
+                file_left, file_top = int(self.col_lefts[col]), int(self.row_tops[row])
+                x0, y0 = max(left, file_left), max(top, file_top)
+                x1 = min(left + width, file_left + self.headers[i].width)
+                y1 = min(top + height, file_top + self.headers[i].height)
+                if x1 > x0 and y1 > y0:
+                    yield i, (x0 - file_left, y0 - file_top, x1 - x0, y1 - y0), \
+                        (x0 - left, y0 - top)
+
+
+def vms_index_path(vms_path: Path) -> Path:
+    vms_path = Path(vms_path)
+    return vms_path.with_name(f".{vms_path.name}.index.npz")
+
+
+def _load_vms_index(format: AbstractFormat) -> Optional[VMSIndex]:
+    vms_path = Path(format.path)
+    persisted = vms_index_path(vms_path)
+    index = VMSIndex.load(persisted, vms_path)
+    if index is not None:
+        return index
+
+    try:
+        with timed('vms_index'):
+            index = VMSIndex.build(vms_path)
+    except (OSError, ValueError, struct.error) as e:
+        log.warning(f"VMS index of {vms_path} could not be built: {e}")
+        return None
+    try:
+        index.save(persisted, vms_path)
+    except OSError as e:
+        log.warning(f"VMS index could not be persisted to {persisted}: {e}")
+    return index
+
+
+def cached_vms_index(format: AbstractFormat) -> Optional[VMSIndex]:
+    return format.get_cached('_vms_index', _load_vms_index, format)
+
+
+class FileHandlePool:
+    """
+    Bounded pool of open file descriptors, read with `os.pread` so that
+    threads can share them. Evicted descriptors are closed once released.
+    """
+
+    def __init__(self, max_handles: int):
+        self.max_handles = max_handles
+        self._fds = OrderedDict()
+        self._users = dict()
+        self._evicted = set()
+        self._lock = threading.Lock()
+
+    def _close_unused(self):
+        for fd in [fd for fd in self._evicted if not self._users.get(fd)]:
+            self._evicted.discard(fd)
+            self._users.pop(fd, None)
+            os.close(fd)
+
+    @contextmanager
+    def open(self, path: str):
+        with self._lock:
+            fd = self._fds.get(path)
+            if fd is None:
+                fd = os.open(path, os.O_RDONLY)
+                self._fds[path] = fd
+                while len(self._fds) > self.max_handles:
+                    _, evicted = self._fds.popitem(last=False)
+                    self._evicted.add(evicted)
+            self._fds.move_to_end(path)
+            self._users[fd] = self._users.get(fd, 0) + 1
+            self._close_unused()
+        try:
+            yield fd
+        finally:
+            with self._lock:
+                self._users[fd] -= 1
+                self._close_unused()
+
+    def clear(self):
+        with self._lock:
+            self._evicted.update(self._fds.values())
+            self._fds.clear()
+            self._close_unused()
+
+
+_handles: Optional[FileHandlePool] = None
+
+
+def get_jpeg_handle_pool() -> FileHandlePool:
+    global _handles
+    if _handles is None:
+        _handles = FileHandlePool(get_settings().vms_file_handles)
+    return _handles
+
+
+def read_intervals(
+    index: VMSIndex, directory: Path, i: int, window: Tuple[int, int, int, int]
+) -> VIPSImage:
+    """
+    Decode a window of a JPEG file from the restart intervals covering it
+    only, by decoding a JPEG made of these intervals.
+    """
+    header, starts = index.headers[i], index.starts[i]
+    left, top, width, height = window
+    interval_width = header.restart_interval * header.mcu_width
+    col0, col1 = left // interval_width, (left + width - 1) // interval_width
+    row0, row1 = top // header.mcu_height, (top + height - 1) // header.mcu_height
+
+    data = bytearray()
+    n = 0
+    with get_jpeg_handle_pool().open(str(directory / index.files[i])) as fd:
+        for row in range(row0, row1 + 1):
+            first = row * header.intervals_across + col0
+            last = row * header.intervals_across + col1
+            # Consecutive intervals are read at once, markers included.
+            chunk = os.pread(
+                fd, int(starts[last + 1] - 2 - starts[first]), int(starts[first])
+            )
+            for k in range(first, last + 1):
+                begin = int(starts[k] - starts[first])
+                end = int(starts[k + 1] - 2 - starts[first])
+                if n > 0:
+                    data += bytes((0xFF, 0xD0 + (n - 1) % 8))
+                data += chunk[begin:end]
+                n += 1
+    data += EOI
+    count('decoded_restart_intervals', n)
+
+    # Last intervals of the file may be partially in the image.
+    jpeg_width = min((col1 + 1) * interval_width, header.width) \
+        - col0 * interval_width
+    jpeg_height = min((row1 + 1) * header.mcu_height, header.height) \
+        - row0 * header.mcu_height
+    # Lazy: pixels are decoded when the image is consumed.
+    im = VIPSImage.jpegload_buffer(
+        header.with_size(jpeg_width, jpeg_height) + bytes(data)
+    )
+    return im.extract_area(
+        left - col0 * interval_width, top - row0 * header.mcu_height,
+        width, height
+    )
+
+
+class VMSReader(OpenslideVipsReader):
+    """
+    Level 0 reads decode only the restart intervals they need. Other
+    levels (JPEG scaled on load by OpenSlide) use OpenSlide.
+    """
+
+    def _read_area(
+        self, tier, left: int, top: int, width: int, height: int, c=None
+    ) -> VIPSImage:
+        index = None
+        if tier.data.get('sidecar_path') is None \
+                and tier.data.get('openslide_level', tier.level) == 0:
+            index = cached_vms_index(self.format)
+        if index is None or index.width != tier.width \
+                or index.height != tier.height:
+            return super()._read_area(tier, left, top, width, height, c)
+
+        parts = list(index.locate(left, top, width, height))
+        if not all(index.headers[i].is_indexable for i, _, _ in parts):
+            return super()._read_area(tier, left, top, width, height, c)
+
+        directory = Path(self.format.path).parent
+        if len(parts) == 1 and parts[0][1][2:] == (width, height):
+            im = read_intervals(index, directory, parts[0][0], parts[0][1])
+        else:
+            im = VIPSImage.black(width, height, bands=3)
+            for i, window, (x, y) in parts:
+                im = im.insert(read_intervals(index, directory, i, window), x, y)
+        return flatten(im, None if c is None else channel_list(c, im.bands))
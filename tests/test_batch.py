@@ -0,0 +1,28 @@
+from pims_plugin_format_openslide.utils.batch import chunks, plan_extractions
+from pims_plugin_format_openslide.utils.pyramid import CompactPyramid
+
+
+def plan(requests):
+    pyramid = CompactPyramid([4096, 1024], [4096, 1024], [256] * 2, [256] * 2)
+    return plan_extractions(requests, pyramid, lambda level: (256, 256))
+
+
+def test_extractions_are_sorted_by_tier_and_tile():
+    extractions = plan([
+        ((2048, 2048, 100, 100), 100, 100),
+        ((0, 0, 4096, 4096), 1024, 1024),
+        ([(10, 10), (300, 10), (10, 300)], 290, 290),
+    ])
+    assert [e.index for e in extractions] == [2, 0, 1]
+    assert extractions[0].tiles == ((0, 0, 0), (0, 1, 0), (0, 0, 1))
+    assert extractions[2].level == 1 and len(extractions[2].tiles) == 16
+
+
+def test_chunks_decode_every_tile_once():
+    extractions = plan([((x, 0, 300, 200), 300, 200) for x in (0, 100, 200, 1000)])
+    decoded, released = [], []
+    for chunk, needed, freed in chunks(extractions, 2):
+        decoded += needed
+        released += freed
+    assert len(decoded) == len(set(decoded)) == 5
+    assert sorted(released) == sorted(decoded)
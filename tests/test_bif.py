@@ -0,0 +1,112 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from pims_plugin_format_openslide.vendors import bif
+from pims_plugin_format_openslide.vendors.bif import (
+    VentanaMetadata, parse_ventana_xml, ventana_metadata_path
+)
+
+ISCAN = b"""<?xml version="1.0"?>
+<Metadata><iScan ScanDate="8/18/2014 09:44:30" ScannerModel="VENTANA iScan HT"
+ Magnification="40" ScanRes="0.2325"/></Metadata>"""
+
+ENCODE_INFO = b"""<?xml version="1.0"?>
+<EncodeInfo><SlideStitchInfo>
+<ImageInfo AOIScanned="1" AOIIndex="2" Width="1024" Height="1024"
+ NumRows="3" NumCols="4" Pos-X="100" Pos-Y="200">
+<TileJointInfo FlagJoined="1" Confidence="95" Direction="RIGHT"
+ Tile1="1" Tile2="2" OverlapX="12" OverlapY="-1"/>
+<TileJointInfo FlagJoined="0" Confidence="10" Direction="UP"
+ Tile1="1" Tile2="5" OverlapX="0" OverlapY="9"/>
+<TileJointInfo FlagJoined="1" Direction="DIAGONAL" Tile1="1" Tile2="6"/>
+</ImageInfo>
+</SlideStitchInfo></EncodeInfo>"""
+
+
+def test_parse_ventana_xml():
+    metadata = parse_ventana_xml(ISCAN, ENCODE_INFO)
+
+    assert metadata.iscan['ScannerModel'] == "VENTANA iScan HT"
+    assert metadata.iscan['ScanRes'] == "0.2325"
+
+    assert len(metadata.images) == 1
+    image = metadata.images[0]
+    assert image['aoi'] == 2 and image['scanned']
+    assert (image['tile_width'], image['tile_height']) == (1024, 1024)
+    assert (image['n_rows'], image['n_cols']) == (3, 4)
+    assert (image['pos_x'], image['pos_y']) == (100, 200)
+
+    # Joints with an unknown direction are dropped.
+    joints = metadata.joints
+    assert len(joints) == 2
+    assert list(joints['aoi']) == [2, 2]
+    assert list(joints['tile2']) == [2, 5]
+    assert list(joints['direction']) == [1, 2]
+    assert list(joints['overlap_x']) == [12, 0]
+    assert list(joints['overlap_y']) == [-1, 9]
+    assert list(joints['joined']) == [True, False]
+
+
+def _format(path):
+    page = SimpleNamespace(tags={bif.XMP_TAG: SimpleNamespace(value=ENCODE_INFO)})
+    return SimpleNamespace(path=path, _tf=SimpleNamespace(pages=[page]))
+
+
+def test_persisted_metadata_is_invalidated(tmp_path, monkeypatch):
+    slide = tmp_path / "slide.bif"
+    slide.write_bytes(b"0" * 16)
+    parsed = []
+
+    def parse(*packets):
+        parsed.append(packets)
+        return parse_ventana_xml(*packets)
+    monkeypatch.setattr(bif, 'parse_ventana_xml', parse)
+
+    metadata = bif._load_ventana_metadata(_format(slide))
+    assert len(parsed) == 1
+    assert ventana_metadata_path(slide).exists()
+
+    loaded = VentanaMetadata.load(ventana_metadata_path(slide), slide)
+    assert (loaded.images == metadata.images).all()
+    assert (loaded.joints == metadata.joints).all()
+    bif._load_ventana_metadata(_format(slide))
+    assert len(parsed) == 1
+
+    stat = os.stat(slide)
+    os.utime(slide, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert VentanaMetadata.load(ventana_metadata_path(slide), slide) is None
+    bif._load_ventana_metadata(_format(slide))
+    assert len(parsed) == 2
+
+    stat = os.stat(slide)
+    slide.write_bytes(b"0" * 32)
+    os.utime(slide, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert VentanaMetadata.load(ventana_metadata_path(slide), slide) is None
+    bif._load_ventana_metadata(_format(slide))
+    assert len(parsed) == 3
+
+
+def test_corrupt_persisted_metadata(tmp_path):
+    slide = tmp_path / "slide.bif"
+    slide.write_bytes(b"0" * 16)
+    persisted = ventana_metadata_path(slide)
+    persisted.write_bytes(b"PK\x03\x04truncated")
+    assert VentanaMetadata.load(persisted, slide) is None
+
+    metadata = bif._load_ventana_metadata(_format(slide))
+    assert len(metadata.joints) == 2
+    assert VentanaMetadata.load(persisted, slide) is not None
+
+
+def test_failed_save_leaves_no_temporary_file(tmp_path, monkeypatch):
+    slide = tmp_path / "slide.bif"
+    slide.write_bytes(b"0" * 16)
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(bif.np, 'savez', fail)
+    with pytest.raises(OSError):
+        parse_ventana_xml(ENCODE_INFO).save(ventana_metadata_path(slide), slide)
+    assert [path.name for path in tmp_path.iterdir()] == ["slide.bif"]
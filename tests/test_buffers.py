@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from pyvips import Image as VIPSImage
+
+from pims_plugin_format_openslide.utils import engine
+from pims_plugin_format_openslide.utils.buffers import BufferPool, write_into
+from pims_plugin_format_openslide.utils.tiff import to_vips
+
+
+def test_buffer_pool_reuse():
+    pool = BufferPool(max_bytes=1024)
+    buffer = pool.acquire((8, 8, 3))
+    pool.release(buffer)
+    assert pool.acquire((8, 8, 3)) is buffer
+    assert pool.nbytes == 0
+
+    pool.release(np.empty((32, 32, 3), dtype=np.uint8))  # beyond max_bytes
+    assert pool.nbytes == 0
+
+
+def test_buffer_pool_keyed_by_dtype():
+    pool = BufferPool(max_bytes=4096)
+    buffer = pool.acquire((8, 8, 3), np.uint16)
+    assert buffer.dtype == np.uint16
+    pool.release(buffer)
+    assert pool.acquire((8, 8, 3)).dtype == np.uint8
+    assert pool.acquire((8, 8, 3), np.uint16) is buffer
+
+
+class _ArrayReader(engine.OpenslideVipsReader):
+    def __init__(self, image):
+        self.format = None
+        self.image = image
+
+    def _read_area(self, tier, left, top, width, height, c=None):
+        return to_vips(self.image[top:top + height, left:left + width])
+
+
+def test_read_tile_into_native_bit_depth(monkeypatch):
+    monkeypatch.setattr(engine, 'get_buffer_pool', lambda: BufferPool(2 ** 20))
+    image = np.arange(64 * 96 * 3, dtype=np.uint16).reshape(64, 96, 3)
+    reader = _ArrayReader(image)
+    tile = SimpleNamespace(tier=None, left=32, top=16, width=48, height=40)
+
+    out = reader.read_tile_into(tile)
+    assert out.dtype == np.uint16
+    assert np.array_equal(out, image[16:56, 32:80])
+
+
+def test_write_into():
+    im = (VIPSImage.black(20, 10, bands=3) + [1, 2, 3]).cast('uchar')
+    out = np.zeros((10, 20, 3), dtype=np.uint8)
+    assert write_into(im, out) is out
+    assert (out == [1, 2, 3]).all()
+
+    resized = write_into(im, np.zeros((5, 7, 3), dtype=np.uint8))
+    assert (resized == [1, 2, 3]).all()
+
+    with pytest.raises(ValueError):
+        write_into(im, np.zeros((10, 20, 1), dtype=np.uint8))
+
+
+def test_write_into_native_bit_depth():
+    im = (VIPSImage.black(20, 10, bands=3) + [1000, 2000, 4095]).cast('ushort')
+    out = write_into(im, np.zeros((5, 10, 3), dtype=np.uint16))
+    assert (out == [1000, 2000, 4095]).all()
+
+    with pytest.raises(ValueError):
+        write_into(im, np.zeros((10, 20, 3), dtype=np.float16))
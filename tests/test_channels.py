@@ -0,0 +1,28 @@
+import numpy as np
+
+from pims_plugin_format_openslide.utils.channels import (
+    STAIN_MATRICES, flatten_array, stain_channels
+)
+
+
+def test_flatten_array_opaque_is_view():
+    array = np.full((8, 8, 4), 255, dtype=np.uint8)
+    flat = flatten_array(array, [1])
+    assert flat.shape == (8, 8, 1)
+    assert np.shares_memory(flat, array)
+
+
+def test_flatten_array_alpha():
+    array = np.full((2, 2, 4), 200, dtype=np.uint8)
+    array[..., 3] = 0
+    assert flatten_array(array, [0, 2]).max() == 0
+
+
+def test_stain_channels_pure_hematoxylin():
+    od = STAIN_MATRICES['HE'][0] * 0.5
+    rgb = np.round(255 * 10 ** -od).astype(np.uint8)
+    rgb = np.broadcast_to(rgb, (4, 4, 3)).copy()
+    stains = stain_channels(rgb, ['hematoxylin', 'eosin'])
+    assert stains.shape == (4, 4, 2)
+    assert np.allclose(stains[..., 0], 0.5, atol=0.02)
+    assert np.allclose(stains[..., 1], 0, atol=0.02)
@@ -0,0 +1,76 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+
+from pims_plugin_format_openslide.utils import handles, pyramid as pyramid_module
+from pims_plugin_format_openslide.utils.handles import HandlePool
+from pims_plugin_format_openslide.utils.pyramid import CompactPyramid, cached_compact_pyramid
+
+
+def compact_pyramid():
+    return CompactPyramid(
+        [40000, 10000, 2500, 625], [30000, 7500, 1875, 469],
+        [256] * 4, [256] * 4
+    )
+
+
+def test_compact_pyramid_levels():
+    pyramid = compact_pyramid()
+    levels = pyramid.levels_for_downsamples([0.5, 1, 3.9, 4, 5, 16, 100])
+    assert np.array_equal(levels, [0, 0, 0, 1, 1, 2, 3])
+
+
+def test_compact_pyramid_locate():
+    pyramid = compact_pyramid()
+    assert pyramid.locate(1000, 1000, 4000, 4000, 1000, 1000) == \
+        (1, (250, 250, 1000, 1000))
+    assert pyramid.locate(0, 0, 40000, 30000, 100, 100) == \
+        (3, (0, 0, 625, 469))
+
+
+def test_compact_pyramid_clipped_window():
+    pyramid = compact_pyramid()
+    assert pyramid.scale_window(1, 39000, 29000, 4000, 4000) == \
+        (9750, 7250, 250, 250)
+
+
+class _Format:
+    def __init__(self, path, parsed):
+        self.path = path
+        self.parsed = parsed
+        self._cache = dict()
+
+    @property
+    def pyramid(self):
+        self.parsed.append(self)
+        return SimpleNamespace(tiers=[
+            SimpleNamespace(width=w, height=h, tile_width=256, tile_height=256)
+            for w, h in ((1000, 800), (250, 200))
+        ])
+
+    def get_cached(self, key, func, *args):
+        if key not in self._cache:
+            self._cache[key] = func(*args)
+        return self._cache[key]
+
+
+def test_compact_pyramid_shared_by_format_instances(tmp_path, monkeypatch):
+    pool = HandlePool('test', max_entries=4)
+    monkeypatch.setattr(pyramid_module, 'get_handle_pool', lambda: pool)
+    monkeypatch.setattr(handles, '_handles', pool)
+    slide = tmp_path / "slide.svs"
+    slide.write_bytes(b"slide")
+    parsed = []
+
+    view = cached_compact_pyramid(_Format(slide, parsed))
+    assert cached_compact_pyramid(_Format(slide, parsed)) is view
+    assert len(parsed) == 1 and pool.nbytes == view.nbytes
+
+    stat = os.stat(slide)
+    os.utime(slide, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cached_compact_pyramid(_Format(slide, parsed)) is not view
+    assert len(parsed) == 2
+
+    handles.invalidate(slide)
+    assert len(pool) == 0
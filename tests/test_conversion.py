@@ -0,0 +1,58 @@
+import os
+
+from pims.formats.utils.structures.pyramid import Pyramid
+from pyvips import Image as VIPSImage
+
+from pims_plugin_format_openslide.utils import conversion
+from pims_plugin_format_openslide.utils.conversion import (
+    apply_conversion, converted_path, is_converted
+)
+from pims_plugin_format_openslide.utils.sidecar import write_pyramid
+
+
+class _Format:
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def get_identifier(cls):
+        return 'NDPI'
+
+
+def _original(width, height):
+    pyramid = Pyramid()
+    pyramid.insert_tier(width, height, (width, 8))
+    pyramid.insert_tier(width // 4, height // 4, (width // 4, 8))
+    return pyramid
+
+
+def test_serve_converted_copy_once_ready(tmp_path, monkeypatch):
+    slide = tmp_path / "slide.ndpi"
+    slide.write_bytes(b"original")
+    dest = converted_path(slide)
+    assert dest == tmp_path / ".slide.ndpi.converted.tif"
+
+    scheduled = []
+    monkeypatch.setattr(conversion, 'conversion_formats', lambda: {'NDPI'})
+    monkeypatch.setattr(
+        conversion, 'schedule_build', lambda path, dest, *args: scheduled.append(dest)
+    )
+    original = _original(1000, 600)
+    assert apply_conversion(_Format(slide), original) is original
+    assert scheduled == [dest]
+
+    write_pyramid(VIPSImage.black(1000, 600, bands=3), dest, 256, 90)
+    pyramid = apply_conversion(_Format(slide), original)
+    assert pyramid is not original and len(pyramid.tiers) == 3
+    assert all(tier.data['sidecar_path'] == str(dest) for tier in pyramid.tiers)
+
+    # Stale copy of a slide modified since.
+    os.utime(slide, ns=(dest.stat().st_mtime_ns + 10**9,) * 2)
+    assert not is_converted(slide, dest)
+    assert apply_conversion(_Format(slide), original) is original
+
+
+def test_no_conversion_without_policy(tmp_path, monkeypatch):
+    monkeypatch.setattr(conversion, 'conversion_formats', lambda: {'VMS'})
+    original = _original(1000, 600)
+    assert apply_conversion(_Format(tmp_path / "slide.ndpi"), original) is original
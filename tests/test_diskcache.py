@@ -0,0 +1,101 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+from pyvips import Image as VIPSImage
+
+from pims_plugin_format_openslide.utils import engine
+from pims_plugin_format_openslide.utils.channels import to_numpy
+from pims_plugin_format_openslide.utils.diskcache import DiskTileCache, slide_fingerprint
+
+
+def test_disk_tile_cache(tmp_path):
+    cache = DiskTileCache(tmp_path / "cache", max_bytes=10000)
+    key = ("fingerprint", 0, 0, 0, 256, 256, None, "jpeg", 75)
+    assert cache.get(key, "jpg") is None
+    cache.put(key, "jpg", b"tile")
+    assert cache.get(key, "jpg") == b"tile"
+    assert cache.get(key[:-1] + (90,), "jpg") is None
+
+
+def test_disk_tile_cache_eviction(tmp_path):
+    cache = DiskTileCache(tmp_path / "cache", max_bytes=4000)
+    for i in range(10):
+        cache.put(("slide", i), "jpg", bytes(1000))
+        path = cache._path(("slide", i), "jpg")
+        os.utime(path, ns=(i * 10 ** 9, i * 10 ** 9))
+    cache.evict()
+    assert cache.size() <= 4000
+    assert cache.get(("slide", 9), "jpg") is not None
+    assert cache.get(("slide", 0), "jpg") is None
+
+
+def test_slide_fingerprint(tmp_path):
+    slide = tmp_path / "slide.svs"
+    slide.write_bytes(b"header" * 10)
+    fingerprint = slide_fingerprint(slide)
+    slide.write_bytes(b"HEADER" * 10)
+    os.utime(slide, ns=(0, 0))
+    assert slide_fingerprint(slide) != fingerprint
+
+
+class _Format:
+    def __init__(self, path):
+        self.path = path
+        self._cache = dict()
+
+    def get_cached(self, key, func, *args):
+        if key not in self._cache:
+            self._cache[key] = func(*args)
+        return self._cache[key]
+
+
+class _CountingReader(engine.OpenslideVipsReader):
+    decoded = 0
+
+    def _read_area(self, tier, left, top, width, height, c=None):
+        self.decoded += 1
+        return (VIPSImage.black(width, height, bands=3) + [left % 256, top % 256, 7]).cast('uchar')
+
+
+def test_read_tile_uses_disk_cache(tmp_path, monkeypatch):
+    slide = tmp_path / "slide.svs"
+    slide.write_bytes(b"header")
+    cache = DiskTileCache(tmp_path / "cache", max_bytes=10 ** 7)
+    monkeypatch.setattr(engine, 'get_disk_tile_cache', lambda: cache)
+
+    reader = _CountingReader(_Format(slide))
+    tier = SimpleNamespace(level=0, data=dict())
+    tile = SimpleNamespace(tier=tier, left=256, top=512, width=64, height=32)
+    first = to_numpy(reader.read_tile(tile))
+    second = to_numpy(reader.read_tile(tile))
+    assert reader.decoded == 1
+    assert np.array_equal(first, second)
+    assert (second == [0, 0, 7]).all()
+
+    reader.read_tile(tile, c=[0])
+    assert reader.decoded == 2
+
+
+class _Uint16Reader(engine.OpenslideVipsReader):
+    decoded = 0
+
+    def _read_area(self, tier, left, top, width, height, c=None):
+        self.decoded += 1
+        return (VIPSImage.black(width, height, bands=1) + 40000).cast('ushort')
+
+
+def test_disk_cache_keeps_bit_depth(tmp_path, monkeypatch):
+    slide = tmp_path / "slide.svs"
+    slide.write_bytes(b"header")
+    cache = DiskTileCache(tmp_path / "cache", max_bytes=10 ** 7)
+    monkeypatch.setattr(engine, 'get_disk_tile_cache', lambda: cache)
+
+    reader = _Uint16Reader(_Format(slide))
+    tier = SimpleNamespace(level=0, data=dict())
+    tile = SimpleNamespace(tier=tier, left=0, top=0, width=64, height=32)
+    reader.read_tile(tile)
+    cached = to_numpy(reader.read_tile(tile))
+    assert reader.decoded == 1
+    assert cached.dtype == np.uint16
+    assert (cached == 40000).all()
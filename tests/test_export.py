@@ -0,0 +1,78 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from pyvips import Image as VIPSImage
+
+from pims_plugin_format_openslide.utils import engine
+from pims_plugin_format_openslide.utils.buffers import write_into
+from pims_plugin_format_openslide.utils.export import StripWriter
+from pims_plugin_format_openslide.utils.tiff import to_vips
+
+
+def test_strip_writer(tmp_path):
+    image = np.arange(1200 * 600, dtype=np.uint16).reshape(1200, 600, 1)
+    dest = tmp_path / "export.tif"
+    with StripWriter(dest, 600, 1200, 1, np.uint16) as writer:
+        for top in range(0, 1200, 64):
+            writer.write(top, image[top:top + 64])
+        writer.save()
+    assert [path.name for path in tmp_path.iterdir()] == ["export.tif"]
+
+    im = VIPSImage.tiffload(str(dest))
+    assert im.get('n-pages') > 1
+    array = np.ndarray(buffer=im.write_to_memory(), dtype=np.uint16, shape=(1200, 600))
+    assert np.array_equal(array, image[..., 0])
+
+
+def test_strip_writer_jpeg(tmp_path):
+    with pytest.raises(ValueError):
+        StripWriter(tmp_path / "export.jpg", 200, 300, 1, np.uint16, 'jpeg')
+
+    events = []
+    with StripWriter(tmp_path / "export.jpg", 200, 300, 3, np.uint8, 'jpeg') as writer:
+        writer.write(0, np.full((300, 200, 3), 128, dtype=np.uint8))
+        writer.save(lambda phase, fraction: events.append((phase, fraction)))
+    assert VIPSImage.new_from_file(str(tmp_path / "export.jpg")).width == 200
+    assert events[-1] == ('encode', 1.0)
+
+
+class _ArrayReader(engine.OpenslideVipsReader):
+    def __init__(self, image):
+        self.format = None
+        self.image = image
+        self.tier = SimpleNamespace(width=image.shape[1], height=image.shape[0])
+
+    def _locate(self, region, out_width, out_height):
+        return self.tier, (region.left, region.top, region.width, region.height)
+
+    def _read_area_array(self, tier, left, top, width, height, c=None):
+        return self.image[top:top + height, left:left + width]
+
+
+def test_export_window_matches_single_resize(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 2 ** 16, (700, 500, 1), dtype=np.uint16)
+    reader = _ArrayReader(image)
+    monkeypatch.setattr(engine, 'cached_compact_pyramid', lambda format: SimpleNamespace(
+        tiers=[reader.tier], tile_widths=[64], tile_heights=[64]
+    ))
+
+    region = SimpleNamespace(left=30, top=50, width=450, height=610)
+    dest = reader.export_window(region, 190, 257, tmp_path / "export.tif")
+
+    expected = write_into(
+        to_vips(image[50:660, 30:480]), np.empty((257, 190, 1), dtype=np.uint16)
+    )
+    im = VIPSImage.tiffload(str(dest))
+    array = np.ndarray(buffer=im.write_to_memory(), dtype=np.uint16, shape=(257, 190, 1))
+    assert np.array_equal(array, expected)
+
+
+def test_export_empty_window(tmp_path):
+    reader = _ArrayReader(np.zeros((10, 10, 1), dtype=np.uint8))
+    for width, height, out_width, out_height in ((0, 10, 10, 10), (10, 10, 10, 0)):
+        region = SimpleNamespace(left=0, top=0, width=width, height=height)
+        with pytest.raises(ValueError):
+            reader.export_window(region, out_width, out_height, tmp_path / "export.tif")
+    assert list(tmp_path.iterdir()) == []
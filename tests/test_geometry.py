@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from pims_plugin_format_openslide.utils.geometry import (
+    covered_tiles, geometry_bounds, rasterize
+)
+
+
+def test_bounds():
+    assert geometry_bounds([(10, 20), (30, 20), (30, 50)]) == (10, 20, 21, 31)
+    multipoint = {'type': 'MultiPoint', 'coordinates': [(1.5, 2), (4, 8.2)]}
+    assert geometry_bounds(multipoint) == (1, 2, 4, 7)
+    with pytest.raises(ValueError):
+        geometry_bounds({'type': 'GeometryCollection', 'geometries': []})
+
+
+def test_rasterize_with_hole_and_scale():
+    polygon = {'type': 'Polygon', 'coordinates': [
+        [(0, 0), (100, 0), (100, 100), (0, 100), (0, 0)],
+        [(40, 40), (60, 40), (60, 60), (40, 60), (40, 40)],
+    ]}
+    mask = rasterize(polygon, (0, 0, 100, 100), 50, 50)
+    assert mask.shape == (50, 50)
+    assert mask[5, 5] and not mask[25, 25]
+
+
+def test_covered_tiles_skips_tiles_outside_geometry():
+    # Diagonal line over a 4x4 tile grid
+    window = (0, 0, 400, 400)
+    mask = rasterize([(0, 0), (399, 399)], window, 400, 400)
+    assert covered_tiles(mask, window, 100, 100) == [(i, i) for i in range(4)]
+
+    # Window not aligned on tiles
+    mask = np.zeros((150, 150), dtype=bool)
+    mask[0, 0] = True
+    assert covered_tiles(mask, (50, 50, 150, 150), 100, 100) == [(0, 0)]
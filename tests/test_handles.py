@@ -0,0 +1,154 @@
+import os
+from types import SimpleNamespace
+
+from pims_plugin_format_openslide.utils import handles, warmup
+from pims_plugin_format_openslide.utils.handles import (
+    HandlePool, LRUCache, ParsedCache, shared_parsing
+)
+
+
+def _touch(path, content=b"slide"):
+    path.write_bytes(content)
+    return path
+
+
+def _bump_mtime(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache('test', max_entries=2)
+    cache.get_or_create('a', lambda: 1)
+    cache.get_or_create('b', lambda: 2)
+    assert cache.get_or_create('a', lambda: None) == 1  # refresh
+    cache.get_or_create('c', lambda: 3)
+
+    assert len(cache) == 2
+    assert cache.get_or_create('b', lambda: 'created') == 'created'
+    assert cache.get_or_create('a', lambda: 1) == 1
+    assert cache.get_or_create('b', lambda: None) == 'created'
+
+
+def test_lru_cache_bounded_in_bytes():
+    cache = LRUCache('test', max_entries=10, max_bytes=10, sizeof=len)
+    cache.get_or_create('a', lambda: b"0" * 6)
+    cache.get_or_create('b', lambda: b"0" * 6)
+    assert len(cache) == 1 and cache.nbytes == 6
+
+
+class _Loader:
+    def __init__(self):
+        self.loads = []
+
+    def openslideload(self, path, **options):
+        self.loads.append((path, options))
+        return SimpleNamespace(width=10, height=10, bands=4)
+
+
+def test_handle_pool_reuses_handles(tmp_path, monkeypatch):
+    loader = _Loader()
+    monkeypatch.setattr(handles, 'VIPSImage', loader)
+    slide = _touch(tmp_path / "slide.svs")
+    pool = HandlePool('test', max_entries=4, handle_bytes=1000)
+
+    handle = pool.openslide(slide)
+    assert pool.openslide(slide) is handle
+    level = pool.openslide(slide, level=1)
+    assert level is not handle
+    pool.openslide(slide, associated='macro')
+    assert [options for _, options in loader.loads] == [
+        {}, {'level': 1}, {'associated': 'macro'}
+    ]
+    # Associated images are charged their decoded size.
+    assert pool.nbytes == 2 * 1000 + 10 * 10 * 4
+
+
+def test_handle_pool_invalidated_by_fingerprint(tmp_path, monkeypatch):
+    loader = _Loader()
+    monkeypatch.setattr(handles, 'VIPSImage', loader)
+    slide = _touch(tmp_path / "slide.svs")
+    pool = HandlePool('test', max_entries=4)
+
+    handle = pool.openslide(slide)
+    _bump_mtime(slide)
+    assert pool.openslide(slide) is not handle
+    _touch(slide, b"modified slide")
+    pool.openslide(slide)
+    assert len(loader.loads) == 3
+
+
+def test_handle_pool_evicts_least_recently_used(tmp_path, monkeypatch):
+    loader = _Loader()
+    monkeypatch.setattr(handles, 'VIPSImage', loader)
+    slides = [_touch(tmp_path / f"slide{i}.svs") for i in range(3)]
+    pool = HandlePool('test', max_entries=2)
+
+    for slide in slides:
+        pool.openslide(slide)
+    pool.openslide(slides[0])
+    assert len(pool) == 2
+    assert len(loader.loads) == 4
+
+
+def test_parsed_cache_returns_copies(tmp_path):
+    slide = _touch(tmp_path / "slide.svs")
+    cache = ParsedCache('test', max_entries=4)
+    parsed = []
+
+    def parse():
+        parsed.append(1)
+        return {'width': 100}
+
+    first = cache.get_or_parse(slide, 'SVSFormat', 'main', parse)
+    first['width'] = 0
+    assert cache.get_or_parse(slide, 'SVSFormat', 'main', parse) == {'width': 100}
+    assert len(parsed) == 1
+
+    cache.get_or_parse(slide, 'NDPIFormat', 'main', parse)
+    assert len(parsed) == 2
+    _bump_mtime(slide)
+    cache.get_or_parse(slide, 'SVSFormat', 'main', parse)
+    assert len(parsed) == 3
+
+
+def test_shared_parsing(tmp_path, monkeypatch):
+    monkeypatch.setattr(handles, '_parsed', ParsedCache('test', max_entries=4))
+    slide = _touch(tmp_path / "slide.svs")
+    calls = []
+
+    class Parser:
+        def __init__(self, format):
+            self.format = format
+
+        def parse_main_metadata(self):
+            calls.append(self.format)
+            return SimpleNamespace(width=100)
+
+    Shared = shared_parsing(type('Shared', (Parser,), {}))
+    first = Shared(SimpleNamespace(path=slide)).parse_main_metadata()
+    first.width = 0
+    second = Shared(SimpleNamespace(path=slide)).parse_main_metadata()
+    assert second.width == 100
+    assert len(calls) == 1
+
+    handles.invalidate(slide)
+    Shared(SimpleNamespace(path=slide)).parse_main_metadata()
+    assert len(calls) == 2
+
+
+def test_warm_up(monkeypatch):
+    def warm_slide(path, overview_size):
+        if path == 'broken':
+            raise ValueError(path)
+        return path != 'other'
+    monkeypatch.setattr(warmup, 'warm_slide', warm_slide)
+
+    report = warmup.warm_up(['a', 'broken', 'other', 'b'], workers=1)
+    assert report.warmed == ['a', 'b']
+    assert report.failed == ['broken']
+    assert report.skipped == ['other']
+
+    report = warmup.warm_up(['a', 'b', 'c'], time_budget=0, workers=1)
+    assert report.warmed == ['a']
+    assert report.skipped == ['b', 'c']
@@ -0,0 +1,76 @@
+import json
+
+from pims_plugin_format_openslide.utils import ingest as ingest_module
+from pims_plugin_format_openslide.utils.ingest import ingest, ingest_slide, read_journal
+
+
+def _journal(path, entries):
+    with open(path, "w") as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+
+
+def _entry(slide, **changes):
+    stat = slide.stat()
+    return {
+        "path": str(slide), "status": "ok",
+        "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, **changes
+    }
+
+
+def test_resume_skips_unchanged_slides(tmp_path):
+    slide = tmp_path / "slide.svs"
+    slide.write_bytes(b"slide")
+    journal = tmp_path / "journal.jsonl"
+    _journal(journal, [_entry(slide)])
+
+    assert list(ingest([str(slide)], journal=str(journal), workers=1)) == []
+
+
+def test_changed_slide_is_reingested(tmp_path):
+    slide = tmp_path / "slide.svs"
+    slide.write_bytes(b"slide")
+    journal = tmp_path / "journal.jsonl"
+    _journal(journal, [_entry(slide, mtime_ns=slide.stat().st_mtime_ns - 10 ** 9)])
+
+    results = list(ingest([str(slide)], journal=str(journal), workers=1))
+    assert [result["path"] for result in results] == [str(slide)]
+    assert read_journal(journal)[str(slide)]["mtime_ns"] == slide.stat().st_mtime_ns
+
+
+def test_failed_slide_is_journaled(tmp_path):
+    missing = tmp_path / "missing.svs"
+    journal = tmp_path / "journal.jsonl"
+
+    result, = ingest([str(missing)], journal=str(journal), workers=1)
+    assert result["status"] == "error" and result["stage"] == "check"
+    assert read_journal(journal)[str(missing)]["status"] == "error"
+
+
+class _FailingFormat:
+    @classmethod
+    def match(cls, proxy):
+        return True
+
+    @classmethod
+    def from_proxy(cls, proxy):
+        return cls()
+
+    @classmethod
+    def get_name(cls):
+        return "Failing"
+
+    @property
+    def main_imd(self):
+        raise ValueError("corrupted")
+
+
+def test_failed_stage_is_reported(tmp_path, monkeypatch):
+    slide = tmp_path / "slide.svs"
+    slide.write_bytes(b"slide")
+    monkeypatch.setattr(ingest_module, 'openslide_formats', lambda: [_FailingFormat])
+
+    result = ingest_slide(str(slide), None)
+    assert result["status"] == "error" and result["stage"] == "parse"
+    assert result["error"] == "ValueError: corrupted"
+    assert "check" in result["timings"]
@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+
+import pytest
+
+from pims_plugin_format_openslide.utils import instrumentation
+from pims_plugin_format_openslide.utils.instrumentation import (
+    MemorySink, PrometheusSink, Sink, count, get_sink, timed, timed_method
+)
+
+
+def test_sink_is_abstract():
+    with pytest.raises(TypeError):
+        Sink()
+
+
+def test_sink_configured_on_first_use(monkeypatch):
+    sink = MemorySink()
+    configured = []
+    monkeypatch.setattr(instrumentation, '_sink', instrumentation._UNCONFIGURED)
+    monkeypatch.setattr(
+        instrumentation, '_sink_from_settings', lambda: configured.append(1) or sink
+    )
+    assert configured == []
+
+    with timed('decode'):
+        count('decoded_bytes', 10)
+    assert get_sink() is sink and configured == [1]
+    assert sink.counters[('decoded_bytes',)] == 10
+    key = ('phase_seconds', ('format', ''), ('phase', 'decode'))
+    assert sink.observations[key][0] == 1
+
+
+def test_prometheus_metrics_registered_once(monkeypatch):
+    prometheus_client = pytest.importorskip('prometheus_client')
+    registry = prometheus_client.CollectorRegistry()
+    monkeypatch.setattr(instrumentation, '_sink', PrometheusSink(registry))
+
+    class Parser:
+        format = SimpleNamespace()
+
+        @timed_method('parse_pyramid')
+        def parse_pyramid(self):
+            with timed('decode'):
+                count('decoded_bytes', 10)
+
+    Parser().parse_pyramid()
+    with timed('decode'):
+        pass
+
+    def sample(name, **labels):
+        return registry.get_sample_value(f'pims_openslide_{name}', labels)
+    assert sample('phase_seconds_count', phase='decode', format='') == 2
+    assert sample(
+        'phase_seconds_count', phase='parse_pyramid', format='SimpleNamespace'
+    ) == 1
+    assert sample('decoded_bytes_total') == 10
@@ -0,0 +1,47 @@
+import numpy as np
+
+from pims_plugin_format_openslide.utils.buffers import BufferPool
+from pims_plugin_format_openslide.utils.handles import LRUCache
+from pims_plugin_format_openslide.utils.memory import MemoryGovernor
+
+
+def _tiles(name):
+    return LRUCache(name, max_entries=100, sizeof=lambda array: array.nbytes)
+
+
+def test_budget_evicts_least_recently_used_across_caches():
+    governor = MemoryGovernor(budget=300)
+    a, b = _tiles('a'), _tiles('b')
+    governor.register('a', a)
+    governor.register('b', b)
+
+    a.get_or_create(1, lambda: np.zeros(100, np.uint8))
+    b.get_or_create(1, lambda: np.zeros(100, np.uint8))
+    a.get_or_create(2, lambda: np.zeros(100, np.uint8))
+    a.get_or_create(1, lambda: None)  # refresh
+    b.get_or_create(2, lambda: np.zeros(100, np.uint8))
+
+    # b[1] was the least recently used entry.
+    assert len(a) == 2 and len(b) == 1
+    assert governor.usage()['total'] == 300
+
+
+def test_free_buffers_are_dropped_first():
+    governor = MemoryGovernor(budget=150)
+    pool, tiles = BufferPool(max_bytes=1000), _tiles('tiles')
+    governor.register('buffers', pool)
+    governor.register('tiles', tiles)
+
+    tiles.get_or_create(1, lambda: np.zeros(100, np.uint8))
+    pool.release(np.zeros((10, 10), np.uint8))
+    assert len(tiles) == 1
+    assert governor.usage() == {'buffers': 0, 'tiles': 100, 'total': 100, 'budget': 150}
+
+
+def test_no_budget():
+    governor = MemoryGovernor()
+    tiles = _tiles('tiles')
+    governor.register('tiles', tiles)
+    for i in range(10):
+        tiles.get_or_create(i, lambda: np.zeros(100, np.uint8))
+    assert governor.nbytes == 1000
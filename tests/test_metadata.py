@@ -0,0 +1,57 @@
+from pims.formats.utils.structures.metadata import MetadataStore
+
+from pims_plugin_format_openslide.utils.metadata import LazyMetadataStore
+
+FIELDS = {
+    'vendor': 'aperio',
+    'mpp-x': 0.25,
+    'mpp-y': 0.26,
+}
+
+
+def _stores():
+    reads = []
+
+    def getter(key):
+        reads.append(key)
+        return FIELDS[key]
+
+    base = MetadataStore()
+    base.set('SVS.Filename', 'slide')
+    lazy = LazyMetadataStore.from_store(base)
+    lazy.set_lazy('openslide', lambda: list(FIELDS), getter, prefix='openslide')
+
+    eager = MetadataStore()
+    eager.set('SVS.Filename', 'slide')
+    for key, value in FIELDS.items():
+        eager.set(f"openslide.{key}", value)
+    return lazy, eager, reads
+
+
+def test_lazy_store_reads_nothing_until_accessed():
+    lazy, _, reads = _stores()
+    assert reads == []
+    assert lazy.namespaces() == ['OPENSLIDE', 'SVS']
+    assert lazy.get_value('SVS.Filename') == 'slide'
+    assert reads == []
+
+
+def test_lazy_store_key_access_reads_one_key():
+    lazy, eager, reads = _stores()
+    assert lazy.get_value('openslide.mpp-x') == eager.get_value('openslide.mpp-x')
+    assert reads == ['mpp-x']
+    lazy.get_value('openslide.mpp-x')
+    assert reads == ['mpp-x']
+
+
+def test_lazy_store_namespace_access_reads_namespace():
+    lazy, eager, reads = _stores()
+    assert lazy.get_namedstore('openslide') == eager.get_namedstore('openslide')
+    assert sorted(reads) == sorted(FIELDS)
+
+
+def test_lazy_store_full_dump_matches_eager_store():
+    lazy, eager, reads = _stores()
+    assert len(lazy) == len(eager)
+    assert sorted(reads) == sorted(FIELDS)
+    assert sorted(lazy.items()) == sorted(eager.items())
@@ -0,0 +1,101 @@
+from base64 import b64encode
+from types import SimpleNamespace
+
+from pims.utils import UNIT_REGISTRY
+
+from pims_plugin_format_openslide.vendors.philips import PhilipsParser, parse_philips_xml
+
+
+def _jpeg_header(width, height, components=3):
+    app0 = b'\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+    sof = b'\xff\xc0' + (8 + 3 * components).to_bytes(2, 'big') + b'\x08' \
+        + height.to_bytes(2, 'big') + width.to_bytes(2, 'big') \
+        + bytes([components]) + b'\x01\x11\x00' * components
+    return b'\xff\xd8' + app0 + sof + b'\x00' * 64
+
+
+def _scanned_image(image_type, content):
+    return f"""
+<DataObject ObjectType="DPScannedImage">
+<Attribute Name="PIM_DP_IMAGE_TYPE" PMSVR="IString">{image_type}</Attribute>
+{content}
+</DataObject>"""
+
+
+MACRO = b64encode(_jpeg_header(1600, 640)).decode()
+LABEL = b64encode(_jpeg_header(500, 520, components=1)).decode()
+WSI = """
+<Attribute Name="PIIM_PIXEL_DATA_REPRESENTATION_SEQUENCE" PMSVR="IDataObjectArray">
+<Array>
+<DataObject ObjectType="PixelDataRepresentation">
+<Attribute Name="DICOM_PIXEL_SPACING" PMSVR="IDoubleArray">"0.00050" "0.00052"</Attribute>
+<Attribute Name="PIIM_PIXEL_DATA_REPRESENTATION_NUMBER" PMSVR="IUInt16">1</Attribute>
+</DataObject>
+<DataObject ObjectType="PixelDataRepresentation">
+<Attribute Name="DICOM_PIXEL_SPACING" PMSVR="IDoubleArray">"0.00025" "0.00026"</Attribute>
+<Attribute Name="PIIM_PIXEL_DATA_REPRESENTATION_NUMBER" PMSVR="IUInt16">0</Attribute>
+</DataObject>
+</Array>
+</Attribute>"""
+
+DESCRIPTION = f"""<?xml version="1.0" encoding="UTF-8" ?>
+<DataObject ObjectType="DPUfsImport">
+<Attribute Name="DICOM_ACQUISITION_DATETIME" PMSVR="IString">20181019105847.000000</Attribute>
+<Attribute Name="DICOM_MANUFACTURERS_MODEL_NAME" PMSVR="IString">UFS Scanner</Attribute>
+<Attribute Name="DICOM_SOFTWARE_VERSIONS" PMSVR="IStringArray">"1.6.5505"</Attribute>
+<Attribute Name="PIM_DP_SCANNED_IMAGES" PMSVR="IDataObjectArray">
+<Array>
+{_scanned_image("WSI", WSI)}
+{_scanned_image("MACROIMAGE", f'<Attribute Name="PIM_DP_IMAGE_DATA">{MACRO}</Attribute>')}
+{_scanned_image("LABELIMAGE", f'<Attribute Name="PIM_DP_IMAGE_DATA">{LABEL}</Attribute>')}
+</Array>
+</Attribute>
+</DataObject>"""
+
+
+def test_parse_philips_xml():
+    philips = parse_philips_xml(DESCRIPTION)
+
+    assert philips.attributes['DICOM_MANUFACTURERS_MODEL_NAME'] == 'UFS Scanner'
+    assert 'DICOM_SOFTWARE_VERSIONS' not in philips.attributes
+    # Sorted by pixel data representation number, in millimeters.
+    assert philips.pixel_spacings == [(0.00025, 0.00026), (0.0005, 0.00052)]
+    assert philips.associated == {
+        'macro': (1600, 640, 3), 'label': (500, 520, 1)
+    }
+
+
+def test_parse_philips_xml_full():
+    attributes = parse_philips_xml(DESCRIPTION, full=True).attributes
+
+    assert attributes['DICOM_SOFTWARE_VERSIONS'] == '"1.6.5505"'
+    assert attributes['PIM_DP_SCANNED_IMAGES[1].PIM_DP_IMAGE_TYPE'] == 'MACROIMAGE'
+    assert not any(key.endswith('PIM_DP_IMAGE_DATA') for key in attributes)
+
+
+def test_known_metadata_from_xml(tmp_path, monkeypatch):
+    slide = tmp_path / "slide.tiff"
+    slide.write_bytes(b"")
+    page = SimpleNamespace(description=DESCRIPTION)
+    format = SimpleNamespace(path=slide, _tf=SimpleNamespace(pages=[page]))
+    parser = PhilipsParser(format)
+
+    def vips_known_metadata():
+        return SimpleNamespace(
+            microscope=SimpleNamespace(),
+            associated_macro=SimpleNamespace(),
+            associated_label=SimpleNamespace()
+        )
+    monkeypatch.setattr(parser, '_parse_vips_known_metadata', vips_known_metadata)
+
+    imd = parser.parse_known_metadata()
+    micrometers = UNIT_REGISTRY("micrometers")
+    assert round(float(imd.physical_size_x / micrometers), 6) == 0.26
+    assert round(float(imd.physical_size_y / micrometers), 6) == 0.25
+    assert imd.microscope.model == 'UFS Scanner'
+    assert imd.acquisition_datetime.year == 2018
+    assert (imd.associated_macro.width, imd.associated_macro.height) == (1600, 640)
+    assert imd.associated_macro.n_channels == 3
+    assert (imd.associated_label.width, imd.associated_label.height) == (500, 520)
+    assert imd.associated_label.n_channels == 1
+    assert imd.is_complete
@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import tifffile
+
+from pims_plugin_format_openslide.utils.planes import ZStackReader, find_z_planes, fuse_planes
+from pims_plugin_format_openslide.utils.channels import to_numpy
+from pims_plugin_format_openslide.utils.tiff import TiffTileReader, to_vips
+
+
+@pytest.fixture
+def stack():
+    rng = np.random.default_rng(0)
+    return (rng.random((3, 200, 300, 3)) * 255).astype(np.uint8)
+
+
+def test_read_planes(tmp_path, stack):
+    path = tmp_path / "z.tif"
+    tifffile.imwrite(
+        path, stack, tile=(1, 64, 64), volumetric=True, photometric='rgb',
+        compression='zlib'
+    )
+    with tifffile.TiffFile(path) as tf:
+        planes = find_z_planes(tf)
+        assert planes.n_planes == 3 and planes.pages == {(300, 200): 0}
+
+        reader = TiffTileReader(path, 0, tf.pages[0])
+        for z in range(3):
+            window = reader.read(50, 30, 150, 100, z)
+            assert np.array_equal(window, stack[z, 30:130, 50:200])
+        channel = reader.read(10, 10, 100, 100, 1, samples=[2])
+        assert np.array_equal(channel[..., 0], stack[1, 10:110, 10:110, 2])
+        with pytest.raises(ValueError):
+            reader.read(0, 0, 10, 10, 3)
+
+
+class _Format:
+    def __init__(self, path):
+        self.path = path
+        self._tf = tifffile.TiffFile(path)
+        self._cache = dict()
+
+    def get_cached(self, key, func, *args, **kwargs):
+        if key not in self._cache:
+            self._cache[key] = func(*args, **kwargs)
+        return self._cache[key]
+
+
+def test_read_plane_array(tmp_path, stack):
+    path = tmp_path / "z.tif"
+    tifffile.imwrite(
+        path, stack, tile=(1, 64, 64), volumetric=True, photometric='rgb',
+        compression='zlib'
+    )
+    format = _Format(path)
+    reader = ZStackReader(format)
+    tile = SimpleNamespace(
+        tier=SimpleNamespace(data=dict(), width=300, height=200),
+        left=64, top=64, width=64, height=64
+    )
+    try:
+        for z in range(3):
+            array = reader.read_tile_array(tile, z=z)
+            assert np.array_equal(array, stack[z, 64:128, 64:128])
+        channel = reader.read_tile_array(tile, c=1, z=2)
+        assert np.array_equal(channel[..., 0], stack[2, 64:128, 64:128, 1])
+    finally:
+        format._tf.close()
+
+
+def test_fuse_planes(stack):
+    blurred = np.full_like(stack, 128)
+    blurred[1] = stack[1]
+    assert np.array_equal(fuse_planes(blurred), stack[1])
+    assert np.array_equal(fuse_planes(stack, 'max'), stack.max(axis=0))
+    with pytest.raises(ValueError):
+        fuse_planes(stack, 'median')
+
+
+def test_read_native_bit_depth(tmp_path):
+    image = np.arange(200 * 300 * 3, dtype=np.uint16).reshape(200, 300, 3)
+    path = tmp_path / "16bit.tif"
+    tifffile.imwrite(path, image, tile=(64, 64), photometric='rgb', compression='zlib')
+    with tifffile.TiffFile(path) as tf:
+        reader = TiffTileReader(path, 0, tf.pages[0])
+        window = reader.read(50, 30, 150, 100)
+        assert window.dtype == np.uint16
+        assert np.array_equal(window, image[30:130, 50:200])
+        assert np.array_equal(to_numpy(to_vips(window)), window)
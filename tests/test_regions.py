@@ -0,0 +1,19 @@
+from pims_plugin_format_openslide.utils.regions import RegionIndex
+
+
+def test_region_index():
+    index = RegionIndex([
+        (5000, 0, 1000, 1000), (0, 0, 1000, 1000), (0, 2000, 3000, 500)
+    ])
+    assert index.intersecting((500, 500, 100, 100)) == [1]
+    assert index.intersecting((900, 900, 4200, 1200)) == [0, 1, 2]
+    assert index.intersecting((2000, 0, 1000, 1000)) == []
+    assert index.intersecting((2900, 2400, 100, 100)) == [2]
+
+
+def test_region_index_containing():
+    index = RegionIndex([(0, 0, 1000, 1000), (500, 500, 1000, 1000)])
+    assert index.containing((100, 100, 100, 100)) == 0
+    assert index.containing((1200, 1200, 100, 100)) == 1
+    assert index.containing((900, 100, 200, 100)) is None
+    assert RegionIndex([]).intersecting((0, 0, 10, 10)) == []
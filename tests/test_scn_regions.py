@@ -0,0 +1,79 @@
+from pims_plugin_format_openslide.vendors.scn import parse_scn_regions
+
+SCN_XML = """<?xml version="1.0"?>
+<scn xmlns="http://www.leica-microsystems.com/scn/2010/10/01">
+  <collection name="slide" sizeX="20000000" sizeY="10000000">
+    <image name="macro">
+      <pixels sizeX="800" sizeY="400">
+        <dimension sizeX="800" sizeY="400" r="0" ifd="0"/>
+      </pixels>
+      <view sizeX="20000000" sizeY="10000000" offsetX="0" offsetY="0" spacingZ="0"/>
+    </image>
+    <image name="region1">
+      <pixels sizeX="4000" sizeY="2000">
+        <dimension sizeX="4000" sizeY="2000" r="0" ifd="1"/>
+        <dimension sizeX="1000" sizeY="500" r="1" ifd="2"/>
+      </pixels>
+      <view sizeX="2000000" sizeY="1000000" offsetX="1000000" offsetY="500000" spacingZ="0"/>
+      <scanSettings><illuminationSettings>
+        <illuminationSource>brightfield</illuminationSource>
+      </illuminationSettings></scanSettings>
+    </image>
+    <image name="region2">
+      <pixels sizeX="2000" sizeY="2000">
+        <dimension sizeX="2000" sizeY="2000" r="0" ifd="3"/>
+      </pixels>
+      <view sizeX="1000000" sizeY="1000000" offsetX="8000000" offsetY="500000" spacingZ="0"/>
+    </image>
+  </collection>
+</scn>"""
+
+
+def test_parse_scn_regions():
+    region1, region2 = parse_scn_regions(SCN_XML)
+    assert region1.window == (2000, 1000, 4000, 2000)
+    assert region1.illumination == 'brightfield'
+    assert region1.ifd_for_downsample(4) == 2
+    assert region1.ifd_for_downsample(2) is None
+    assert region2.window == (16000, 1000, 2000, 2000)
+
+
+FLUORESCENCE_XML = """<?xml version="1.0"?>
+<scn xmlns="http://www.leica-microsystems.com/scn/2010/10/01">
+  <collection name="slide" sizeX="20000000" sizeY="10000000">
+    <image name="region1">
+      <creationDate>2012-03-01T10:00:00.00Z</creationDate>
+      <device model="Leica SCN400;Leica SCN" version="1.4"/>
+      <pixels sizeX="4000" sizeY="2000">
+        <dimension sizeX="4000" sizeY="2000" r="0" c="0" ifd="1"/>
+        <dimension sizeX="4000" sizeY="2000" r="0" c="1" ifd="2"/>
+        <dimension sizeX="1000" sizeY="500" r="1" c="0" ifd="3"/>
+        <dimension sizeX="1000" sizeY="500" r="1" c="1" ifd="4"/>
+      </pixels>
+      <view sizeX="2000000" sizeY="1000000" offsetX="1000000" offsetY="500000" spacingZ="0"/>
+      <scanSettings>
+        <objectiveSettings><objective>20</objective></objectiveSettings>
+        <illuminationSettings>
+          <illuminationSource>fluorescence</illuminationSource>
+        </illuminationSettings>
+        <channelSettings>
+          <channel name="DAPI"/>
+          <channel name="FITC"/>
+        </channelSettings>
+      </scanSettings>
+    </image>
+  </collection>
+</scn>"""
+
+
+def test_parse_scn_fluorescence():
+    regions = parse_scn_regions(FLUORESCENCE_XML)
+    assert regions.is_fluorescence
+    assert (regions.width, regions.height) == (40000, 20000)
+    assert regions.channel_names == ['DAPI', 'FITC']
+    assert regions.properties['objective'] == '20'
+
+    region, = regions
+    assert region.ifd_for_downsample(1) == 1
+    assert region.channel_ifds_for_downsample(4) == (3, 4)
+    assert not parse_scn_regions(SCN_XML).is_fluorescence
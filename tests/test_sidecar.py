@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+from pyvips import Image as VIPSImage
+
+from pims.formats.utils.structures.pyramid import Pyramid
+from pims_plugin_format_openslide.utils import engine, sidecar
+from pims_plugin_format_openslide.utils.config import Settings
+from pims_plugin_format_openslide.utils.sidecar import (
+    add_sidecar_tiers, find_gaps, sidecar_path, write_pyramid
+)
+
+STORED = [(4096, 4096), (1024, 1024), (64, 64)]
+
+
+def _settings():
+    return Settings(sparse_pyramid_sidecar=True)
+
+
+def _pyramid():
+    pyramid = Pyramid()
+    for level, (width, height) in enumerate(STORED):
+        pyramid.insert_tier(width, height, (256, 256), openslide_level=level)
+    return pyramid
+
+
+def test_find_gaps():
+    assert find_gaps([1, 4, 64], 4.0) == [1]
+    assert find_gaps([1, 4, 16], 4.0) == []
+    assert find_gaps([1, 2, 8, 64], 2.0) == [1, 2]
+
+
+def test_missing_sidecar_is_scheduled(tmp_path, monkeypatch):
+    monkeypatch.setattr(sidecar, 'get_settings', _settings)
+    scheduled = []
+    monkeypatch.setattr(
+        sidecar, 'schedule_sidecar_build', lambda *args: scheduled.append(args)
+    )
+    slide = tmp_path / "slide.svs"
+    pyramid = add_sidecar_tiers(SimpleNamespace(path=slide), _pyramid(), STORED)
+
+    assert pyramid.n_levels == 3
+    assert scheduled == [(slide, 1, sidecar_path(slide, 1))]
+
+
+def test_sidecar_tiers(tmp_path, monkeypatch):
+    monkeypatch.setattr(sidecar, 'get_settings', _settings)
+    slide = tmp_path / "slide.svs"
+    dest = sidecar_path(slide, 1)
+    # Level 1 downsampled by 2, as built by `build_sidecar`.
+    write_pyramid(VIPSImage.black(512, 512, bands=3), dest, 64, 90)
+
+    format = SimpleNamespace(path=slide)
+    pyramid = add_sidecar_tiers(format, _pyramid(), STORED)
+
+    # Sidecar tiers smaller than 2x the next stored level are not used.
+    assert [tier.width for tier in pyramid.tiers] == [4096, 1024, 512, 256, 128, 64]
+    synthetic = pyramid.tiers[2:5]
+    assert [tier.data['sidecar_page'] for tier in synthetic] == [0, 1, 2]
+    assert all(tier.data['sidecar_path'] == str(dest) for tier in synthetic)
+    assert pyramid.tiers[5].data['openslide_level'] == 2
+
+    opened = []
+    monkeypatch.setattr(
+        engine, 'cached_vips_openslide_file',
+        lambda format, level=None: opened.append(level)
+    )
+    reader = engine.OpenslideVipsReader(format)
+    assert reader._read_tier(pyramid.tiers[3]).width == 256
+    assert opened == []
+    reader._read_tier(pyramid.tiers[5])
+    assert opened == [2]
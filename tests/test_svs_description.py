@@ -0,0 +1,88 @@
+import json
+import random
+from pathlib import Path
+
+import pytest
+
+from pims_plugin_format_openslide.vendors.svs import (
+    APERIO_KNOWN_KEYS, parse_aperio_description, tokenize_aperio_description
+)
+
+CORPUS_PATH = Path(__file__).parent / "data" / "aperio_descriptions.json"
+
+
+@pytest.fixture
+def corpus():
+    with open(CORPUS_PATH) as f:
+        return json.load(f)
+
+
+def test_svs_description_header(corpus):
+    result = tokenize_aperio_description(corpus[0])
+    assert result['Aperio Image Library'] == 'v10.0.51'
+    assert result['Description'].startswith('46920x33014')
+
+
+def test_svs_description_known_keys(corpus):
+    result = parse_aperio_description(corpus[0], APERIO_KNOWN_KEYS)
+    assert result['MPP'] == 0.499
+    assert result['AppMag'] == 20
+    assert result['Date'] == '12/29/09'
+    assert result['Time'] == '09:59:15'
+    assert 'StripeWidth' not in result
+
+
+def test_svs_description_associated(corpus):
+    result = tokenize_aperio_description(corpus[3])
+    assert result['Description'] == 'label 387x463'
+
+
+def test_svs_description_malformed_items(corpus):
+    result = tokenize_aperio_description(corpus[7])
+    assert result['Title'] == 'Kidney | PAS'
+    assert result['Comment'] == 'stain = PAS'
+    assert result['Empty'] == ''
+    assert 'Malformed item' not in result
+    assert result['ScanScope ID'] == 'SS1302'
+
+
+def test_svs_description_unclosed_quote(corpus):
+    result = tokenize_aperio_description(corpus[9])
+    assert result['Comment'] == '"unclosed'
+    assert result['MPP'] == '0.25'
+    assert result['User'] == 'x'
+    assert result['Title'] == 'Liver'
+    assert parse_aperio_description(corpus[9], APERIO_KNOWN_KEYS)['MPP'] == 0.25
+
+
+def test_svs_description_duplicate_keys():
+    description = 'Aperio Image Library v11.2.1\n1000x1000|MPP = 0.25|AppMag = 20|MPP = 0.5'
+    assert tokenize_aperio_description(description)['MPP'] == '0.5'
+    assert parse_aperio_description(description, APERIO_KNOWN_KEYS)['MPP'] == 0.5
+
+
+def test_svs_description_invalid():
+    with pytest.raises(ValueError):
+        tokenize_aperio_description('Hamamatsu|MPP = 0.5')
+
+
+def test_svs_description_fuzz(corpus):
+    rng = random.Random(42)
+    alphabet = '|= "\n\r\\ab01.'
+    for _ in range(2000):
+        description = list(rng.choice(corpus))
+        for _ in range(rng.randint(1, 10)):
+            # Keep the 'Aperio ' prefix, so that the description is valid
+            position = rng.randint(len('Aperio '), len(description))
+            operation = rng.random()
+            if operation < 0.4:
+                description.insert(position, rng.choice(alphabet))
+            elif operation < 0.8 and position < len(description):
+                del description[position]
+            else:
+                description[position:position] = rng.choice(corpus)[7:40]
+        description = ''.join(description)
+
+        result = tokenize_aperio_description(description)
+        assert all(isinstance(v, str) for v in result.values())
+        parse_aperio_description(description, APERIO_KNOWN_KEYS)
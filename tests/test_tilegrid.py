@@ -0,0 +1,43 @@
+import pytest
+
+from pims_plugin_format_openslide.utils.tilegrid import (
+    DeepZoomGrid, native_tiles, parse_iiif_region, parse_iiif_size
+)
+
+
+def test_deepzoom_grid():
+    grid = DeepZoomGrid(1500, 1000, tile_size=254, overlap=1)
+    assert grid.level_count == 12
+    assert grid.level_dimensions[-1] == (1500, 1000)
+    assert grid.level_dimensions[0] == (1, 1)
+    assert grid.tile_count(11) == (6, 4)
+
+    assert grid.tile_window(11, 0, 0) == (0, 0, 255, 255)
+    assert grid.tile_window(11, 1, 1) == (253, 253, 256, 256)
+    assert grid.tile_window(11, 5, 3) == (1269, 761, 231, 239)
+    assert grid.base_window(10, 1, 0) == ((506, 0, 512, 510), (256, 255))
+
+    with pytest.raises(ValueError):
+        grid.tile_window(11, 6, 0)
+
+
+def test_iiif_parameters():
+    assert parse_iiif_region('full', 1500, 1000) == (0, 0, 1500, 1000)
+    assert parse_iiif_region('square', 1500, 1000) == (250, 0, 1000, 1000)
+    assert parse_iiif_region('1024,512,1024,1024', 1500, 1000) == (1024, 512, 476, 488)
+    assert parse_iiif_region('pct:10,10,50,50', 1500, 1000) == (150, 100, 750, 500)
+
+    assert parse_iiif_size('max', 1024, 512) == (1024, 512)
+    assert parse_iiif_size('256,', 1024, 512) == (256, 128)
+    assert parse_iiif_size(',256', 1024, 512) == (512, 256)
+    assert parse_iiif_size('!256,256', 1024, 512) == (256, 128)
+    assert parse_iiif_size('pct:50', 1024, 512) == (512, 256)
+
+    with pytest.raises(ValueError):
+        parse_iiif_size('abc', 1024, 512)
+
+
+def test_native_tiles():
+    cols, rows = native_tiles((100, 200, 500, 300), 240, 240)
+    assert list(cols) == [0, 1, 2]
+    assert list(rows) == [0, 1, 2]
@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from pims_plugin_format_openslide.vendors.vms import (
+    FileHandlePool, VMSIndex, read_intervals, vms_index_path
+)
+
+
+def make_vms(directory, opt=False):
+    rng = np.random.default_rng(0)
+    arrays = dict()
+    for col in range(2):
+        for row in range(2):
+            array = (rng.random((100, 160, 3)) * 255).astype(np.uint8)
+            options = dict(restart_marker_rows=1) if opt \
+                else dict(restart_marker_blocks=2)
+            Image.fromarray(array).save(
+                directory / f"{col}{row}.jpg", quality=95, subsampling=0,
+                **options
+            )
+            arrays[(col, row)] = np.asarray(Image.open(directory / f"{col}{row}.jpg"))
+    lines = ["[Virtual Microscope Specimen]", "ImageFile=00.jpg",
+             "ImageFile(1,0)=10.jpg", "ImageFile(0,1)=01.jpg", "ImageFile(1,1)=11.jpg"]
+    if opt:
+        lines.append("OptimisationFile=slide.opt")
+    (directory / "slide.vms").write_text("\n".join(lines) + "\n")
+    return directory / "slide.vms", arrays
+
+
+def test_index_decodes_windows_from_restart_intervals(tmp_path):
+    vms_path, arrays = make_vms(tmp_path)
+    index = VMSIndex.build(vms_path)
+    assert (index.width, index.height) == (320, 200)
+    assert len(index.starts[0]) == 10 * 13 + 1  # 8x8 MCUs, 2 per interval
+
+    i, window, position = next(index.locate(170, 120, 50, 30))
+    assert index.files[i] == "11.jpg" and window == (10, 20, 50, 30)
+    decoded = read_intervals(index, tmp_path, i, window).numpy()
+    assert np.array_equal(decoded, arrays[(1, 1)][20:50, 10:60])
+
+    index.save(vms_index_path(vms_path), vms_path)
+    loaded = VMSIndex.load(vms_index_path(vms_path), vms_path)
+    assert all(np.array_equal(a, b) for a, b in zip(index.starts, loaded.starts))
+    (tmp_path / "00.jpg").write_bytes(b"")
+    assert VMSIndex.load(vms_index_path(vms_path), vms_path) is None
+
+
+def test_index_uses_optimisation_file(tmp_path):
+    vms_path, _ = make_vms(tmp_path, opt=True)
+    (tmp_path / "slide.opt").write_bytes(b"")
+    scanned = VMSIndex.build(vms_path)
+
+    records = np.zeros((sum(len(s) - 1 for s in scanned.starts), 40), np.uint8)
+    offsets = np.concatenate([s[:-1] for s in scanned.starts])
+    records[:, :8] = offsets.astype('<i8').view(np.uint8).reshape(-1, 8)
+    (tmp_path / "slide.opt").write_bytes(records.tobytes())
+    index = VMSIndex.build(vms_path)
+    assert all(np.array_equal(a, b) for a, b in zip(index.starts, scanned.starts))
+
+    # Invalid offsets are ignored
+    records[1:, :8] = 0
+    (tmp_path / "slide.opt").write_bytes(records.tobytes())
+    index = VMSIndex.build(vms_path)
+    assert all(np.array_equal(a, b) for a, b in zip(index.starts, scanned.starts))
+
+
+def test_file_handle_pool(tmp_path):
+    pool = FileHandlePool(max_handles=1)
+    (tmp_path / "a").write_bytes(b"a")
+    (tmp_path / "b").write_bytes(b"b")
+    with pool.open(str(tmp_path / "a")) as fd:
+        with pool.open(str(tmp_path / "b")):
+            pass
+        # Evicted while in use, still readable
+        assert os.pread(fd, 1, 0) == b"a"
+    assert len(pool._fds) == 1 and not pool._evicted